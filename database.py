@@ -1,13 +1,34 @@
 import os
 
+import bisect
+import contextlib
+import functools
+import io
+import itertools
 import json
+import mmap
+import multiprocessing
+import operator
+import pickle
 import re
 import shutil
-from typing import List, Union, Type, Tuple
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Union, Type, Tuple, Callable, BinaryIO
 
 from datetime import datetime
 import pathvalidate
 
+_temp_suffix = '.tmp'
+_parse_cache_size = 1 << 16
+_versions = itertools.count(1)
+
 
 def assert_exists(path: str) -> None:
     if not os.path.exists(path):
@@ -24,46 +45,261 @@ def assert_is_file(path: str) -> None:
         raise ValueError('Path {} does not point to a file'.format(path))
 
 
+def sync_directory(path: str) -> None:
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def write_atomically(path: str, write: Callable[[BinaryIO], None]) -> None:
+    temp_path = path + _temp_suffix
+    try:
+        with open(temp_path, 'wb') as write_stream:
+            write(write_stream)
+            write_stream.flush()
+            os.fsync(write_stream.fileno())
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+    sync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+class ReadWriteLock:
+    def __init__(self) -> None:
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = dict()
+        self._writer = None
+        self._writes = 0
+        self._waiting_writers = 0
+
+    def held(self) -> bool:
+        me = threading.get_ident()
+        return self._writer == me or me in self._readers
+
+    def acquire_read(self) -> None:
+        me = threading.get_ident()
+        with self._condition:
+            # a thread already inside the lock must not wait behind queued writers
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._condition.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def release_read(self) -> None:
+        me = threading.get_ident()
+        with self._condition:
+            count = self._readers.pop(me) - 1
+            if count:
+                self._readers[me] = count
+            else:
+                self._condition.notify_all()
+
+    def acquire_write(self) -> None:
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writes += 1
+                return
+            if me in self._readers:
+                raise ValueError('Cannot upgrade a read lock to a write lock')
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writes = 1
+
+    def release_write(self) -> None:
+        with self._condition:
+            self._writes -= 1
+            if not self._writes:
+                self._writer = None
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+def _reading(method):
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.lock.read():
+            return method(self, *args, **kwargs)
+    return locked
+
+
+def _writing(method):
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._write_lock():
+            result = method(self, *args, **kwargs)
+        self._written()
+        return result
+    return locked
+
+
 class Char:
-    def __init__(self, value: str) -> None:
+    __slots__ = ('_value',)
+
+    interned_limit = 256
+    _interned = dict()
+
+    def __new__(cls, value: str):
+        result = Char._interned.get(value) if type(value) == str else None
+        if result is not None:
+            return result
         if not type(value) == str or not len(value) == 1:
             raise ValueError('Invalid char: {}'.format(value))
-        self.value = value
+        result = super().__new__(cls)
+        result._value = value
+        if ord(value) < Char.interned_limit:
+            Char._interned[value] = result
+        return result
+
+    @property
+    def value(self) -> str:
+        return self._value
+
+    def __reduce__(self):
+        return Char, (self._value,)
 
     def __str__(self) -> str:
-        return self.value
+        return self._value
 
     def __eq__(self, o: object) -> bool:
         if isinstance(o, Char):
-            return self.value == o.value
+            return self._value == o._value
         return False
 
+    def __lt__(self, o: object) -> bool:
+        if isinstance(o, Char):
+            return self._value < o._value
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self._value)
+
 
 class Time:
+    __slots__ = ('_seconds',)
+
     time_format = '%H:%M:%S'
 
+    _pattern = re.compile(r'(2[0-3]|[0-1]\d|\d):([0-5]\d|\d):([0-5]\d|\d)')
+
     def __init__(self, time: str) -> None:
-        self.time = Time.parse_time(time)
+        self._seconds = Time.parse_seconds(time)
 
     @staticmethod
     def parse_time(time: str):
         return datetime.strptime(time, Time.time_format)
 
+    @staticmethod
+    def parse_seconds(time: str) -> int:
+        if type(time) == str:
+            return Time._parse_seconds(time)
+        return Time.seconds_of_day(Time.parse_time(time))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=_parse_cache_size)
+    def _parse_seconds(time: str) -> int:
+        match = Time._pattern.fullmatch(time)
+        if match is None:
+            # strptime accepts the same strings and raises the errors callers rely on
+            return Time.seconds_of_day(Time.parse_time(time))
+        hours, minutes, seconds = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+    @staticmethod
+    def format_seconds(seconds: int) -> str:
+        return '{:02d}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+    @classmethod
+    def from_seconds(cls, seconds: int):
+        result = cls.__new__(cls)
+        result._seconds = seconds
+        return result
+
+    @property
+    def seconds(self) -> int:
+        return self._seconds
+
+    @property
+    def time(self) -> datetime:
+        return Time.time_of_day(self._seconds)
+
+    @staticmethod
+    def seconds_of_day(time: datetime) -> int:
+        return time.hour * 3600 + time.minute * 60 + time.second
+
+    @staticmethod
+    def time_of_day(seconds: int) -> datetime:
+        return datetime(1900, 1, 1, seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+    def __reduce__(self):
+        return Time.from_seconds, (self._seconds,)
+
     def __str__(self) -> str:
-        return self.time.strftime(Time.time_format)
+        return Time.format_seconds(self._seconds)
 
     def __eq__(self, o: object) -> bool:
         if isinstance(o, Time):
-            return self.time == o.time
+            return self._seconds == o._seconds
         return False
 
+    def __lt__(self, o: object) -> bool:
+        if isinstance(o, Time):
+            return self._seconds < o._seconds
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self._seconds)
+
 
 class Color:
+    __slots__ = ('_color',)
+
     def __init__(self, color: str) -> None:
-        self.color = Color.parse_color(color)
+        self._color = Color.parse_color(color)
+
+    @classmethod
+    def from_int(cls, color: int):
+        result = cls.__new__(cls)
+        result._color = color
+        return result
+
+    @property
+    def color(self) -> int:
+        return self._color
 
     @staticmethod
     def parse_color(color: str):
+        if type(color) == str:
+            return Color._parse_color(color)
+        return Color._parse_color.__wrapped__(color)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=_parse_cache_size)
+    def _parse_color(color: str):
         if not len(color) == 7:
             raise ValueError('Color {} format is not correct'.format(color))
 
@@ -74,59 +310,137 @@ class Color:
 
         return result
 
+    def __reduce__(self):
+        return Color.from_int, (self._color,)
+
     def __str__(self) -> str:
-        return Color.rgb_str(self.color)
+        return Color.rgb_str(self._color)
 
     @staticmethod
     def rgb_str(color: int):
-        hex_value = hex(color)[2:]
-        return '#{}{}'.format('0' * (6 - len(hex_value)), hex_value)
+        return '#{:06x}'.format(color)
 
     def __eq__(self, o: object) -> bool:
         if isinstance(o, Color):
-            return self.color == o.color
+            return self._color == o._color
         return False
 
+    def __lt__(self, o: object) -> bool:
+        if isinstance(o, Color):
+            return self._color < o._color
+        return NotImplemented
 
-class ColorInterval:
+    def __hash__(self) -> int:
+        return hash(self._color)
 
-    def __init__(self, value: List[str]) -> None:
+
+class ColorInterval:
+    __slots__ = ('_start', '_end')
+
+    def __init__(self, value: Union[str, List[str]]) -> None:
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except json.JSONDecodeError as e:
+                raise ValueError('Color interval {} format is not correct'.format(value)) from e
+        if not isinstance(value, (list, tuple)) or not len(value) == 2:
+            raise ValueError('Color interval {} format is not correct'.format(value))
         start = Color.parse_color(value[0])
         end = Color.parse_color(value[1])
         if start > end:
             raise ValueError('Start of the color interval {} is greater that its end {}'.format(start, end))
 
-        self.start = start
-        self.end = end
+        self._start = start
+        self._end = end
+
+    @classmethod
+    def from_ints(cls, start: int, end: int):
+        result = cls.__new__(cls)
+        result._start = start
+        result._end = end
+        return result
+
+    @property
+    def start(self) -> int:
+        return self._start
+
+    @property
+    def end(self) -> int:
+        return self._end
+
+    def __reduce__(self):
+        return ColorInterval.from_ints, (self._start, self._end)
 
     def __str__(self) -> str:
-        return json.dumps([Color.rgb_str(self.start), Color.rgb_str(self.end)])
+        return json.dumps([Color.rgb_str(self._start), Color.rgb_str(self._end)])
 
     def __eq__(self, o: object) -> bool:
         if isinstance(o, ColorInterval):
-            return self.start == o.start and self.end == o.end
+            return self._start == o._start and self._end == o._end
         return False
 
+    def __lt__(self, o: object) -> bool:
+        if isinstance(o, ColorInterval):
+            return (self._start, self._end) < (o._start, o._end)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((self._start, self._end))
+
 
 class TimeInterval:
-    def __init__(self, value: List[str]) -> None:
-        if not len(value) == 2:
+    __slots__ = ('_start', '_end')
+
+    def __init__(self, value: Union[str, List[str]]) -> None:
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except json.JSONDecodeError as e:
+                raise ValueError('Time interval should consist of 2 elements') from e
+        if not isinstance(value, (list, tuple)) or not len(value) == 2:
             raise ValueError('Time interval should consist of 2 elements')
-        start = datetime.strptime(value[0], Time.time_format)
-        end = datetime.strptime(value[1], Time.time_format)
+        start = Time.parse_seconds(value[0])
+        end = Time.parse_seconds(value[1])
         if start > end:
-            raise ValueError('Start {} of the time interval is after its end {}'.format(start, end))
-        self.start = start
-        self.end = end
+            raise ValueError('Start {} of the time interval is after its end {}'.format(Time.time_of_day(start),
+                                                                                      Time.time_of_day(end)))
+        self._start = start
+        self._end = end
+
+    @classmethod
+    def from_seconds(cls, start: int, end: int):
+        result = cls.__new__(cls)
+        result._start = start
+        result._end = end
+        return result
+
+    @property
+    def start(self) -> int:
+        return self._start
+
+    @property
+    def end(self) -> int:
+        return self._end
+
+    def __reduce__(self):
+        return TimeInterval.from_seconds, (self._start, self._end)
 
     def __str__(self) -> str:
-        return json.dumps([self.start.strftime(Time.time_format), self.end.strftime(Time.time_format)])
+        return '["{}", "{}"]'.format(Time.format_seconds(self._start), Time.format_seconds(self._end))
 
     def __eq__(self, o: object) -> bool:
         if isinstance(o, TimeInterval):
-            return self.start == o.start and self.end == o.end
+            return self._start == o._start and self._end == o._end
         return False
 
+    def __lt__(self, o: object) -> bool:
+        if isinstance(o, TimeInterval):
+            return (self._start, self._end) < (o._start, o._end)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((self._start, self._end))
+
 
 RowData = List[Union[int, float, str, Char, Color, ColorInterval, Time, TimeInterval]]
 ColumnsTypesStr = List[str]
@@ -158,11 +472,55 @@ class ColumnTypes:
         TimeInterval: 'timeinvl'
     }
 
+    _length_error = 'Length of row {} does not match number of columns in the table'
+    _compiled = dict()
+
     def __init__(self, types_list: ColumnsTypesList) -> None:
         for t in types_list:
             if t not in ColumnTypes.types_to_names:
                 raise ValueError('{} type is not supported'.format(t))
         self.types_list = types_list
+        self._convert, self._verify = ColumnTypes._compile(tuple(types_list))
+
+    @staticmethod
+    def _compile(types: tuple) -> Tuple[Callable, Callable]:
+        compiled = ColumnTypes._compiled.get(types)
+        if compiled is not None:
+            return compiled
+
+        namespace = {'length_error': ColumnTypes._length_error, 'invalid_type': ColumnTypes._invalid_type,
+                     'types': types}
+        names = list()
+        for i, column_type in enumerate(types):
+            if column_type in (int, float, str):
+                names.append(column_type.__name__)
+            else:
+                names.append(f'type_{i}')
+                namespace[f'type_{i}'] = column_type
+        values = ''.join(f'{name}(row[{i}]), ' for i, name in enumerate(names))
+        checks = ' and '.join(f'type(row[{i}]) is {name}' for i, name in enumerate(names)) or 'True'
+        source = f'''
+def convert(row):
+    if not len(row) == {len(types)}:
+        raise ValueError(length_error.format(row))
+    return [{values}]
+
+
+def verify(row):
+    if not len(row) == {len(types)}:
+        raise ValueError(length_error.format(row))
+    if not ({checks}):
+        invalid_type(row, types)
+'''
+        exec(source, namespace)
+        compiled = ColumnTypes._compiled[types] = (namespace['convert'], namespace['verify'])
+        return compiled
+
+    @staticmethod
+    def _invalid_type(row: RowData, types: tuple) -> None:
+        for i in range(len(row)):
+            if not type(row[i]) == types[i]:
+                raise ValueError(f'element {i} in row has invalid type {type(row[i])}; expected: {types[i]}')
 
     def to_json(self) -> ColumnsTypesStr:
         return list(map(lambda x: ColumnTypes.types_to_names[x], self.types_list))
@@ -177,26 +535,43 @@ class ColumnTypes:
         return cls(mapped_types)
 
     def convert(self, row: RowDataStr) -> RowData:
-        if not len(row) == len(self.types_list):
-            raise ValueError('Length of row {} does not match number of columns in the table'.format(row))
-
-        result = list()
-        for i in range(len(row)):
-            result.append(self.types_list[i](row[i]))
-
-        return result
+        return self._convert(row)
 
     def verify(self, row: RowData):
-        if not len(row) == len(self.types_list):
-            raise ValueError('Length of row {} does not match number of columns in the table'.format(row))
-
-        for i in range(len(row)):
-            if not type(row[i]) == self.types_list[i]:
-                raise ValueError(f'element {i} in row has invalid type {type(row[i])}; expected: {self.types_list[i]}')
+        self._verify(row)
+
+    def convert_rows(self, rows: List[RowDataStr]) -> List[RowData]:
+        for row in rows:
+            if not len(row) == len(self.types_list):
+                raise ValueError(ColumnTypes._length_error.format(row))
+        if not self.types_list:
+            return [list() for _ in rows]
+        columns = [self.convert_column_values(column_index, [row[column_index] for row in rows])
+                   for column_index in range(len(self.types_list))]
+        return [list(row) for row in zip(*columns)]
+
+    def verify_rows(self, rows: List[RowData]) -> None:
+        verify = self._verify
+        for row in rows:
+            verify(row)
 
     def convert_column(self, column_index: int, value: str):
         return self.types_list[column_index](value)
 
+    def convert_column_values(self, column_index: int, values: RowDataStr) -> list:
+        column_type = self.types_list[column_index]
+        converted = dict()
+        result = list()
+        for value in values:
+            if not type(value) == str:
+                result.append(column_type(value))
+                continue
+            item = converted.get(value)
+            if item is None:
+                item = converted[value] = column_type(value)
+            result.append(item)
+        return result
+
     def __eq__(self, o: object) -> bool:
         if isinstance(o, ColumnTypes):
             return self.types_list == o.types_list
@@ -207,6 +582,8 @@ class ColumnTypes:
 
 
 class TableRow:
+    __slots__ = ('id', 'data')
+
     id_field = 'id'
     data_field = 'data'
 
@@ -235,20 +612,987 @@ class TableRow:
         return json.dumps(self.to_json(), indent=4)
 
 
+class RowStorage:
+    compaction_min_tombstones = 1024
+    mapped = False
+
+    def __init__(self, columns_types: ColumnTypes) -> None:
+        self._positions = dict()
+        self._tombstones = 0
+        self._rows = list()
+
+    @classmethod
+    def from_rows(cls, columns_types: ColumnTypes, rows):
+        result = cls(columns_types)
+        for row in rows:
+            result.append(row)
+        return result
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, row_id: int) -> bool:
+        return row_id in self._positions
+
+    def __iter__(self):
+        return (row for row in self._rows if row is not None)
+
+    def get(self, row_id: int) -> TableRow:
+        return self._rows[self._positions[row_id]]
+
+    def append(self, table_row: TableRow) -> None:
+        self._positions[table_row.id] = len(self._rows)
+        self._rows.append(table_row)
+
+    def pop(self) -> TableRow:
+        result = self._rows.pop()
+        del self._positions[result.id]
+        return result
+
+    def copy(self):
+        result = object.__new__(type(self))
+        result.__dict__.update(self.__dict__)
+        result._rows = list(self._rows)
+        result._positions = dict(self._positions)
+        return result
+
+    def set_value(self, row_id: int, column_index: int, value) -> None:
+        position = self._positions[row_id]
+        row = self._rows[position]
+        data = list(row.data)
+        data[column_index] = value
+        self._rows[position] = TableRow(row.id, data)
+
+    def remove(self, row_id: int) -> TableRow:
+        position = self._positions.pop(row_id)
+        result = self._detach(position)
+        self._tombstones += 1
+        if self._tombstones > self.compaction_min_tombstones and 2 * self._tombstones > self._slots():
+            self._compact()
+        return result
+
+    def restore(self, table_row: TableRow) -> None:
+        rows = self._rows
+        position = self._slot_position(table_row.id)
+        if position < len(rows) and rows[position] is None:
+            # the tombstone left behind by the removal takes the row back without moving others
+            rows[position] = table_row
+            self._positions[table_row.id] = position
+            self._tombstones -= 1
+            return
+        rows.insert(position, table_row)
+        self._positions.update((rows[i].id, i) for i in range(position, len(rows)) if rows[i] is not None)
+
+    def column_values(self, column_index: int) -> list:
+        return [row.data[column_index] for row in self]
+
+    def ids(self) -> List[int]:
+        return [row.id for row in self]
+
+    def rows_after(self, after_id: Union[int, None], limit: Union[int, None]) -> List[TableRow]:
+        rows = self._rows
+        position = 0
+        if after_id is not None:
+            position = self._positions.get(after_id)
+            if position is None:
+                position = self._slot_position(after_id)
+            else:
+                position += 1
+        result = list()
+        while position < len(rows) and (limit is None or len(result) < limit):
+            end = len(rows) if limit is None else position + limit - len(result)
+            result.extend(row for row in rows[position:end] if row is not None)
+            position = end
+        return result
+
+    def _slot_position(self, row_id: int) -> int:
+        # first slot holding a larger id; bisect's key argument needs Python 3.10
+        low, high = 0, len(self._rows)
+        while low < high:
+            middle = (low + high) // 2
+            if row_id < self._slot_id(middle):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _slot_id(self, position: int) -> int:
+        rows = self._rows
+        while position < len(rows):
+            if rows[position] is not None:
+                return rows[position].id
+            position += 1
+        return sys.maxsize
+
+    def project(self, row_id: int, column_indexes: List[int]) -> RowData:
+        data = self.get(row_id).data
+        return [data[column_index] for column_index in column_indexes]
+
+    def _detach(self, position: int) -> TableRow:
+        result = self._rows[position]
+        self._rows[position] = None
+        return result
+
+    def _slots(self) -> int:
+        return len(self._rows)
+
+    def _compact(self) -> None:
+        self._rows = list(self)
+        self._positions = {row.id: position for position, row in enumerate(self._rows)}
+        self._tombstones = 0
+
+
+def _map_array(section: memoryview, typecode: str, swap: bool):
+    if not swap:
+        return section.cast(typecode)
+    result = array(typecode)
+    result.frombytes(section)
+    result.byteswap()
+    return result
+
+
+def _own_array(values, typecode: str) -> array:
+    if isinstance(values, array):
+        return values
+    result = array(typecode)
+    result.frombytes(values.cast('B'))
+    return result
+
+
+class _ArrayColumn:
+    encoding = None
+
+    def __init__(self, typecode: str, encode=None, decode=None) -> None:
+        self.typecode = typecode
+        self.values = array(typecode)
+        self._encode = encode
+        self._decode = decode
+
+    def append(self, value) -> None:
+        self.values.append(value if self._encode is None else self._encode(value))
+
+    def pop(self) -> None:
+        self.values.pop()
+
+    def get(self, position: int):
+        value = self.values[position]
+        return value if self._decode is None else self._decode(value)
+
+    def set(self, position: int, value) -> None:
+        self.values[position] = value if self._encode is None else self._encode(value)
+
+    def copy(self):
+        result = _ArrayColumn(self.typecode, self._encode, self._decode)
+        result.values = self.values[:]
+        return result
+
+    def compact(self, positions: List[int]) -> None:
+        values = self.values
+        self.values = array(self.typecode, [values[position] for position in positions])
+
+    def sections(self) -> list:
+        return [self.values]
+
+    def map(self, sections: List[memoryview], swap: bool) -> None:
+        self.values = _map_array(sections[0], self.typecode, swap)
+
+    def materialize(self) -> None:
+        self.values = _own_array(self.values, self.typecode)
+
+    def statistics(self) -> tuple:
+        return min(self.values), max(self.values)
+
+    def decode(self, value):
+        return value if self._decode is None else self._decode(value)
+
+
+class _IntervalColumn:
+    encoding = None
+
+    def __init__(self, typecode: str, encode, decode) -> None:
+        self.typecode = typecode
+        self.starts = array(typecode)
+        self.ends = array(typecode)
+        self._encode = encode
+        self._decode = decode
+
+    def append(self, value) -> None:
+        start, end = self._encode(value)
+        self.starts.append(start)
+        try:
+            self.ends.append(end)
+        except Exception:
+            self.starts.pop()
+            raise
+
+    def pop(self) -> None:
+        self.starts.pop()
+        self.ends.pop()
+
+    def get(self, position: int):
+        return self._decode(self.starts[position], self.ends[position])
+
+    def set(self, position: int, value) -> None:
+        start, end = self._encode(value)
+        previous_start = self.starts[position]
+        self.starts[position] = start
+        try:
+            self.ends[position] = end
+        except Exception:
+            self.starts[position] = previous_start
+            raise
+
+    def copy(self):
+        result = _IntervalColumn(self.typecode, self._encode, self._decode)
+        result.starts = self.starts[:]
+        result.ends = self.ends[:]
+        return result
+
+    def compact(self, positions: List[int]) -> None:
+        starts, ends = self.starts, self.ends
+        self.starts = array(self.typecode, [starts[position] for position in positions])
+        self.ends = array(self.typecode, [ends[position] for position in positions])
+
+    def sections(self) -> list:
+        return [self.starts, self.ends]
+
+    def map(self, sections: List[memoryview], swap: bool) -> None:
+        self.starts = _map_array(sections[0], self.typecode, swap)
+        self.ends = _map_array(sections[1], self.typecode, swap)
+
+    def materialize(self) -> None:
+        self.starts = _own_array(self.starts, self.typecode)
+        self.ends = _own_array(self.ends, self.typecode)
+
+    def statistics(self) -> tuple:
+        return min(self.starts), max(self.ends)
+
+
+class _StringColumn:
+    encoding = None
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.starts = array('q')
+        self.ends = array('q')
+        self._contiguous = True
+
+    def append(self, value: str) -> None:
+        encoded = value.encode('utf-8', 'surrogatepass')
+        self.starts.append(len(self.buffer))
+        self.buffer.extend(encoded)
+        self.ends.append(len(self.buffer))
+
+    def pop(self) -> None:
+        start = self.starts.pop()
+        if self.ends.pop() == len(self.buffer):
+            del self.buffer[start:]
+
+    def get(self, position: int) -> str:
+        return str(self.buffer[self.starts[position]:self.ends[position]], 'utf-8', 'surrogatepass')
+
+    def set(self, position: int, value: str) -> None:
+        encoded = value.encode('utf-8', 'surrogatepass')
+        self.starts[position] = len(self.buffer)
+        self.buffer.extend(encoded)
+        self.ends[position] = len(self.buffer)
+        self._contiguous = False
+
+    def copy(self):
+        result = type(self)()
+        result.buffer = self.buffer[:]
+        result.starts = self.starts[:]
+        result.ends = self.ends[:]
+        result._contiguous = self._contiguous
+        return result
+
+    def compact(self, positions: List[int]) -> None:
+        buffer = bytearray()
+        starts = array('q')
+        ends = array('q')
+        for position in positions:
+            starts.append(len(buffer))
+            buffer.extend(self.buffer[self.starts[position]:self.ends[position]])
+            ends.append(len(buffer))
+        self.buffer, self.starts, self.ends = buffer, starts, ends
+        self._contiguous = True
+
+    def sections(self) -> list:
+        if not self._contiguous:
+            column = self.copy()
+            column.compact(range(len(column.starts)))
+            return column.sections()
+        offsets = array('q')
+        offsets.frombytes(memoryview(self.starts).cast('B'))
+        offsets.append(len(self.buffer))
+        return [offsets, self.buffer]
+
+    def map(self, sections: List[memoryview], swap: bool) -> None:
+        offsets = _map_array(sections[0], 'q', swap)
+        self.starts = offsets[:-1]
+        self.ends = offsets[1:]
+        self.buffer = sections[1]
+        self._contiguous = True
+
+    def materialize(self) -> None:
+        self.starts = _own_array(self.starts, 'q')
+        self.ends = _own_array(self.ends, 'q')
+        self.buffer = bytearray(self.buffer)
+
+
+class _DecimalColumn(_StringColumn):
+    encoding = 'decimal'
+
+    @classmethod
+    def from_values(cls, values):
+        result = cls()
+        for value in values:
+            result.append(value)
+        return result
+
+    def append(self, value: int) -> None:
+        super().append(str(value))
+
+    def get(self, position: int) -> int:
+        return int(super().get(position))
+
+    def set(self, position: int, value: int) -> None:
+        super().set(position, str(value))
+
+    def statistics(self) -> tuple:
+        values = [self.get(position) for position in range(len(self.starts))]
+        return min(values), max(values)
+
+    def decode(self, value):
+        return value
+
+
+class ColumnarStorage(RowStorage):
+    wide_ints = False
+    _column_factories = {
+        int: lambda: _ArrayColumn('q'),
+        float: lambda: _ArrayColumn('d'),
+        str: _StringColumn,
+        Char: lambda: _ArrayColumn('I', lambda char: ord(char.value), lambda code: Char(chr(code))),
+        Color: lambda: _ArrayColumn('I', lambda color: color.color, Color.from_int),
+        ColorInterval: lambda: _IntervalColumn('I', lambda interval: (interval.start, interval.end),
+                                               ColorInterval.from_ints),
+        Time: lambda: _ArrayColumn('i', lambda time: time.seconds, Time.from_seconds),
+        TimeInterval: lambda: _IntervalColumn('i', lambda interval: (interval.start, interval.end),
+                                              TimeInterval.from_seconds)
+    }
+
+    def __init__(self, columns_types: ColumnTypes) -> None:
+        super().__init__(columns_types)
+        self._ids = array('q')
+        self._live = bytearray()
+        self._types = columns_types.types_list
+        self._columns = [ColumnarStorage._column_factories[t]() for t in columns_types.types_list]
+
+    @classmethod
+    def from_sections(cls, columns_types: ColumnTypes, ids: memoryview, columns: List[List[memoryview]],
+                      swap: bool = False, encodings: list = None):
+        result = cls(columns_types)
+        result._ids = _map_array(ids, 'q', swap)
+        result._live = bytearray(b'\x01') * len(result._ids)
+        result._position_map = None
+        for column_index, encoding in enumerate(encodings or ()):
+            if encoding == _DecimalColumn.encoding:
+                result._columns[column_index] = _DecimalColumn()
+                result.wide_ints = True
+        for column, sections in zip(result._columns, columns):
+            column.map(sections, swap)
+        result.mapped = True
+        if swap:
+            result.materialize()
+        return result
+
+    @property
+    def _positions(self) -> dict:
+        if self._position_map is None:
+            live = self._live
+            self._position_map = {row_id: position for position, row_id in enumerate(self._ids) if live[position]}
+        return self._position_map
+
+    @_positions.setter
+    def _positions(self, positions: dict) -> None:
+        self._position_map = positions
+
+    def __len__(self) -> int:
+        return len(self._ids) - self._tombstones
+
+    def __iter__(self):
+        return (self._row(position) for position, live in enumerate(self._live) if live)
+
+    def get(self, row_id: int) -> TableRow:
+        return self._row(self._positions[row_id])
+
+    def _row(self, position: int) -> TableRow:
+        # rows are decoded while the caller holds the table lock, never later from a storage that moved on
+        return TableRow(self._ids[position], [column.get(position) for column in self._columns])
+
+    def row_data(self, row_id: int) -> RowData:
+        position = self._positions[row_id]
+        return [column.get(position) for column in self._columns]
+
+    def append(self, table_row: TableRow) -> None:
+        appended = 0
+        try:
+            for column, value in zip(self._columns, table_row.data):
+                column.append(value)
+                appended += 1
+        except (OverflowError, TypeError) as e:
+            for column in self._columns[:appended]:
+                column.pop()
+            if isinstance(e, OverflowError) and self._widen(appended):
+                return self.append(table_row)
+            raise ValueError(f'Row {table_row} cannot be stored in a columnar table') from e
+
+        self._positions[table_row.id] = len(self._ids)
+        self._ids.append(table_row.id)
+        self._live.append(1)
+
+    def pop(self) -> TableRow:
+        result = self._row(len(self._ids) - 1)
+        for column in self._columns:
+            column.pop()
+        del self._positions[result.id]
+        self._ids.pop()
+        self._live.pop()
+        return result
+
+    def set_value(self, row_id: int, column_index: int, value) -> None:
+        try:
+            self._columns[column_index].set(self._positions[row_id], value)
+        except (OverflowError, TypeError) as e:
+            if isinstance(e, OverflowError) and self._widen(column_index):
+                return self.set_value(row_id, column_index, value)
+            raise ValueError(f'Value {value} cannot be stored in a columnar table') from e
+
+    def restore(self, table_row: TableRow) -> None:
+        position = bisect.bisect_right(self._ids, table_row.id) - 1
+        if position < 0 or not self._ids[position] == table_row.id or self._live[position]:
+            rows = [TableRow(row_id, self.row_data(row_id)) for row_id in self.ids()]
+            rows.insert(bisect.bisect_right([row.id for row in rows], table_row.id), table_row)
+            self._ids = array('q')
+            self._live = bytearray()
+            self._positions = dict()
+            self._tombstones = 0
+            self._columns = [ColumnarStorage._column_factories[t]() for t in self._types]
+            self.mapped = False
+            for row in rows:
+                self.append(row)
+            return
+        for column, value in zip(self._columns, table_row.data):
+            column.set(position, value)
+        self._live[position] = 1
+        self._positions[table_row.id] = position
+        self._tombstones -= 1
+
+    def _widen(self, column_index: int) -> bool:
+        column = self._columns[column_index]
+        if not self.wide_ints or self._types[column_index] is not int or isinstance(column, _DecimalColumn):
+            return False
+        # ints outside int64 switch the column to decimal text instead of being rejected
+        self._columns[column_index] = _DecimalColumn.from_values(column.values)
+        return True
+
+    def encodings(self) -> list:
+        return [column.encoding for column in self._columns]
+
+    def column_values(self, column_index: int) -> list:
+        column = self._columns[column_index]
+        return [column.get(position) for position, live in enumerate(self._live) if live]
+
+    def ids(self) -> List[int]:
+        ids = self._ids
+        return [ids[position] for position, live in enumerate(self._live) if live]
+
+    def rows_after(self, after_id: Union[int, None], limit: Union[int, None]) -> List[TableRow]:
+        ids = self._ids
+        live = self._live
+        position = 0 if after_id is None else bisect.bisect_right(ids, after_id)
+        result = list()
+        while position < len(ids) and (limit is None or len(result) < limit):
+            if live[position]:
+                result.append(self._row(position))
+            position += 1
+        return result
+
+    def project(self, row_id: int, column_indexes: List[int]) -> RowData:
+        position = self._positions[row_id]
+        return [self._columns[column_index].get(position) for column_index in column_indexes]
+
+    def materialize(self) -> None:
+        self._ids = _own_array(self._ids, 'q')
+        for column in self._columns:
+            column.materialize()
+        self.mapped = False
+
+    def copy(self):
+        result = object.__new__(type(self))
+        result.__dict__.update(self.__dict__)
+        # slicing copies owned arrays and keeps mapped sections as views
+        result._ids = self._ids[:]
+        result._live = bytearray(self._live)
+        result._position_map = None
+        result._columns = [column.copy() for column in self._columns]
+        return result
+
+    def sections(self) -> Tuple[array, List[list]]:
+        if self._tombstones:
+            storage = self.copy()
+            storage._compact()
+            return storage.sections()
+        return self._ids, [column.sections() for column in self._columns]
+
+    def statistics(self, column_index: int):
+        if not len(self._ids):
+            return None
+        return self._columns[column_index].statistics()
+
+    def decode_statistic(self, column_index: int, value):
+        return self._columns[column_index].decode(value)
+
+    def _detach(self, position: int) -> TableRow:
+        result = self._row(position)
+        self._live[position] = 0
+        return result
+
+    def _slots(self) -> int:
+        return len(self._ids)
+
+    def _compact(self) -> None:
+        positions = [position for position, live in enumerate(self._live) if live]
+        for column in self._columns:
+            column.compact(positions)
+        self._ids = array('q', [self._ids[position] for position in positions])
+        self._live = bytearray(b'\x01') * len(positions)
+        self._positions = {row_id: position for position, row_id in enumerate(self._ids)}
+        self._tombstones = 0
+        self.mapped = False
+
+
+class ColumnarSpill:
+    chunk_size = 1 << 16
+
+    # builds a mapped columnar storage batch by batch, so a table larger than memory never has to be held
+    def __init__(self, columns_types: ColumnTypes, wide_ints: bool = False, directory: str = None) -> None:
+        self._columns_types = columns_types
+        self._wide_ints = wide_ints
+        self._directory = directory
+        self._ids = None
+        self._files = None
+        self._encodings = None
+        self._buffer_lengths = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._ids is not None:
+            self._ids.close()
+            for files in self._files:
+                for file in files:
+                    file.close()
+
+    def append(self, rows: List[TableRow]) -> None:
+        storage = ColumnarStorage(self._columns_types)
+        storage.wide_ints = self._wide_ints
+        for row in rows:
+            storage.append(row)
+        if self._ids is None:
+            self._ids = self._temporary()
+            self._files = [[self._temporary() for _ in column.sections()] for column in storage._columns]
+            self._encodings = storage.encodings()
+            self._buffer_lengths = [0 if isinstance(column, _StringColumn) else None for column in storage._columns]
+        self._ids.write(storage._ids)
+        for column_index, column in enumerate(storage._columns):
+            self._append_column(column_index, column)
+
+    def storage(self) -> Union[ColumnarStorage, None]:
+        if self._ids is None:
+            return None
+        # the sections are copied into one unnamed file, the mapping keeps it alive
+        with self._temporary() as write_stream:
+            ids = self._copy(self._ids, write_stream)
+            columns = list()
+            for files, buffer_length in zip(self._files, self._buffer_lengths):
+                if buffer_length is not None:
+                    files[0].write(array('q', [buffer_length]))
+                columns.append([self._copy(file, write_stream) for file in files])
+            write_stream.flush()
+            view = memoryview(mmap.mmap(write_stream.fileno(), 0, access=mmap.ACCESS_READ))
+
+        def section(location):
+            return view[location[0]:location[0] + location[1]]
+
+        return ColumnarStorage.from_sections(self._columns_types, section(ids),
+                                             [[section(location) for location in locations] for locations in columns],
+                                             False, self._encodings)
+
+    def _temporary(self):
+        return tempfile.TemporaryFile(suffix=_temp_suffix, dir=self._directory)
+
+    @staticmethod
+    def _copy(read_stream: BinaryIO, write_stream: BinaryIO) -> Tuple[int, int]:
+        return BinaryFormat._copy_section(read_stream, write_stream, (0, read_stream.tell()))
+
+    def _append_column(self, column_index: int, column) -> None:
+        if not column.encoding == self._encodings[column_index]:
+            if column.encoding is None:
+                column = _DecimalColumn.from_values(column.values)
+            else:
+                self._widen(column_index)
+        files = self._files[column_index]
+        if self._buffer_lengths[column_index] is None:
+            for file, section in zip(files, column.sections()):
+                file.write(section)
+            return
+        offsets, buffer = column.sections()
+        base = self._buffer_lengths[column_index]
+        files[0].write(array('q', [offset + base for offset in offsets[:-1]]))
+        files[1].write(buffer)
+        self._buffer_lengths[column_index] = base + len(buffer)
+
+    def _widen(self, column_index: int) -> None:
+        # a batch with an int outside int64 switches the column to decimal text, earlier batches included
+        values = self._files[column_index][0]
+        self._files[column_index] = [self._temporary(), self._temporary()]
+        self._encodings[column_index] = _DecimalColumn.encoding
+        self._buffer_lengths[column_index] = 0
+        with values:
+            values.seek(0)
+            while True:
+                chunk = array('q', values.read(ColumnarSpill.chunk_size))
+                if not chunk:
+                    break
+                self._append_column(column_index, _DecimalColumn.from_values(chunk))
+
+
+class HashIndex:
+    kind = 'hash'
+    types = None
+
+    def __init__(self, column_index: int) -> None:
+        self.column_index = column_index
+        self._buckets = None
+
+    @property
+    def built(self) -> bool:
+        return self._buckets is not None
+
+    def build(self, ids: List[int], values: list) -> None:
+        buckets = dict()
+        for row_id, value in zip(ids, values):
+            bucket = buckets.get(value)
+            if bucket is None:
+                buckets[value] = {row_id}
+            else:
+                bucket.add(row_id)
+        self._buckets = buckets
+
+    def add(self, row_id: int, value) -> None:
+        bucket = self._buckets.get(value)
+        if bucket is None:
+            self._buckets[value] = {row_id}
+        else:
+            bucket.add(row_id)
+
+    def remove(self, row_id: int, value) -> None:
+        bucket = self._buckets[value]
+        bucket.discard(row_id)
+        if not bucket:
+            del self._buckets[value]
+
+    def equal(self, value) -> List[int]:
+        return sorted(self._buckets.get(value, ()))
+
+
+class OrderedIndex:
+    kind = 'ordered'
+    types = (int, float, Time, Color)
+
+    _after_ids = float('inf')
+    bucket_size = 1 << 9
+
+    def __init__(self, column_index: int) -> None:
+        self.column_index = column_index
+        # sorted buckets of (value, row id) entries with the first entry of each, so a change only touches
+        # its own bucket instead of shifting one list holding every entry
+        self._buckets = None
+        self._firsts = None
+
+    @property
+    def built(self) -> bool:
+        return self._buckets is not None
+
+    def build(self, ids: List[int], values: list) -> None:
+        entries = sorted(zip(values, ids))
+        self._buckets = [entries[start:start + self.bucket_size] for start in range(0, len(entries), self.bucket_size)]
+        self._firsts = [bucket[0] for bucket in self._buckets]
+
+    def add(self, row_id: int, value) -> None:
+        entry = (value, row_id)
+        if not self._buckets:
+            self._buckets.append([entry])
+            self._firsts.append(entry)
+            return
+        position = self._bucket(entry)
+        bucket = self._buckets[position]
+        bisect.insort(bucket, entry)
+        self._firsts[position] = bucket[0]
+        if len(bucket) > 2 * self.bucket_size:
+            halves = [bucket[:len(bucket) // 2], bucket[len(bucket) // 2:]]
+            self._buckets[position:position + 1] = halves
+            self._firsts[position:position + 1] = [half[0] for half in halves]
+
+    def remove(self, row_id: int, value) -> None:
+        entry = (value, row_id)
+        position = self._bucket(entry)
+        bucket = self._buckets[position]
+        del bucket[bisect.bisect_left(bucket, entry)]
+        if not bucket:
+            del self._buckets[position]
+            del self._firsts[position]
+            return
+        self._firsts[position] = bucket[0]
+
+    def equal(self, value) -> List[int]:
+        return sorted(self.range(value, value))
+
+    def range(self, low=None, high=None, include_low: bool = True, include_high: bool = True) -> List[int]:
+        buckets = self._buckets
+        if not buckets:
+            return list()
+        # the bounds are keys no entry is equal to, so a bisect finds the same position from either side
+        if low is None:
+            start_bucket, start = 0, 0
+        else:
+            start_bucket, start = self._position((low,) if include_low else (low, OrderedIndex._after_ids))
+        if high is None:
+            end_bucket, end = len(buckets) - 1, len(buckets[-1])
+        else:
+            end_bucket, end = self._position((high, OrderedIndex._after_ids) if include_high else (high,))
+        result = list()
+        for position in range(start_bucket, end_bucket + 1):
+            bucket = buckets[position]
+            entries = bucket[start if position == start_bucket else 0:end if position == end_bucket else len(bucket)]
+            result.extend(row_id for _, row_id in entries)
+        return result
+
+    def _bucket(self, entry: tuple) -> int:
+        return max(bisect.bisect_right(self._firsts, entry) - 1, 0)
+
+    def _position(self, key: tuple) -> Tuple[int, int]:
+        position = self._bucket(key)
+        return position, bisect.bisect_left(self._buckets[position], key)
+
+
+class IntervalIndex:
+    kind = 'interval'
+    types = (TimeInterval, ColorInterval)
+    point_types = {
+        TimeInterval: Time,
+        ColorInterval: Color
+    }
+
+    _after_ids = float('inf')
+    bucket_size = 1 << 9
+
+    def __init__(self, column_index: int) -> None:
+        self.column_index = column_index
+        # sorted buckets of (start, end, row id) entries with the first entry of each, so a change only touches
+        # its own bucket; every bucket also keeps its (end, start, row id) entries in end order, and a max tree
+        # over the largest end of each bucket leads a query straight to the buckets holding an overlap
+        self._buckets = None
+        self._ends = None
+        self._firsts = None
+        self._tree = None
+        self._leaves = 0
+
+    @property
+    def built(self) -> bool:
+        return self._buckets is not None
+
+    def build(self, ids: List[int], values: list) -> None:
+        entries = sorted((value.start, value.end, row_id) for row_id, value in zip(ids, values))
+        self._buckets = [entries[start:start + self.bucket_size] for start in range(0, len(entries), self.bucket_size)]
+        self._ends = [IntervalIndex._end_order(bucket) for bucket in self._buckets]
+        self._firsts = [bucket[0] for bucket in self._buckets]
+        self._build_tree()
+
+    def add(self, row_id: int, value) -> None:
+        entry = (value.start, value.end, row_id)
+        if not self._buckets:
+            self._buckets.append([entry])
+            self._ends.append([(value.end, value.start, row_id)])
+            self._firsts.append(entry)
+            self._build_tree()
+            return
+        position = self._bucket(entry)
+        bucket = self._buckets[position]
+        bisect.insort(bucket, entry)
+        bisect.insort(self._ends[position], (value.end, value.start, row_id))
+        self._firsts[position] = bucket[0]
+        if len(bucket) > 2 * self.bucket_size:
+            halves = [bucket[:len(bucket) // 2], bucket[len(bucket) // 2:]]
+            self._buckets[position:position + 1] = halves
+            self._ends[position:position + 1] = [IntervalIndex._end_order(half) for half in halves]
+            self._firsts[position:position + 1] = [half[0] for half in halves]
+            self._build_tree()
+        else:
+            self._update_tree(position)
+
+    def remove(self, row_id: int, value) -> None:
+        entry = (value.start, value.end, row_id)
+        position = self._bucket(entry)
+        bucket = self._buckets[position]
+        del bucket[bisect.bisect_left(bucket, entry)]
+        ends = self._ends[position]
+        del ends[bisect.bisect_left(ends, (value.end, value.start, row_id))]
+        if not bucket:
+            del self._buckets[position]
+            del self._ends[position]
+            del self._firsts[position]
+            self._build_tree()
+            return
+        self._firsts[position] = bucket[0]
+        self._update_tree(position)
+
+    def equal(self, value) -> List[int]:
+        result = list()
+        for bucket in self._buckets[self._bucket((value.start, value.end)):]:
+            start = bisect.bisect_left(bucket, (value.start, value.end))
+            end = bisect.bisect_right(bucket, (value.start, value.end, IntervalIndex._after_ids))
+            result.extend(row_id for _, _, row_id in bucket[start:end])
+            if end < len(bucket):
+                break
+        return result
+
+    def overlapping(self, low: int, high: int) -> List[int]:
+        count = bisect.bisect_right(self._firsts, (high, IntervalIndex._after_ids))
+        if not count:
+            return list()
+        result = list()
+        # every interval in a bucket before the last one reached starts at or before high, so the ones that
+        # overlap are exactly those ending at or after low, a suffix of the bucket's end order
+        for position in self._reaching(low, count - 1):
+            ends = self._ends[position]
+            result.extend(row_id for _, _, row_id in ends[bisect.bisect_left(ends, (low,)):])
+        # the last bucket also holds intervals starting after high, the smaller candidate side is filtered
+        bucket = self._buckets[count - 1]
+        ends = self._ends[count - 1]
+        starting = bisect.bisect_right(bucket, (high, IntervalIndex._after_ids))
+        ending = bisect.bisect_left(ends, (low,))
+        if starting <= len(ends) - ending:
+            result.extend(row_id for _, end, row_id in bucket[:starting] if end >= low)
+        else:
+            result.extend(row_id for _, start, row_id in ends[ending:] if start <= high)
+        result.sort()
+        return result
+
+    def _bucket(self, entry: tuple) -> int:
+        return max(bisect.bisect_right(self._firsts, entry) - 1, 0)
+
+    @staticmethod
+    def _end_order(bucket: list) -> list:
+        return sorted((end, start, row_id) for start, end, row_id in bucket)
+
+    def _build_tree(self) -> None:
+        leaves = 1
+        while leaves < len(self._ends):
+            leaves *= 2
+        tree = [-IntervalIndex._after_ids] * (2 * leaves)
+        for position, ends in enumerate(self._ends):
+            tree[leaves + position] = ends[-1][0]
+        for node in range(leaves - 1, 0, -1):
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+        self._tree = tree
+        self._leaves = leaves
+
+    def _update_tree(self, position: int) -> None:
+        tree = self._tree
+        node = self._leaves + position
+        tree[node] = self._ends[position][-1][0]
+        node //= 2
+        while node:
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            node //= 2
+
+    def _reaching(self, low: int, count: int) -> List[int]:
+        # buckets among the first count whose largest end is at or after low, found without visiting the others
+        result = list()
+        tree = self._tree
+        nodes = [(1, 0, self._leaves)]
+        while nodes:
+            node, first, width = nodes.pop()
+            if first >= count or tree[node] < low:
+                continue
+            if width == 1:
+                result.append(first)
+                continue
+            width //= 2
+            nodes.append((2 * node + 1, first + width, width))
+            nodes.append((2 * node, first, width))
+        return result
+
+
 class Table:
     name_field = 'name'
     columns_names_field = 'column_names'
     columns_types_field = 'columns_types'
     id_counter_field = 'id_counter'
     rows_field = 'rows'
+    storage_field = 'storage'
+    indexes_field = 'indexes'
+
+    join_algorithms = ('auto', 'hash', 'merge')
+    join_batch_size = 1 << 12
+    max_spill_partitions = 1 << 6
+    max_spill_depth = 3
+    size_sample = 100
+    storages = {
+        'row': RowStorage,
+        'columnar': ColumnarStorage
+    }
+    index_kinds = {
+        'hash': HashIndex,
+        'ordered': OrderedIndex,
+        'interval': IntervalIndex
+    }
+    comparisons = {
+        '=': operator.eq,
+        '!=': operator.ne,
+        '<': lambda value, other: value < other,
+        '<=': lambda value, other: not other < value,
+        '>': lambda value, other: other < value,
+        '>=': lambda value, other: not value < other
+    }
+
+    _condition_pattern = re.compile(r'^([a-zA-Z0-9]+)(<=|>=|!=|=|<|>)(.*)$')
 
     def __init__(self, name: str, columns_names: ColumnsNames,
-                 column_types: ColumnTypes, id_counter: int = 0) -> None:
+                 column_types: ColumnTypes, id_counter: int = 0, storage: str = 'row') -> None:
+        if storage not in Table.storages:
+            raise ValueError(f'Unknown storage {storage}; expected one of {list(Table.storages)}')
         self.name = name
         self.columns_names = columns_names
         self.columns_types = column_types
         self.id_counter = id_counter
-        self.rows = list()
+        self.storage = storage
+        self._storage = Table.storages[storage](column_types)
+        self._database = None
+        self._statistics = dict()
+        self._indexes = dict()
+        self.dirty = True
+        self.version = next(_versions)
+        self.lock = ReadWriteLock()
+        self._snapshots = ()
+        self._pin_lock = threading.Lock()
 
     def __eq__(self, o: object) -> bool:
         if isinstance(o, Table):
@@ -262,37 +1606,297 @@ class Table:
     def append_row_sql(self, sql: str):
         return self.append_row_str(sql.split(','))
 
+    @property
+    @_reading
+    def rows(self) -> List[TableRow]:
+        return list(self._storage)
+
+    @_reading
+    def column_values(self, column_name: str) -> list:
+        return self._storage.column_values(self._column_index(column_name))
+
+    @_reading
+    def column_statistics(self, column_name: str):
+        column_index = self._column_index(column_name)
+        if column_index not in self._statistics:
+            return None
+        return tuple(self._storage.decode_statistic(column_index, value) for value in self._statistics[column_index])
+
+    def _column_index(self, column_name: str) -> int:
+        if column_name not in self.columns_names:
+            raise ValueError(f'No column with name {column_name} in table {self.name}')
+        return self.columns_names.index(column_name)
+
+    def convert_value(self, column_name: str, value: str):
+        return self.columns_types.convert_column(self._column_index(column_name), value)
+
+    @_writing
+    def create_index(self, column_name: str, kind: str = 'hash') -> None:
+        self._add_index(column_name, kind)
+        self._mutated('create_index', column_name, kind)
+
+    @_writing
+    def drop_index(self, column_name: str) -> None:
+        if column_name not in self._indexes:
+            raise ValueError(f'No index on column {column_name} in table {self.name}')
+        del self._indexes[column_name]
+        self._mutated('drop_index', column_name)
+
+    @_reading
+    def get_indexes(self) -> dict:
+        return {column_name: index.kind for column_name, index in self._indexes.items()}
+
+    def _add_index(self, column_name: str, kind: str) -> None:
+        column_index = self._column_index(column_name)
+        if kind not in Table.index_kinds:
+            raise ValueError(f'Unknown index kind {kind}; expected one of {list(Table.index_kinds)}')
+        if column_name in self._indexes:
+            raise ValueError(f'Index on column {column_name} already exists in table {self.name}')
+        column_type = self.columns_types.types_list[column_index]
+        index_type = Table.index_kinds[kind]
+        if index_type.types is not None and column_type not in index_type.types:
+            raise ValueError(f'{kind.capitalize()} index is not supported for column {column_name} '
+                             f'of type {ColumnTypes.types_to_names[column_type]}')
+        self._indexes[column_name] = index_type(column_index)
+
+    def _index(self, column_name: str):
+        index = self._indexes.get(column_name)
+        if index is not None and not index.built:
+            index.build(self._storage.ids(), self._storage.column_values(index.column_index))
+        return index
+
+    @_reading
+    def lookup(self, column_name: str, value) -> List[TableRow]:
+        column_index = self._column_index(column_name)
+        index = self._index(column_name)
+        if index is None:
+            return [row for row in self._storage if row.data[column_index] == value]
+        return [self._storage.get(row_id) for row_id in index.equal(value)]
+
+    @_reading
+    def lookup_range(self, column_name: str, low=None, high=None,
+                     include_low: bool = True, include_high: bool = True) -> List[TableRow]:
+        column_index = self._column_index(column_name)
+        column_type = self.columns_types.types_list[column_index]
+        if column_type not in OrderedIndex.types:
+            raise ValueError(f'Range queries are not supported for column {column_name} '
+                             f'of type {ColumnTypes.types_to_names[column_type]}')
+        index = self._index(column_name)
+        if isinstance(index, OrderedIndex):
+            return [self._storage.get(row_id) for row_id in sorted(index.range(low, high, include_low, include_high))]
+
+        def matches(value) -> bool:
+            if low is not None and (value < low if include_low else not low < value):
+                return False
+            if high is not None and (high < value if include_high else not value < high):
+                return False
+            return True
+
+        return [row for row in self._storage if matches(row.data[column_index])]
+
+    @_reading
+    def lookup_containing(self, column_name: str, point) -> List[TableRow]:
+        column_type = self._interval_column_type(column_name)
+        if not type(point) == IntervalIndex.point_types[column_type]:
+            raise ValueError(f'Point {point} has invalid type {type(point)}; '
+                             f'expected: {IntervalIndex.point_types[column_type]}')
+        bound = point.seconds if column_type == TimeInterval else point.color
+        return self._lookup_overlapping(column_name, bound, bound)
+
+    @_reading
+    def lookup_overlapping(self, column_name: str, interval) -> List[TableRow]:
+        column_type = self._interval_column_type(column_name)
+        if not type(interval) == column_type:
+            raise ValueError(f'Interval {interval} has invalid type {type(interval)}; expected: {column_type}')
+        return self._lookup_overlapping(column_name, interval.start, interval.end)
+
+    def _interval_column_type(self, column_name: str):
+        column_type = self.columns_types.types_list[self._column_index(column_name)]
+        if column_type not in IntervalIndex.types:
+            raise ValueError(f'Interval queries are not supported for column {column_name} '
+                             f'of type {ColumnTypes.types_to_names[column_type]}')
+        return column_type
+
+    def _lookup_overlapping(self, column_name: str, low: int, high: int) -> List[TableRow]:
+        index = self._index(column_name)
+        if isinstance(index, IntervalIndex):
+            return [self._storage.get(row_id) for row_id in index.overlapping(low, high)]
+        column_index = self._column_index(column_name)
+        return [row for row in self._storage if row.data[column_index].start <= high
+                and low <= row.data[column_index].end]
+
+    def lookup_str(self, column_name: str, value: str = None, low: str = None, high: str = None,
+                   contains: str = None, overlaps: str = None) -> List[TableRow]:
+        if value is not None:
+            return self.lookup(column_name, self.convert_value(column_name, value))
+        if contains is not None:
+            point_type = IntervalIndex.point_types[self._interval_column_type(column_name)]
+            return self.lookup_containing(column_name, point_type(contains))
+        if overlaps is not None:
+            return self.lookup_overlapping(column_name, self.convert_value(column_name, overlaps))
+        if low is None and high is None:
+            raise ValueError(f'Lookup on column {column_name} requires a value, a range or an interval')
+        return self.lookup_range(column_name,
+                                 None if low is None else self.convert_value(column_name, low),
+                                 None if high is None else self.convert_value(column_name, high))
+
+    def parse_where(self, sql: str) -> List[Tuple[str, str, object]]:
+        conditions = list()
+        for condition_info in sql.split(','):
+            match = Table._condition_pattern.match(condition_info.strip())
+            if match is None:
+                raise ValueError(f'Invalid format of condition: {condition_info}')
+            column_name, comparison, value = match.groups()
+            conditions.append((column_name, comparison, self.convert_value(column_name, value)))
+        return conditions
+
+    def select(self, columns: ColumnsNames = None, where: List[Tuple[str, str, object]] = None,
+               order_by: Union[str, List[str]] = None, limit: int = None, offset: int = 0):
+        return self._select(*Table._select_arguments(self, columns, where, order_by, limit, offset))
+
+    @staticmethod
+    def _select_arguments(table, columns: ColumnsNames, where: List[Tuple[str, str, object]],
+                          order_by: Union[str, List[str]], limit: int, offset: int) -> tuple:
+        column_indexes = list(range(len(table.columns_names))) if columns is None \
+            else [table._column_index(column_name) for column_name in columns]
+
+        conditions = list()
+        for column_name, comparison, value in where or ():
+            if comparison not in Table.comparisons:
+                raise ValueError(f'Unknown comparison {comparison}; expected one of {list(Table.comparisons)}')
+            conditions.append((table._column_index(column_name), column_name, comparison, value))
+
+        order = list()
+        for key in [order_by] if isinstance(order_by, str) else order_by or ():
+            descending = key.startswith('-')
+            column_name = key[1:] if descending else key
+            order.append((table._column_index(column_name), column_name, descending))
+
+        if limit is not None and limit < 0:
+            raise ValueError(f'Invalid limit {limit}')
+        if offset < 0:
+            raise ValueError(f'Invalid offset {offset}')
+
+        return column_indexes, conditions, order, limit, offset
+
+    def _select(self, *arguments):
+        # rows are read lazily from a snapshot, so the lock is not held while the caller iterates
+        with self.snapshot() as snapshot:
+            yield from snapshot._select(*arguments)
+
+    def _may_match(self, column_name: str, comparison: str, value) -> bool:
+        statistics = self.column_statistics(column_name)
+        if statistics is None:
+            return True
+        low, high = statistics
+        if comparison == '=':
+            return not (value < low or high < value)
+        if comparison in ('<', '<='):
+            return Table.comparisons[comparison](low, value)
+        if comparison in ('>', '>='):
+            return Table.comparisons[comparison](high, value)
+        return True
+
+    def _candidates(self, conditions: list, order: list) -> Tuple[list, bool]:
+        for _, column_name, comparison, value in conditions:
+            index = self._index(column_name)
+            if comparison == '=' and index is not None:
+                return index.equal(value), False
+
+        ranges = [(column_name, comparison, value) for _, column_name, comparison, value in conditions
+                  if comparison not in ('=', '!=') and isinstance(self._index(column_name), OrderedIndex)]
+        if len(order) == 1 and not order[0][2] and isinstance(self._index(order[0][1]), OrderedIndex):
+            index = self._index(order[0][1])
+            for column_name, comparison, value in ranges:
+                if column_name == order[0][1]:
+                    return Table._index_range(index, comparison, value), True
+            return index.range(), True
+        if ranges:
+            return sorted(Table._index_range(self._index(ranges[0][0]), *ranges[0][1:])), False
+        return self._storage.ids(), False
+
+    @staticmethod
+    def _index_range(index: OrderedIndex, comparison: str, value) -> List[int]:
+        if comparison in ('<', '<='):
+            return index.range(high=value, include_high=comparison == '<=')
+        return index.range(low=value, include_low=comparison == '>=')
+
+    def _write_storage(self):
+        if self._storage.mapped:
+            if self.storage == 'columnar':
+                self._storage.materialize()
+            else:
+                self._storage = Table.storages[self.storage].from_rows(self.columns_types, (
+                    TableRow(row.id, row.data) for row in self._storage))
+        return self._storage
+
+    @_writing
     def update_row_sql(self, id: int, sql: str):
         columns_names, column_values = Table._parse_row_sql(sql)
-        if id not in [row.id for row in self.rows]:
+        if id not in self._storage:
             raise ValueError(f'No row with id {id}')
 
-        updated_row = None
-        for row in self.rows:
-            if row.id == id:
-                updated_row = row
-
+        updates = list()
         for i in range(len(columns_names)):
             columns_name = columns_names[i]
             column_value = column_values[i]
             if columns_name not in self.columns_names:
                 raise ValueError(f'No column with name {columns_name} in table {self.name}')
             column_index = self.columns_names.index(columns_name)
-            updated_row.data[column_index] = self.columns_types.convert_column(column_index, column_value)
+            updates.append((column_index, self.columns_types.convert_column(column_index, column_value)))
 
+        self._set_values(id, dict(updates))
+        self._mutated('update_row', id, list(map(str, self._storage.get(id).data)))
+
+    @_writing
     def delete_row(self, id: int):
-        ids = [row.id for row in self.rows]
-        if id not in ids:
+        if id not in self._storage:
             raise ValueError(f'No row with id {id} in table {self.name}')
-        result = self.rows[ids.index(id)]
-        del self.rows[ids.index(id)]
+        result = self._remove_row(id)
+        self._mutated('delete_row', id)
+        return result
+
+    def _set_values(self, row_id: int, values: dict) -> None:
+        storage = self._write_storage()
+        indexes = [index for index in self._indexes.values() if index.built and index.column_index in values]
+        undo = self._undo_log()
+        self._preserve(row_id)
+        previous = list(storage.get(row_id).data) if indexes or undo is not None else None
+        if undo is not None:
+            undo.append((self, '_set_values', (row_id, {column_index: previous[column_index]
+                                                        for column_index in values})))
+        for column_index, value in values.items():
+            storage.set_value(row_id, column_index, value)
+        for index in indexes:
+            index.remove(row_id, previous[index.column_index])
+            index.add(row_id, values[index.column_index])
+
+    def _remove_row(self, row_id: int) -> TableRow:
+        result = self._write_storage().remove(row_id)
+        self._preserve(row_id, result, True)
+        self._log_undo('_restore_row', result)
+        for index in self._indexes.values():
+            if index.built:
+                index.remove(row_id, result.data[index.column_index])
         return result
 
+    def _restore_row(self, table_row: TableRow) -> None:
+        self._write_storage().restore(table_row)
+        for index in self._indexes.values():
+            if index.built:
+                index.add(table_row.id, table_row.data[index.column_index])
+
+    @_reading
+    def page(self, after_id: int = None, limit: int = None) -> List[TableRow]:
+        if limit is not None and limit < 0:
+            raise ValueError(f'Invalid limit {limit}')
+        return self._storage.rows_after(after_id, limit)
+
+    @_reading
     def get_row(self, id: int):
-        ids = [row.id for row in self.rows]
-        if id not in ids:
+        if id not in self._storage:
             raise ValueError(f'No row with id {id} in table {self.name}')
-        return self.rows[ids.index(id)]
+        return self._storage.get(id)
 
     @staticmethod
     def _parse_row_sql(sql: str) -> Tuple[List[str], List[str]]:
@@ -310,47 +1914,182 @@ class Table:
 
         return names, values
 
+    @_writing
     def append_row_str(self, row_str: RowDataStr):
-        converted = self.columns_types.convert(row_str)
-        return self.append_row(converted)
+        return self._append_row_unchecked(self.columns_types.convert(row_str))
 
+    @_writing
     def append_row(self, row: RowData):
         self.columns_types.verify(row)
+        return self._append_row_unchecked(row)
+
+    def _append_row_unchecked(self, row: RowData):
         table_row = TableRow(self.id_counter, row)
         self._append_row_obj(table_row)
         self.id_counter += 1
+        self._mutated('append_row', table_row.id, list(map(str, row)))
         return table_row
 
+    @_writing
+    def append_rows_str(self, rows_str: List[RowDataStr]) -> List[TableRow]:
+        return self._append_rows_unchecked(self.columns_types.convert_rows(rows_str))
+
+    @_writing
+    def append_rows(self, rows: List[RowData]) -> List[TableRow]:
+        self.columns_types.verify_rows(rows)
+        return self._append_rows_unchecked(rows)
+
+    def _append_rows_unchecked(self, rows: List[RowData]) -> List[TableRow]:
+        if not rows:
+            return list()
+        first_id = self.id_counter
+        table_rows = [TableRow(row_id, row) for row_id, row in zip(itertools.count(first_id), rows)]
+        self._append_row_objs(table_rows)
+        self.id_counter += len(table_rows)
+        self._mutated('append_rows', first_id, [list(map(str, row)) for row in rows])
+        return table_rows
+
+    def _append_row_objs(self, table_rows: List[TableRow]) -> None:
+        appended = 0
+        try:
+            for table_row in table_rows:
+                self._append_row_obj(table_row)
+                appended += 1
+        except Exception:
+            for _ in range(appended):
+                self._pop_row()
+            raise
+
+    def _pop_row(self) -> TableRow:
+        result = self._write_storage().pop()
+        self._preserve(result.id, result, True)
+        self._log_undo('_append_row_obj', result)
+        for index in self._indexes.values():
+            if index.built:
+                index.remove(result.id, result.data[index.column_index])
+        return result
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        database = self._database
+        with contextlib.nullcontext() if database is None else database.lock.read(), self.lock.write():
+            if database is not None:
+                database._check_open()
+            yield
+
+    def _written(self) -> None:
+        database = self._database
+        if database is not None:
+            database._checkpoint_if_due()
+
+    def _mutated(self, operation: str, *args) -> None:
+        self.dirty = True
+        self.version = next(_versions)
+        self._statistics = dict()
+        if self._database is not None:
+            self._database._mutated(operation, self.name, *args)
+
+    def _apply(self, operation: str, args: list) -> None:
+        self.dirty = True
+        self.version = next(_versions)
+        self._statistics = dict()
+        if operation == 'append_row':
+            row_id, row = args
+            self._append_row_obj(TableRow(row_id, self.columns_types.convert(row)))
+            self.id_counter = max(self.id_counter, row_id + 1)
+        elif operation == 'append_rows':
+            first_id, rows = args
+            rows = self.columns_types.convert_rows(rows)
+            self._append_row_objs([TableRow(row_id, row) for row_id, row in zip(itertools.count(first_id), rows)])
+            self.id_counter = max(self.id_counter, first_id + len(rows))
+        elif operation == 'add_rows':
+            self.id_counter = max(self.id_counter, self._append_rows_json(args[0]) + 1)
+        elif operation == 'update_row':
+            row_id, row = args
+            self._set_values(row_id, dict(enumerate(self.columns_types.convert(row))))
+        elif operation == 'delete_row':
+            self._remove_row(args[0])
+        elif operation == 'create_index':
+            self._add_index(*args)
+        elif operation == 'drop_index':
+            del self._indexes[args[0]]
+        else:
+            raise ValueError(f'Unknown operation {operation} for table {self.name}')
+
     def _append_row_obj(self, table_row: TableRow):
-        self.rows.append(table_row)
+        if table_row.id in self._storage:
+            raise ValueError(f'Row with id {table_row.id} already exists in table {self.name}')
+        self._write_storage().append(table_row)
+        self._log_undo('_pop_row')
+        for index in self._indexes.values():
+            if index.built:
+                index.add(table_row.id, table_row.data[index.column_index])
 
     def to_json(self) -> dict:
-        result = dict()
-        result[Table.name_field] = self.name
-        result[Table.columns_names_field] = self.columns_names
-        result[Table.columns_types_field] = self.columns_types.to_json()
+        with self.snapshot() as snapshot:
+            return snapshot.to_json()
+
+    @_reading
+    def snapshot(self):
+        result = TableSnapshot(self)
+        with self._pin_lock:
+            self._snapshots += (result,)
+        return result
 
-        result[Table.rows_field] = list(map(lambda x: x.to_json(), self.rows))
+    def _release(self, snapshot) -> None:
+        with self._pin_lock:
+            self._snapshots = tuple(pinned for pinned in self._snapshots if pinned is not snapshot)
 
-        return result
+    def _preserve(self, row_id: int, row: TableRow = None, removed: bool = False) -> None:
+        snapshots = self._snapshots
+        if not snapshots:
+            return
+        if row is None:
+            row = self._storage.get(row_id)
+        for snapshot in snapshots:
+            snapshot._preserve(row, removed)
+
+    def _savepoint(self) -> tuple:
+        return self.id_counter, self.version, self.dirty
+
+    def _rollback(self, savepoint: tuple) -> None:
+        self.id_counter, self.version, self.dirty = savepoint
+        self._statistics = dict()
+
+    def _undo_log(self) -> Union[list, None]:
+        return None if self._database is None else self._database._undo
+
+    def _log_undo(self, method: str, *args) -> None:
+        undo = self._undo_log()
+        if undo is not None:
+            undo.append((self, method, args))
 
     @classmethod
     def from_json(cls, json_obj: dict):
         table_header = ColumnTypes.from_json(json_obj[Table.columns_types_field])
-        result = cls(json_obj[Table.name_field], json_obj[Table.columns_names_field], table_header)
+        result = cls(json_obj[Table.name_field], json_obj[Table.columns_names_field], table_header,
+                     storage=json_obj.get(Table.storage_field, 'row'))
+        result.id_counter = result._append_rows_json(json_obj[Table.rows_field]) + 1
+        result._add_indexes(json_obj.get(Table.indexes_field, dict()))
+        return result
+
+    def _add_indexes(self, indexes: dict) -> None:
+        for column_name, kind in indexes.items():
+            self._add_index(column_name, kind)
+
+    def _append_rows_json(self, rows_json: List[dict]) -> int:
+        rows = self.columns_types.convert_rows([row_json[TableRow.data_field] for row_json in rows_json])
         id_counter = 0
-        for row_json in json_obj[Table.rows_field]:
-            table_row = TableRow.from_json(row_json, table_header)
-            result._append_row_obj(table_row)
+        for row_json, row in zip(rows_json, rows):
+            table_row = TableRow(int(row_json[TableRow.id_field]), row)
+            self._append_row_obj(table_row)
             id_counter = max(id_counter, table_row.id)
-
-        result.id_counter = id_counter + 1
-        return result
+        return id_counter
 
     @classmethod
-    def from_sql(cls, name: str, sql: str):
+    def from_sql(cls, name: str, sql: str, storage: str = 'row'):
         names, types = Table._parse_sql(sql)
-        return Table(name, names, types)
+        return Table(name, names, types, storage=storage)
 
     @staticmethod
     def _parse_sql(sql: str) -> Tuple[List[str], ColumnTypes]:
@@ -372,14 +2111,15 @@ class Table:
 
         return names, ColumnTypes.from_json(types)
 
-    def join(self, other_table, column_name: str, new_name: str = None):
-        if column_name not in self.columns_names:
-            raise ValueError('Column {} not present in the {} table'.format(column_name, self.name))
-        if column_name not in other_table.columns_names:
-            raise ValueError('Column {} not present in the {} table'.format(column_name, other_table.name))
-
-        column_index = self.columns_names.index(column_name)
-        other_column_index = other_table.columns_names.index(column_name)
+    def join(self, other_table, column_name: str, new_name: str = None, algorithm: str = 'auto',
+             memory_budget: int = None, spill_path: str = None, limit: int = None):
+        column_index, other_column_index = self._join_columns(other_table, column_name)
+        if algorithm not in Table.join_algorithms:
+            raise ValueError(f'Unknown join algorithm {algorithm}; expected one of {Table.join_algorithms}')
+        if limit is not None and limit < 0:
+            raise ValueError(f'Invalid limit {limit}')
+        if memory_budget is not None and algorithm not in ('auto', 'hash'):
+            raise ValueError(f'Join algorithm {algorithm} does not support a memory budget')
 
         result_name = '{}JOIN{}'.format(self.name, other_table.name) if new_name is None else new_name
 
@@ -391,79 +2131,1381 @@ class Table:
         result_columns_types_list.extend(other_table.columns_types.types_list[:other_column_index])
         result_columns_types_list.extend(other_table.columns_types.types_list[other_column_index + 1:])
 
-        result = Table(result_name, result_columns_names, ColumnTypes(result_columns_types_list))
+        result = Table(result_name, result_columns_names, ColumnTypes(result_columns_types_list),
+                       storage=self.storage)
+
+        if memory_budget is not None:
+            # closing an unfinished join removes its spill files, result rows go to a mapped file batch by batch
+            spill = ColumnarSpill(result.columns_types, result.storage == 'row',
+                                  self._spill_path() if spill_path is None else spill_path)
+            with contextlib.closing(self.join_rows(other_table, column_name, memory_budget, spill_path)) as joined, \
+                    spill:
+                result_rows = itertools.islice(joined, limit)
+                while True:
+                    batch = list(itertools.islice(result_rows, Table.join_batch_size))
+                    if not batch:
+                        break
+                    spill.append([TableRow(row_id, data) for row_id, data in
+                                  zip(itertools.count(result.id_counter), batch)])
+                    result.id_counter += len(batch)
+                storage = spill.storage()
+            if storage is not None:
+                result._storage = storage
+            return result
+
+        with self.snapshot() as snapshot, other_table.snapshot() as other_snapshot:
+            rows = snapshot.rows
+            other_rows = other_snapshot.rows
+        keys = [row.data[column_index] for row in rows]
+        other_keys = [row.data[other_column_index] for row in other_rows]
+
+        mergeable = Table._mergeable(self.columns_types.types_list[column_index],
+                                     other_table.columns_types.types_list[other_column_index])
+        if algorithm == 'merge' and not mergeable:
+            raise ValueError(f'Column {column_name} has incomparable types in tables {self.name} '
+                             f'and {other_table.name}')
+        if algorithm == 'auto':
+            presorted = mergeable and Table._is_sorted(keys) and Table._is_sorted(other_keys)
+            algorithm = 'merge' if presorted else 'hash'
+
+        if algorithm == 'merge':
+            pairs = Table._merge_join(keys, other_keys, limit)
+        else:
+            pairs = Table._hash_join(keys, other_keys, limit)
+
+        result._append_rows_unchecked([Table._join_row(rows[i].data, other_rows[j].data, other_column_index)
+                                       for i, j in pairs])
+
+        return result
+
+    def join_rows(self, other_table, column_name: str, memory_budget: int = None, spill_path: str = None):
+        column_index, other_column_index = self._join_columns(other_table, column_name)
+        if memory_budget is not None and memory_budget < 1:
+            raise ValueError(f'Invalid memory budget {memory_budget}')
+
+        partitions = 1
+        if memory_budget is not None:
+            with self.snapshot() as snapshot, other_table.snapshot() as other_snapshot:
+                build_size = min(Table._estimate_size(snapshot), Table._estimate_size(other_snapshot))
+            partitions = min(-(-build_size // memory_budget), Table.max_spill_partitions)
+        if partitions <= 1:
+            return self._join_in_memory(other_table, column_index, other_column_index)
+        if spill_path is None:
+            spill_path = self._spill_path()
+        return self._grace_join(other_table, column_index, other_column_index, partitions, memory_budget,
+                                spill_path)
+
+    def _join_columns(self, other_table, column_name: str) -> Tuple[int, int]:
+        if column_name not in self.columns_names:
+            raise ValueError('Column {} not present in the {} table'.format(column_name, self.name))
+        if column_name not in other_table.columns_names:
+            raise ValueError('Column {} not present in the {} table'.format(column_name, other_table.name))
+        return self.columns_names.index(column_name), other_table.columns_names.index(column_name)
+
+    def _join_in_memory(self, other_table, column_index: int, other_column_index: int):
+        with self.snapshot() as snapshot, other_table.snapshot() as other_snapshot:
+            rows = snapshot.rows
+            other_rows = other_snapshot.rows
+        # rows are joined as they are consumed, a caller that stops early does not pay for the rest
+        buckets = Table._build_buckets([row.data[other_column_index] for row in other_rows])
+        for row in rows:
+            for j in buckets.get(row.data[column_index], ()):
+                yield Table._join_row(row.data, other_rows[j].data, other_column_index)
+
+    def _grace_join(self, other_table, column_index: int, other_column_index: int, partitions: int,
+                    memory_budget: int, spill_path: str):
+        directory = tempfile.mkdtemp(prefix=f'{self.name}JOIN{other_table.name}', suffix=_temp_suffix,
+                                     dir=spill_path)
+        try:
+            with self.snapshot() as snapshot, other_table.snapshot() as other_snapshot:
+                spilled = Table._spill((row.data for row in snapshot), column_index, partitions,
+                                       os.path.join(directory, 'left'), 0)
+                other_spilled = Table._spill((row.data for row in other_snapshot), other_column_index, partitions,
+                                             os.path.join(directory, 'right'), 0)
+            for partition, other_partition in zip(spilled, other_spilled):
+                yield from Table._join_spilled(partition, other_partition, column_index, other_column_index,
+                                               memory_budget, 1)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @staticmethod
+    def _join_spilled(partition: Tuple[str, int], other_partition: Tuple[str, int], column_index: int,
+                      other_column_index: int, memory_budget: int, depth: int):
+        (path, size), (other_path, other_size) = partition, other_partition
+        build_size = min(size, other_size)
+        if not build_size:
+            return
+        if build_size > memory_budget and depth <= Table.max_spill_depth:
+            # a partition still over budget is split again with another hash, at most max_spill_partitions ways
+            partitions = min(-(-build_size // memory_budget), Table.max_spill_partitions)
+            spilled = Table._spill(Table._read_spilled(path), column_index, partitions, f'{path}_', depth)
+            other_spilled = Table._spill(Table._read_spilled(other_path), other_column_index, partitions,
+                                         f'{other_path}_', depth)
+            os.remove(path)
+            os.remove(other_path)
+            for partition, other_partition in zip(spilled, other_spilled):
+                # a partition that did not shrink holds a single key, hashing it again would not split it
+                shrunk = min(partition[1], other_partition[1]) < build_size
+                yield from Table._join_spilled(partition, other_partition, column_index, other_column_index,
+                                               memory_budget, depth + 1 if shrunk else Table.max_spill_depth + 1)
+            return
+
+        # the build side is read a budget sized block at a time and the probe side streamed once per block
+        if size <= other_size:
+            for buckets in Table._spilled_blocks(path, column_index, memory_budget):
+                for other_data in Table._read_spilled(other_path):
+                    for data in buckets.get(other_data[other_column_index], ()):
+                        yield Table._join_row(data, other_data, other_column_index)
+        else:
+            for buckets in Table._spilled_blocks(other_path, other_column_index, memory_budget):
+                for data in Table._read_spilled(path):
+                    for other_data in buckets.get(data[column_index], ()):
+                        yield Table._join_row(data, other_data, other_column_index)
+
+    @staticmethod
+    def _spill(rows, column_index: int, partitions: int, prefix: str, depth: int) -> List[Tuple[str, int]]:
+        paths = [f'{prefix}{partition}' for partition in range(partitions)]
+        sizes = [0] * partitions
+        files = list()
+        try:
+            for path in paths:
+                files.append(open(path, 'wb'))
+            for data in rows:
+                partition = hash((depth, data[column_index])) % partitions
+                pickle.dump(data, files[partition], pickle.HIGHEST_PROTOCOL)
+                sizes[partition] += Table._row_size(data)
+        finally:
+            for file in files:
+                file.close()
+        return list(zip(paths, sizes))
+
+    @staticmethod
+    def _read_spilled(path: str):
+        with open(path, 'rb') as file:
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError:
+                    return
+
+    @staticmethod
+    def _spilled_blocks(path: str, column_index: int, memory_budget: int):
+        buckets = dict()
+        size = 0
+        for data in Table._read_spilled(path):
+            bucket = buckets.get(data[column_index])
+            if bucket is None:
+                buckets[data[column_index]] = [data]
+            else:
+                bucket.append(data)
+            size += Table._row_size(data)
+            if size >= memory_budget:
+                yield buckets
+                buckets = dict()
+                size = 0
+        if buckets:
+            yield buckets
+
+    @_reading
+    def estimated_size(self) -> int:
+        return Table._estimate_size(self._storage)
+
+    @staticmethod
+    def _estimate_size(storage: RowStorage) -> int:
+        sample = list(itertools.islice(storage, Table.size_sample))
+        if not sample:
+            return 0
+        return sum(Table._row_size(row.data) for row in sample) * len(storage) // len(sample)
+
+    @staticmethod
+    def _row_size(data: RowData) -> int:
+        return sys.getsizeof(data) + sum(map(sys.getsizeof, data))
 
-        for row in self.rows:
-            for other_row in other_table.rows:
-                if row.data[column_index] == other_row.data[other_column_index]:
-                    new_row = list(row.data)
-                    new_row.extend(other_row.data[other_column_index + 1:])
-                    result.append_row(new_row)
+    def _spill_path(self) -> Union[str, None]:
+        database = self._database
+        if database is None:
+            return None
+        path = database._file_path or database._snapshot_path
+        return None if path is None else os.path.dirname(os.path.abspath(path))
 
+    @staticmethod
+    def _join_row(data: RowData, other_data: RowData, other_column_index: int) -> RowData:
+        result = list(data)
+        result.extend(other_data[:other_column_index])
+        result.extend(other_data[other_column_index + 1:])
         return result
 
+    @staticmethod
+    def _mergeable(column_type, other_column_type) -> bool:
+        numeric = (int, float)
+        return column_type == other_column_type or (column_type in numeric and other_column_type in numeric)
+
+    @staticmethod
+    def _is_sorted(keys: list) -> bool:
+        return not any(map(operator.lt, itertools.islice(keys, 1, None), keys))
+
+    @staticmethod
+    def _hash_join(keys: list, other_keys: list, limit: int = None) -> List[Tuple[int, int]]:
+        pairs = list()
+        # probing the left side in order yields pairs already sorted, so a limited join can stop early
+        if limit is not None or len(other_keys) <= len(keys):
+            buckets = Table._build_buckets(other_keys)
+            for i, key in enumerate(keys):
+                for j in buckets.get(key, ()):
+                    pairs.append((i, j))
+                if limit is not None and len(pairs) >= limit:
+                    del pairs[limit:]
+                    break
+        else:
+            buckets = Table._build_buckets(keys)
+            for j, key in enumerate(other_keys):
+                for i in buckets.get(key, ()):
+                    pairs.append((i, j))
+            pairs.sort()
+        return pairs
+
+    @staticmethod
+    def _build_buckets(keys: list) -> dict:
+        buckets = dict()
+        for position, key in enumerate(keys):
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [position]
+            else:
+                bucket.append(position)
+        return buckets
+
+    @staticmethod
+    def _merge_join(keys: list, other_keys: list, limit: int = None) -> List[Tuple[int, int]]:
+        presorted = Table._is_sorted(keys)
+        other_order = range(len(other_keys)) if Table._is_sorted(other_keys) \
+            else sorted(range(len(other_keys)), key=other_keys.__getitem__)
+
+        pairs = list()
+        if limit is not None and not presorted:
+            # the first pairs in left order come from looking the left keys up in the sorted right side
+            other_sorted = [other_keys[j] for j in other_order]
+            for i, key in enumerate(keys):
+                start = bisect.bisect_left(other_sorted, key)
+                for j in other_order[start:bisect.bisect_right(other_sorted, key, start)]:
+                    pairs.append((i, j))
+                if len(pairs) >= limit:
+                    del pairs[limit:]
+                    break
+            return pairs
+
+        order = range(len(keys)) if presorted else sorted(range(len(keys)), key=keys.__getitem__)
+        i, j = 0, 0
+        while i < len(order) and j < len(other_order) and (limit is None or len(pairs) < limit):
+            key = keys[order[i]]
+            other_key = other_keys[other_order[j]]
+            if key < other_key:
+                i += 1
+            elif other_key < key:
+                j += 1
+            else:
+                i_end = i + 1
+                while i_end < len(order) and keys[order[i_end]] == key:
+                    i_end += 1
+                j_end = j + 1
+                while j_end < len(other_order) and other_keys[other_order[j_end]] == key:
+                    j_end += 1
+                for left in order[i:i_end]:
+                    for right in other_order[j:j_end]:
+                        pairs.append((left, right))
+                    if limit is not None and len(pairs) >= limit:
+                        break
+                i, j = i_end, j_end
+
+        if not presorted:
+            pairs.sort()
+        if limit is not None:
+            del pairs[limit:]
+        return pairs
+
+
+class TableSnapshot:
+    chunk_size = 1 << 10
+
+    def __init__(self, table: Table) -> None:
+        self.name = table.name
+        self.columns_names = table.columns_names
+        self.columns_types = table.columns_types
+        self.storage = table.storage
+        self.id_counter = table.id_counter
+        self.version = table.version
+        self.dirty = table.dirty
+        self._indexes = table.get_indexes()
+        self._length = len(table._storage)
+        # rows changed or removed after the snapshot was taken, as they were when it was taken
+        self._versions = dict()
+        self._removed = list()
+        self._table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.release()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self):
+        after_id = None
+        while True:
+            rows = self._rows_after(after_id, TableSnapshot.chunk_size)
+            if not rows:
+                return
+            yield from rows
+            after_id = rows[-1].id
+
+    def release(self) -> None:
+        if self._table is not None:
+            self._table._release(self)
+            self._table = None
+
+    @property
+    def rows(self) -> List[TableRow]:
+        return list(self)
+
+    def column_values(self, column_name: str) -> list:
+        column_index = self._column_index(column_name)
+        return [row.data[column_index] for row in self]
+
+    def _column_index(self, column_name: str) -> int:
+        if column_name not in self.columns_names:
+            raise ValueError(f'No column with name {column_name} in table {self.name}')
+        return self.columns_names.index(column_name)
+
+    def select(self, columns: ColumnsNames = None, where: List[Tuple[str, str, object]] = None,
+               order_by: Union[str, List[str]] = None, limit: int = None, offset: int = 0):
+        return self._select(*Table._select_arguments(self, columns, where, order_by, limit, offset))
+
+    def _select(self, column_indexes: List[int], conditions: list, order: list, limit: int, offset: int):
+        row_ids, ordered = None, False
+        with self._read_lock():
+            table = self._table
+            if table.version == self.version:
+                # the table's statistics and indexes still describe the snapshot
+                if not all(table._may_match(column_name, comparison, value)
+                           for _, column_name, comparison, value in conditions):
+                    return
+                row_ids, ordered = table._candidates(conditions, order)
+        if row_ids is None:
+            row_ids = [row.id for row in self]
+
+        checks = [(column_index, Table.comparisons[comparison], value)
+                  for column_index, _, comparison, value in conditions]
+        if order and not ordered:
+            keyed = list(self._matching(row_ids, [column_index for column_index, _, _ in order], checks))
+            for position in reversed(range(len(order))):
+                keyed.sort(key=lambda item: item[1][position], reverse=order[position][2])
+            row_ids = [row_id for row_id, _ in keyed]
+            checks = list()
+
+        stop = None if limit is None else offset + limit
+        for row_id, data in itertools.islice(self._matching(row_ids, column_indexes, checks), offset, stop):
+            yield TableRow(row_id, data)
+
+    def page(self, after_id: int = None, limit: int = None) -> List[TableRow]:
+        if limit is not None and limit < 0:
+            raise ValueError(f'Invalid limit {limit}')
+        result = list()
+        while limit is None or len(result) < limit:
+            rows = self._rows_after(after_id, TableSnapshot.chunk_size if limit is None
+                                    else min(TableSnapshot.chunk_size, limit - len(result)))
+            if not rows:
+                break
+            result.extend(rows)
+            after_id = rows[-1].id
+        return result
+
+    def columnar(self) -> ColumnarStorage:
+        with self._read_lock():
+            table = self._table
+            if table.version == self.version and isinstance(table._storage, ColumnarStorage):
+                return table._storage.copy()
+        result = ColumnarStorage(self.columns_types)
+        # row tables accept any int, so their columns may fall back to decimal text
+        result.wide_ints = self.storage == 'row'
+        for row in self:
+            result.append(row)
+        return result
+
+    def _read_lock(self):
+        if self._table is None:
+            raise ValueError(f'Snapshot of table {self.name} was released')
+        # the table is only locked per chunk, writers keep the old versions of the rows they touch
+        return self._table.lock.read()
+
+    def _rows_after(self, after_id: Union[int, None], limit: int) -> List[TableRow]:
+        with self._read_lock():
+            storage = self._table._storage
+            rows = storage.rows_after(after_id, limit)
+            high = rows[-1].id if len(rows) == limit else sys.maxsize
+            if rows and not rows[-1].id < self.id_counter:
+                rows = [row for row in rows if row.id < self.id_counter]
+            versions = self._versions
+            result = [versions.get(row.id, row) for row in rows] if versions else rows
+            removed = self._removed
+            start = 0 if after_id is None else bisect.bisect_right(removed, after_id)
+            stop = bisect.bisect_right(removed, high)
+            if start < stop:
+                present = {row.id for row in result}
+                result.extend(versions[row_id] for row_id in removed[start:stop] if row_id not in present)
+                result.sort(key=lambda row: row.id)
+        return result[:limit]
+
+    def _matching(self, row_ids: List[int], column_indexes: List[int], checks: list):
+        condition_indexes = [column_index for column_index, _, _ in checks]
+        for start in range(0, len(row_ids), TableSnapshot.chunk_size):
+            chunk = row_ids[start:start + TableSnapshot.chunk_size]
+            with self._read_lock():
+                if checks:
+                    chunk = [row_id for row_id in chunk
+                             if all(check(candidate, value) for candidate, (_, check, value)
+                                    in zip(self._project(row_id, condition_indexes), checks))]
+                projected = [(row_id, self._project(row_id, column_indexes)) for row_id in chunk]
+            yield from projected
+
+    def _project(self, row_id: int, column_indexes: List[int]) -> RowData:
+        # candidates all existed when the snapshot was taken, the ones missing since then were kept as versions
+        if row_id in self._versions:
+            data = self._versions[row_id].data
+            return [data[column_index] for column_index in column_indexes]
+        return self._table._storage.project(row_id, column_indexes)
+
+    def _preserve(self, row: TableRow, removed: bool) -> None:
+        if row.id >= self.id_counter:
+            return
+        self._versions.setdefault(row.id, row)
+        if removed:
+            position = bisect.bisect_left(self._removed, row.id)
+            if position == len(self._removed) or not self._removed[position] == row.id:
+                self._removed.insert(position, row.id)
+
+    def get_indexes(self) -> dict:
+        return dict(self._indexes)
+
+    def to_json(self, rows: List[TableRow] = None) -> dict:
+        result = dict()
+        result[Table.name_field] = self.name
+        result[Table.columns_names_field] = self.columns_names
+        result[Table.columns_types_field] = self.columns_types.to_json()
+        if not self.storage == 'row':
+            result[Table.storage_field] = self.storage
+        if self._indexes:
+            result[Table.indexes_field] = self.get_indexes()
+
+        result[Table.rows_field] = list(map(lambda x: x.to_json(), self.rows if rows is None else rows))
+
+        return result
+
+
+class WriteAheadLog:
+    suffix = '.wal'
+
+    def __init__(self, path: str, sync_every: int = 1) -> None:
+        if sync_every < 0:
+            raise ValueError(f'Invalid sync interval {sync_every}')
+        self.path = path
+        self.sync_every = sync_every
+        self.records = 0
+        self.size = 0
+        if os.path.isfile(path):
+            for self.size, _ in WriteAheadLog.read_offsets(path):
+                self.records += 1
+            if self.size != os.path.getsize(path):
+                # cut a torn tail off, otherwise the next record is glued onto it and lost on replay
+                with open(path, 'r+b') as stream:
+                    stream.truncate(self.size)
+                    stream.flush()
+                    os.fsync(stream.fileno())
+        self._stream = open(path, 'a')
+        self._unsynced = 0
+
+    def write(self, record: list) -> None:
+        self.write_records([record])
+
+    def write_records(self, records: List[list]) -> None:
+        if not records:
+            return
+        data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+        self._stream.write(data)
+        self.records += len(records)
+        self.size += len(data)
+        self._unsynced += len(records)
+        if self.sync_every and self._unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        self._stream.flush()
+        os.fsync(self._stream.fileno())
+        self._unsynced = 0
+
+    def truncate(self, lsn: int = None) -> None:
+        self._stream.flush()
+        kept = list() if lsn is None else [record for record in WriteAheadLog.read(self.path) if record[0] > lsn]
+        if not kept:
+            self._stream.truncate(0)
+            self.sync()
+            self.records = 0
+            self.size = 0
+            return
+
+        data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in kept).encode()
+        self._stream.close()
+        write_atomically(self.path, lambda write_stream: write_stream.write(data))
+        self._stream = open(self.path, 'a')
+        self.records = len(kept)
+        self.size = len(data)
+        self._unsynced = 0
+
+    def close(self) -> None:
+        self.sync()
+        self._stream.close()
+
+    @staticmethod
+    def read(path: str):
+        for _, record in WriteAheadLog.read_offsets(path):
+            yield record
+
+    @staticmethod
+    def read_offsets(path: str):
+        offset = 0
+        with open(path, 'rb') as read_stream:
+            for line in read_stream:
+                if not line.endswith(b'\n'):
+                    return
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a torn write at the tail of the log, everything before it is intact
+                    return
+                offset += len(line)
+                yield offset, record
+
+
+class BinaryFormat:
+    magic = b'XDB\x01'
+    version = 1
+    statistics_types = (int, float, Color, Time)
+
+    _prefix = struct.Struct('<4sHHQ')
+    _suffix = struct.Struct('<Q4s')
+    _alignment = 8
+
+    @staticmethod
+    def is_binary(path: str) -> bool:
+        with open(path, 'rb') as read_stream:
+            return read_stream.read(len(BinaryFormat.magic)) == BinaryFormat.magic
+
+    @staticmethod
+    def write(snapshot, write_stream: BinaryIO, previous: BinaryIO = None, sections: dict = None) -> dict:
+        tables = [snapshot.get_table(name) for name in snapshot.get_tables_names()]
+        # clean tables are copied byte for byte from the previous file instead of being encoded again
+        reused = dict() if previous is None or sections is None else {
+            table.name: sections[table.name] for table in tables if not table.dirty and table.name in sections}
+        storages = list()
+        for table in tables:
+            if table.name in reused:
+                storages.append(None)
+            else:
+                storages.append(table.columnar())
+
+        header = dict()
+        header[Database.name_field] = snapshot.name
+        header[Database.lsn_field] = snapshot.lsn
+        header['byteorder'] = sys.byteorder
+        header[Database.tables_field] = [{
+            Table.name_field: table.name,
+            Table.columns_names_field: table.columns_names,
+            Table.columns_types_field: table.columns_types.to_json(),
+            Table.storage_field: table.storage,
+            Table.id_counter_field: table.id_counter,
+            Table.indexes_field: table.get_indexes()
+        } for table in tables]
+        header_bytes = json.dumps(header).encode()
+        write_stream.write(BinaryFormat._prefix.pack(BinaryFormat.magic, BinaryFormat.version, 0, len(header_bytes)))
+        write_stream.write(header_bytes)
+
+        directory = list()
+        for table, storage in zip(tables, storages):
+            if storage is None:
+                entry = reused[table.name]
+                directory.append(dict(entry, ids=BinaryFormat._copy_section(previous, write_stream, entry['ids']),
+                                      columns=[[BinaryFormat._copy_section(previous, write_stream, location)
+                                                for location in locations] for locations in entry['columns']]))
+                continue
+            ids, columns = storage.sections()
+            statistics = list()
+            for column_index, column_type in enumerate(table.columns_types.types_list):
+                statistics.append(storage.statistics(column_index)
+                                  if column_type in BinaryFormat.statistics_types else None)
+            directory.append({
+                'ids': BinaryFormat._write_section(write_stream, ids),
+                'columns': [[BinaryFormat._write_section(write_stream, section) for section in sections]
+                            for sections in columns],
+                'statistics': statistics,
+                'encodings': storage.encodings()
+            })
+
+        footer_bytes = json.dumps({Database.tables_field: directory}).encode()
+        write_stream.write(footer_bytes)
+        write_stream.write(BinaryFormat._suffix.pack(len(footer_bytes), BinaryFormat.magic))
+        return {table.name: entry for table, entry in zip(tables, directory)}
+
+    @staticmethod
+    def _write_section(write_stream: BinaryIO, data) -> Tuple[int, int]:
+        padding = -write_stream.tell() % BinaryFormat._alignment
+        write_stream.write(bytes(padding))
+        offset = write_stream.tell()
+        write_stream.write(data)
+        return offset, memoryview(data).nbytes
+
+    @staticmethod
+    def _copy_section(read_stream: BinaryIO, write_stream: BinaryIO, location) -> Tuple[int, int]:
+        write_stream.write(bytes(-write_stream.tell() % BinaryFormat._alignment))
+        offset = write_stream.tell()
+        Database._copy_section(read_stream, write_stream, *location)
+        return offset, location[1]
+
+    @staticmethod
+    def read(path: str):
+        with open(path, 'rb') as read_stream:
+            view = memoryview(mmap.mmap(read_stream.fileno(), 0, access=mmap.ACCESS_READ))
+        return BinaryFormat.read_buffer(view, path)
+
+    @staticmethod
+    def read_buffer(view: memoryview, path: str):
+        magic, version, _, header_length = BinaryFormat._prefix.unpack_from(view)
+        if not magic == BinaryFormat.magic:
+            raise ValueError(f'File {path} is not a binary database file')
+        if version > BinaryFormat.version:
+            raise ValueError(f'Binary database file {path} has unsupported version {version}')
+        footer_length, magic = BinaryFormat._suffix.unpack_from(view, len(view) - BinaryFormat._suffix.size)
+        if not magic == BinaryFormat.magic:
+            raise ValueError(f'Binary database file {path} is truncated')
+
+        header_start = BinaryFormat._prefix.size
+        header = json.loads(bytes(view[header_start:header_start + header_length]))
+        footer_end = len(view) - BinaryFormat._suffix.size
+        footer = json.loads(bytes(view[footer_end - footer_length:footer_end]))
+        swap = not header['byteorder'] == sys.byteorder
+
+        def section(location):
+            return view[location[0]:location[0] + location[1]]
+
+        result = Database(header[Database.name_field])
+        for table_header, directory in zip(header[Database.tables_field], footer[Database.tables_field]):
+            columns_types = ColumnTypes.from_json(table_header[Table.columns_types_field])
+            table = Table(table_header[Table.name_field], table_header[Table.columns_names_field], columns_types,
+                          table_header[Table.id_counter_field], table_header[Table.storage_field])
+            table._storage = ColumnarStorage.from_sections(
+                columns_types, section(directory['ids']),
+                [[section(location) for location in sections] for sections in directory['columns']], swap,
+                directory.get('encodings'))
+            table._statistics = {column_index: tuple(statistics)
+                                 for column_index, statistics in enumerate(directory['statistics'])
+                                 if statistics is not None}
+            table._add_indexes(table_header.get(Table.indexes_field, dict()))
+            table._database = result
+            result._tables[table.name] = table
+            result._table_sections[table.name] = directory
+        result._lsn = header[Database.lsn_field]
+        result.file_format = 'binary'
+        return result
+
+
+class JsonStreamReader:
+    chunk_size = 1 << 16
+
+    _whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, read_stream, batch_size: int = 1000) -> None:
+        self.batch_size = batch_size
+        self._stream = read_stream
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def read_database(self):
+        name = None
+        lsn = 0
+        tables = list()
+        for key in self._members():
+            if key == Database.tables_field:
+                for table_name in self._members():
+                    tables.append((table_name, self._read_table()))
+            elif key == Database.name_field:
+                name = self._value()
+            elif key == Database.lsn_field:
+                lsn = self._value()
+            else:
+                self._value()
+
+        result = Database(name)
+        for table_name, table in tables:
+            table._database = result
+            result._tables[table_name] = table
+        result._lsn = lsn
+        return result
+
+    def _read_table(self) -> Table:
+        fields = dict()
+        table = None
+        id_counter = 0
+        for key in self._members():
+            required = (Table.name_field, Table.columns_names_field, Table.columns_types_field)
+            if key == Table.rows_field and all(field in fields for field in required):
+                table = Table(fields[Table.name_field], fields[Table.columns_names_field],
+                              ColumnTypes.from_json(fields[Table.columns_types_field]),
+                              storage=fields.get(Table.storage_field, 'row'))
+                batch = list()
+                for _ in self._elements():
+                    batch.append(self._value())
+                    if len(batch) >= self.batch_size:
+                        id_counter = max(id_counter, table._append_rows_json(batch))
+                        batch.clear()
+                id_counter = max(id_counter, table._append_rows_json(batch))
+            else:
+                fields[key] = self._value()
+
+        if table is None:
+            return Table.from_json(fields)
+        table.id_counter = id_counter + 1
+        table._add_indexes(fields.get(Table.indexes_field, dict()))
+        return table
+
+    def _members(self):
+        self._expect('{')
+        if self._peek() == '}':
+            self._position += 1
+            return
+        while True:
+            key = self._value()
+            if not isinstance(key, str):
+                raise ValueError(f'Expected JSON object key, got {key}')
+            self._expect(':')
+            yield key
+            if not self._separator('}'):
+                return
+
+    def _elements(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._position += 1
+            return
+        while True:
+            yield
+            if not self._separator(']'):
+                return
+
+    def _separator(self, closing: str) -> bool:
+        char = self._peek()
+        self._position += 1
+        if char == ',':
+            return True
+        if char == closing:
+            return False
+        raise ValueError(f'Expected "," or "{closing}" in JSON input, got "{char}"')
+
+    def _expect(self, char: str) -> None:
+        found = self._peek()
+        if not found == char:
+            raise ValueError(f'Expected "{char}" in JSON input, got "{found}"')
+        self._position += 1
+
+    def _peek(self) -> str:
+        while True:
+            self._position = JsonStreamReader._whitespace.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON input')
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number at the very end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._position = end
+            return value
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._stream.read(self.chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
+
+
+class DatabaseSnapshot:
+    def __init__(self, name: str, lsn: int, version: int, dirty: bool, tables: dict, table_jsons: dict) -> None:
+        self.name = name
+        self.lsn = lsn
+        self.version = version
+        self.dirty = dirty
+        self.tables = tables
+        self.table_jsons = table_jsons
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.release()
+
+    def release(self) -> None:
+        for table in self.tables.values():
+            if table is not None:
+                table.release()
+
+    def get_tables_names(self) -> List[str]:
+        return list(self.tables.keys())
+
+    def get_table(self, table_name: str) -> TableSnapshot:
+        if table_name not in self.tables:
+            raise ValueError(f'Table with name {table_name} does not exist')
+        table = self.tables[table_name]
+        if table is None:
+            table = Table.from_json(Database._table_json(self.table_jsons[table_name])).snapshot()
+            self.tables[table_name] = table
+        return table
+
+    def to_json(self) -> dict:
+        tables = dict()
+        for name, table in self.tables.items():
+            tables[name] = Database._table_json(self.table_jsons[name]) if table is None else table.to_json()
+
+        result = dict()
+        result[Database.name_field] = self.name
+        result[Database.tables_field] = tables
+        if self.lsn:
+            result[Database.lsn_field] = self.lsn
+
+        return result
+
+
+class LruCache:
+    # capacity counts entries, or the total of size(value) when a size function is given
+    def __init__(self, capacity: int, size=None) -> None:
+        if capacity < 1:
+            raise ValueError(f'Invalid cache capacity {capacity}')
+        self.capacity = capacity
+        self.size = 0
+        self._size = (lambda value: 1) if size is None else size
+        self._entries = OrderedDict()
+        self._sizes = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value) -> None:
+        size = self._size(value)
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+                self.size -= self._sizes.pop(key)
+            # a value that could never fit would only flush everything else
+            if size > self.capacity:
+                return
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.size += size
+            while self.size > self.capacity:
+                evicted, _ = self._entries.popitem(last=False)
+                self.size -= self._sizes.pop(evicted)
+
 
 class Database:
     name_field = 'name'
     tables_field = 'tables'
+    lsn_field = 'lsn'
+
+    file_formats = ('json', 'binary')
+    streaming_threshold = 64 << 20
+    scan_window = 16 << 20
+
+    _tables_pattern = re.compile(rb'\n    "tables": \{')
+    _table_name_pattern = re.compile(rb',?\n        ("(?:[^"\\]|\\.)*"): \{')
+    _tables_end_pattern = re.compile(rb'\n    }|}')
 
-    def __init__(self, name: str) -> None:
+    batch_operations = {'add_table': 1, 'drop_table': 0, 'append_row': 1, 'update_row': 2, 'delete_row': 1}
+
+    def __init__(self, name: str, file_format: str = 'json') -> None:
         pathvalidate.validate_filename(name)
+        if file_format not in Database.file_formats:
+            raise ValueError(f'Unknown file format {file_format}; expected one of {Database.file_formats}')
         self.name = name
+        self.file_format = file_format
         self._tables = dict()
-
+        self._table_jsons = dict()
+        self._lsn = 0
+        self._wal = None
+        self._wal_buffer = None
+        self._undo = None
+        self._snapshot_path = None
+        self._checkpoint_every = None
+        self.dirty = True
+        self.version = next(_versions)
+        self._file_path = None
+        self._table_sections = dict()
+        self.lock = ReadWriteLock()
+        self._log_lock = threading.Lock()
+        self._persist_lock = threading.RLock()
+        self.closed = False
+
+    @_reading
     def get_tables_names(self):
         return list(self._tables.keys())
 
     def get_table(self, table_name: str) -> Table:
+        with self.lock.read():
+            if table_name not in self._tables:
+                raise ValueError(f'Table with name {table_name} does not exist')
+            table = self._tables[table_name]
+        if table is None:
+            table = self._materialize_table(table_name)
+        return table
+
+    @_writing
+    def _materialize_table(self, table_name: str) -> Table:
         if table_name not in self._tables:
             raise ValueError(f'Table with name {table_name} does not exist')
-        return self._tables[table_name]
-
+        table = self._tables[table_name]
+        if table is None:
+            table = Table.from_json(Database._table_json(self._table_jsons.pop(table_name)))
+            table._database = self
+            table.dirty = False
+            self._tables[table_name] = table
+        return table
+
+    @_writing
     def add_table(self, table: Table) -> None:
         if table.name in self._tables:
             raise ValueError('Table with name {} already exists in database'.format(table.name))
         self._tables[table.name] = table
-
+        table._database = self
+        with table.snapshot() as snapshot:
+            rows = snapshot.page(limit=TableSnapshot.chunk_size)
+            self._mutated('add_table', table.name, snapshot.to_json(rows))
+            # the rows of a large table are logged a chunk per record instead of all in one record
+            while self._wal is not None and len(rows) == TableSnapshot.chunk_size:
+                rows = snapshot.page(rows[-1].id, TableSnapshot.chunk_size)
+                if rows:
+                    self._mutated('add_rows', table.name, [row.to_json() for row in rows])
+
+    @_writing
     def drop_table(self, name: str) -> None:
         if name not in self._tables:
             raise ValueError('Table with name {} does not exists in the database'.format(name))
-        del self._tables[name]
+        self._pop_table(name)
+        self._mutated('drop_table', name)
+
+    def _pop_table(self, name: str) -> None:
+        table = self._tables.pop(name)
+        if table is None:
+            del self._table_jsons[name]
+        else:
+            table._database = None
+
+    @_writing
+    def batch(self, operations: List[tuple], atomic: bool = False) -> list:
+        for operation in operations:
+            if len(operation) < 2 or Database.batch_operations.get(operation[0]) != len(operation) - 2:
+                raise ValueError(f'Invalid batch operation {operation}; expected one of '
+                                 f'{list(Database.batch_operations)} with a table name and its arguments')
+        savepoint = self._lsn, self.version, self.dirty, dict(self._tables), dict(self._table_jsons)
+        table_savepoints = dict()
+        results = list()
+        self._wal_buffer = list()
+        # atomic batches record how to revert each applied row change instead of copying the tables
+        self._undo = list() if atomic else None
+        try:
+            with contextlib.ExitStack() as locks:
+                for i, (operation, table_name, *args) in enumerate(operations):
+                    try:
+                        if operation not in ('add_table', 'drop_table'):
+                            table = self.get_table(table_name)
+                            if id(table) not in table_savepoints:
+                                # readers of the table wait for the whole batch instead of seeing it half applied
+                                locks.enter_context(table.lock.write())
+                                table_savepoints[id(table)] = table, table._savepoint() if atomic else None
+                        results.append(self._batch_operation(operation, table_name, args))
+                    except ValueError as e:
+                        if atomic:
+                            raise ValueError(f'Batch operation {i} ({operation}) failed: {e}') from e
+                        results.append(e)
+        except BaseException:
+            if atomic:
+                self._wal_buffer = None
+                self._rollback(savepoint, table_savepoints.values())
+            raise
+        finally:
+            self._undo = None
+            if self._wal_buffer is not None and self._wal is not None:
+                with self._log_lock:
+                    # one write and one sync for the whole batch
+                    self._wal.write_records(self._wal_buffer)
+            self._wal_buffer = None
+        return results
+
+    def _batch_operation(self, operation: str, table_name: str, args: list):
+        if operation == 'add_table':
+            self.add_table(Table.from_sql(table_name, *args))
+        elif operation == 'drop_table':
+            self.drop_table(table_name)
+        elif operation == 'append_row':
+            return self.get_table(table_name).append_row_sql(*args)
+        elif operation == 'update_row':
+            row_id, sql = args
+            self.get_table(table_name).update_row_sql(int(row_id), sql)
+        else:
+            return self.get_table(table_name).delete_row(int(*args))
+
+    def _rollback(self, savepoint: tuple, table_savepoints) -> None:
+        undo, self._undo = self._undo, None
+        for table, method, args in reversed(undo):
+            getattr(table, method)(*args)
+        self._lsn, self.version, self.dirty, tables, self._table_jsons = savepoint
+        for table in self._tables.values():
+            if table is not None:
+                table._database = None
+        self._tables = tables
+        for table in tables.values():
+            if table is not None:
+                table._database = self
+        for table, table_savepoint in table_savepoints:
+            table._rollback(table_savepoint)
+
+    def enable_wal(self, path: str, sync_every: int = 1, checkpoint_every: int = 10000) -> None:
+        with self._persist_lock:
+            with self.lock.write():
+                if self._wal is not None:
+                    raise ValueError(f'Write-ahead log is already enabled for database {self.name}')
+                self._snapshot_path = path
+                self._checkpoint_every = checkpoint_every
+                self._wal = WriteAheadLog(path + WriteAheadLog.suffix, sync_every)
+            if not os.path.isfile(path):
+                self.checkpoint()
+
+    def close(self) -> None:
+        # waits for a running persist, so nothing is written for this database afterwards
+        with self._persist_lock:
+            self.closed = True
+            self.disable_wal()
+
+    def disable_wal(self) -> None:
+        with self._persist_lock, self.lock.write():
+            if self._wal is not None:
+                self._wal.close()
+            self._wal = None
+            self._snapshot_path = None
+
+    def checkpoint(self) -> None:
+        with self._persist_lock:
+            if self._wal is None:
+                raise ValueError(f'Write-ahead log is not enabled for database {self.name}')
+            with self._log_lock:
+                self._wal.sync()
+            with self.snapshot() as snapshot:
+                self._persist_snapshot(self._snapshot_path, snapshot)
+            # records written while the snapshot was persisted stay in the log
+            with self._log_lock:
+                self._wal.truncate(snapshot.lsn)
+
+    @_writing
+    def replay(self, path: str) -> None:
+        for record in WriteAheadLog.read(path):
+            lsn, operation, table_name, *args = record
+            if lsn <= self._lsn:
+                continue
+            self.dirty = True
+            self.version = next(_versions)
+            if operation == 'add_table':
+                table = Table.from_json(args[0])
+                table._database = self
+                self._tables[table_name] = table
+            elif operation == 'drop_table':
+                self._pop_table(table_name)
+            else:
+                self.get_table(table_name)._apply(operation, args)
+            self._lsn = lsn
+
+    def _mutated(self, operation: str, table_name: str, *args) -> None:
+        self.dirty = True
+        self.version = next(_versions)
+        if self._wal is not None:
+            with self._log_lock:
+                self._lsn += 1
+                record = [self._lsn, operation, table_name, *args]
+                if self._wal_buffer is None:
+                    self._wal.write(record)
+                else:
+                    self._wal_buffer.append(record)
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        with self.lock.write():
+            self._check_open()
+            yield
+
+    def _check_open(self) -> None:
+        if self.closed:
+            # an evicted or deleted database must not take writes that nothing will persist
+            raise ValueError(f'Database {self.name} is closed; get it from the DBMS again')
+
+    def _written(self) -> None:
+        self._checkpoint_if_due()
+
+    def _checkpoint_if_due(self) -> None:
+        if self._wal is None or self._checkpoint_every is None or self._wal.records < self._checkpoint_every \
+                or self.lock.held():
+            return
+        with self._persist_lock:
+            if self._wal is not None and self._wal.records >= self._checkpoint_every:
+                self.checkpoint()
+
+    def dirty_bytes(self) -> int:
+        with self.lock.read():
+            if self._wal is not None:
+                return self._wal.size
+            tables = [table for table in self._tables.values() if table is not None and table.dirty]
+        return sum(table.estimated_size() for table in tables)
+
+    def snapshot(self):
+        with self.lock.write():
+            tables = {name: None if table is None else table.snapshot() for name, table in self._tables.items()}
+            return DatabaseSnapshot(self.name, self._lsn, self.version, self.dirty, tables, dict(self._table_jsons))
 
     def to_json(self) -> dict:
-        tables = dict()
-        for name, table in self._tables.items():
-            tables[name] = table.to_json()
-
-        result = dict()
-        result[Database.name_field] = self.name
-        result[Database.tables_field] = tables
-
-        return result
+        with self.snapshot() as snapshot:
+            return snapshot.to_json()
 
     @classmethod
-    def from_json(cls, json_obj):
+    def from_json(cls, json_obj, lazy: bool = False):
         result = cls(json_obj[Database.name_field])
         for name, table_json in json_obj[Database.tables_field].items():
-            result._tables[name] = Table.from_json(table_json)
+            if lazy:
+                result._tables[name] = None
+                result._table_jsons[name] = table_json
+            else:
+                table = Table.from_json(table_json)
+                table._database = result
+                result._tables[name] = table
+        result._lsn = json_obj.get(Database.lsn_field, 0)
         return result
 
     @staticmethod
-    def load(path: str):
+    def load(path: str, lazy: bool = False):
         assert_exists(path)
         assert_is_file(path)
 
-        with open(path) as read_stream:
-            json_obj = json.load(read_stream)
+        sections = dict()
+        binary = BinaryFormat.is_binary(path)
+        unparsed = None if binary or not lazy else Database._read_unparsed(path)
+        if binary:
+            result = BinaryFormat.read(path)
+            sections = result._table_sections
+        elif unparsed is not None:
+            result, sections = unparsed
+        elif os.path.getsize(path) >= Database.streaming_threshold:
+            with open(path) as read_stream:
+                result = JsonStreamReader(read_stream).read_database()
+        else:
+            with open(path) as read_stream:
+                json_obj = json.load(read_stream)
+            result = Database.from_json(json_obj, lazy)
+        result._mark_clean(path, sections)
+        return result
+
+    @staticmethod
+    def _read_unparsed(path: str):
+        # files written with an indent of 4 hold each table on lines of its own, closed by the first line that
+        # is a brace indented by 8, so the text of every table is found without parsing it
+        with open(path, 'rb') as read_stream:
+            mapped = mmap.mmap(read_stream.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        tables = Database._tables_pattern.search(view)
+        if tables is None:
+            return None
+        sections = dict()
+        position = tables.end()
+        while True:
+            name = Database._table_name_pattern.match(view, position)
+            if name is None:
+                break
+            start = name.end() - 1
+            end = Database._find_unparsed_end(mapped, start)
+            if end < 0:
+                return None
+            end += len(b'\n        }')
+            sections[json.loads(name.group(1))] = (start, end - start)
+            position = end
+        close = Database._tables_end_pattern.match(view, position)
+        if close is None:
+            return None
+        header = json.loads(bytes(view[:tables.end()]) + b'}' + bytes(view[close.end():]))
+
+        result = Database(header[Database.name_field])
+        for name, (offset, length) in sections.items():
+            result._tables[name] = None
+            result._table_jsons[name] = view[offset:offset + length]
+        result._lsn = header.get(Database.lsn_field, 0)
+        return result, sections
+
+    @staticmethod
+    def _find_unparsed_end(mapped: mmap.mmap, start: int) -> int:
+        marker = b'\n        }'
+        while True:
+            end = mapped.find(marker, start, start + Database.scan_window + len(marker))
+            if hasattr(mmap, 'MADV_DONTNEED'):
+                # pages already searched stay cached by the system without counting towards this process
+                page = start - start % mmap.PAGESIZE
+                mapped.madvise(mmap.MADV_DONTNEED, page, min(start + Database.scan_window, len(mapped)) - page)
+            if end >= 0 or start + Database.scan_window >= len(mapped):
+                return end
+            start += Database.scan_window
 
-            return Database.from_json(json_obj)
+    @staticmethod
+    def _table_json(table_json) -> dict:
+        # a table of a lazily loaded JSON file stays text in the mapped file until it is first used
+        return json.loads(bytes(table_json)) if isinstance(table_json, memoryview) else table_json
+
+    def export_json(self, path: str) -> None:
+        if os.path.isdir(path):
+            raise ValueError(f'Path {path} points to directory')
+        write_atomically(path, lambda write_stream: write_stream.write(json.dumps(self.to_json(), indent=4).encode()))
 
     def persist(self, path: str) -> None:
         if os.path.isdir(path):
             raise ValueError(f'Path {path} points to directory')
+        with self._persist_lock, self.snapshot() as snapshot:
+            self._persist_snapshot(path, snapshot)
+
+    def _persist_snapshot(self, path: str, snapshot) -> None:
+        reusable = path == self._file_path and os.path.isfile(path)
+        if reusable and not snapshot.dirty:
+            return
+        # sections of a previous file are only reused by the same format
+        reusable = reusable and BinaryFormat.is_binary(path) == (self.file_format == 'binary')
+        sections = dict()
+
+        if self.file_format == 'binary':
+            def write_binary(write_stream: BinaryIO):
+                previous = open(path, 'rb') if reusable else None
+                try:
+                    sections.update(BinaryFormat.write(snapshot, write_stream, previous, self._table_sections))
+                finally:
+                    if previous is not None:
+                        previous.close()
+
+            write_atomically(path, write_binary)
+            self._mark_clean(path, sections, snapshot)
+            return
+
+        def write(write_stream: BinaryIO):
+            previous = open(path, 'rb') if reusable else None
+            try:
+                write_stream.write('{{\n    "{}": {},\n    "{}": {{'.format(
+                    Database.name_field, json.dumps(snapshot.name), Database.tables_field).encode())
+                for i, (name, table) in enumerate(snapshot.tables.items()):
+                    write_stream.write('{}\n        {}: '.format(',' if i else '', json.dumps(name)).encode())
+                    start = write_stream.tell()
+                    clean = table is None or not table.dirty
+                    if previous is not None and clean and name in self._table_sections:
+                        Database._copy_section(previous, write_stream, *self._table_sections[name])
+                    elif table is None and isinstance(snapshot.table_jsons[name], memoryview):
+                        write_stream.write(snapshot.table_jsons[name])
+                    elif table is None:
+                        table_json = snapshot.table_jsons[name]
+                        write_stream.write(json.dumps(table_json, indent=4).replace('\n', '\n        ').encode())
+                    else:
+                        Database._write_table_json(write_stream, table)
+                    sections[name] = (start, write_stream.tell() - start)
+                write_stream.write('\n    }'.encode())
+                if snapshot.lsn:
+                    write_stream.write(',\n    "{}": {}'.format(Database.lsn_field, snapshot.lsn).encode())
+                write_stream.write('\n}'.encode())
+            finally:
+                if previous is not None:
+                    previous.close()
+
+        write_atomically(path, write)
+        self._mark_clean(path, sections, snapshot)
+
+    @staticmethod
+    def _write_table_json(write_stream: BinaryIO, table: TableSnapshot) -> None:
+        # same text as dumping the whole table, but written a chunk of rows at a time
+        header = json.dumps(table.to_json([]), indent=4).replace('\n', '\n        ')
+        write_stream.write(header[:header.rindex('[]') + 1].encode())
+        separator = ''
+        after_id = None
+        while True:
+            rows = table.page(after_id, TableSnapshot.chunk_size)
+            if not rows:
+                break
+            text = json.dumps([row.to_json() for row in rows], indent=4)
+            write_stream.write((separator + text[1:-2].replace('\n', '\n            ')).encode())
+            separator = ','
+            after_id = rows[-1].id
+        write_stream.write('{}]\n        }}'.format('\n            ' if separator else '').encode())
 
-        with open(path, 'w') as write_stream:
-            json.dump(self.to_json(), write_stream, indent=4)
+    @staticmethod
+    def _copy_section(read_stream: BinaryIO, write_stream: BinaryIO, offset: int, length: int) -> None:
+        read_stream.seek(offset)
+        while length > 0:
+            chunk = read_stream.read(min(length, 1 << 20))
+            if not chunk:
+                raise ValueError(f'Database file {read_stream.name} was modified externally')
+            write_stream.write(chunk)
+            length -= len(chunk)
+
+    def _mark_clean(self, path: str, sections: dict, snapshot=None) -> None:
+        with self.lock.write():
+            # only what the persisted snapshot covers is clean, later writes keep their tables dirty
+            self.dirty = snapshot is not None and snapshot.version != self.version
+            self._file_path = path
+            self._table_sections = sections
+            unparsed = [name for name, table_json in self._table_jsons.items()
+                        if isinstance(table_json, memoryview) and name in sections]
+            if snapshot is not None and unparsed and self.file_format == 'json':
+                # unparsed tables move to the file just written, the old one is not kept mapped
+                with open(path, 'rb') as read_stream:
+                    view = memoryview(mmap.mmap(read_stream.fileno(), 0, access=mmap.ACCESS_READ))
+                for name in unparsed:
+                    offset, length = sections[name]
+                    self._table_jsons[name] = view[offset:offset + length]
+            for name, table in self._tables.items():
+                if table is None:
+                    continue
+                pinned = None if snapshot is None else snapshot.tables.get(name)
+                if snapshot is None or (pinned is not None and pinned.version == table.version):
+                    table.dirty = False
 
     def __eq__(self, o: object) -> bool:
         if isinstance(o, Database):
@@ -471,51 +3513,349 @@ class Database:
         return False
 
 
+def _load_database_bytes(path: str):
+    database = Database.load(path)
+    stream = io.BytesIO()
+    try:
+        with database.snapshot() as snapshot:
+            BinaryFormat.write(snapshot, stream)
+    except ValueError:
+        # values that do not fit the binary layout, the database is loaded in the parent instead
+        return None
+    return stream.getvalue(), database.file_format
+
+
 class DBMS:
     _default_data_location = '/home/semen/lib/Xdatabse'
 
-    def __init__(self, path: str = _default_data_location) -> None:
+    def __init__(self, path: str = _default_data_location, wal: bool = False,
+                 sync_every: int = 1, checkpoint_every: int = 10000,
+                 lazy: bool = False, memory_budget: int = None, file_format: str = 'json',
+                 workers: int = 1, join_memory_budget: int = None) -> None:
         pathvalidate.validate_filepath(path)
+        if file_format not in Database.file_formats:
+            raise ValueError(f'Unknown file format {file_format}; expected one of {Database.file_formats}')
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 1:
+            raise ValueError(f'Invalid number of workers {workers}')
+        if join_memory_budget is not None and join_memory_budget < 1:
+            raise ValueError(f'Invalid join memory budget {join_memory_budget}')
         if not os.path.exists(path):
             os.mkdir(path)
         self._path = path
         self._databases = dict()
-
+        self._deleted = set()
+        self._wal = wal
+        self._sync_every = sync_every
+        self._checkpoint_every = checkpoint_every
+        self._lazy = lazy
+        self._memory_budget = memory_budget
+        self._file_format = file_format
+        self._workers = workers
+        # joins spill past their own budget, memory_budget only decides which databases stay loaded
+        self._join_memory_budget = join_memory_budget
+        self._loaded_sizes = OrderedDict()
+        self.lock = ReadWriteLock()
+
+    @_writing
     def create_database(self, name: str):
         if name in self._databases:
             raise ValueError('Database with name {} already exits'.format(name))
-        result = Database(name)
+        for suffix in (WriteAheadLog.suffix, _temp_suffix):
+            if name.endswith(suffix):
+                raise ValueError(f'Database name {name} should not end with {suffix}')
+        result = Database(name, self._file_format)
+        self._deleted.discard(name)
+        if self._wal:
+            result.enable_wal(os.path.join(self._path, name), self._sync_every, self._checkpoint_every)
         self._databases[name] = result
         return result
 
     def get_database(self, name: str) -> Database:
+        with self.lock.read():
+            if name not in self._databases:
+                raise ValueError('Database with name {} does not exist'.format(name))
+            database = self._databases[name]
+            if database is not None and name in self._loaded_sizes:
+                self._loaded_sizes.move_to_end(name)
+        if database is None:
+            database = self._load_unloaded_database(name)
+        return database
+
+    @_writing
+    def _load_unloaded_database(self, name: str) -> Database:
         if name not in self._databases:
             raise ValueError('Database with name {} does not exist'.format(name))
-        return self._databases[name]
+        database = self._databases[name]
+        if database is None:
+            database = self._load_database(name)
+        return database
+
+    def _write_lock(self):
+        return self.lock.write()
 
+    def _written(self) -> None:
+        pass
+
+    @_writing
     def delete_database(self, name: str) -> None:
         if name not in self._databases:
             raise ValueError('Database with name {} does not exist'.format(name))
-        del self._databases[name]
-
+        database = self._databases.pop(name)
+        self._loaded_sizes.pop(name, None)
+        self._deleted.add(name)
+        if database is not None:
+            database.close()
+        if self._wal:
+            self._remove_deleted()
+
+    @_reading
     def get_databases_names(self):
         return list(self._databases.keys())
 
+    @_reading
+    def get_loaded_databases_names(self):
+        return [name for name, database in self._databases.items() if database is not None]
+
+    @property
+    @_reading
+    def dirty(self) -> bool:
+        return bool(self._deleted) or any(database is not None and database.dirty
+                                          for database in self._databases.values())
+
+    def dirty_bytes(self) -> int:
+        with self.lock.read():
+            databases = [database for database in self._databases.values() if database is not None]
+        return sum(database.dirty_bytes() for database in databases)
+
     @staticmethod
-    def load(path: str = _default_data_location):
+    def load(path: str = _default_data_location, wal: bool = False,
+             sync_every: int = 1, checkpoint_every: int = 10000,
+             lazy: bool = False, memory_budget: int = None, file_format: str = 'json', workers: int = 1,
+             join_memory_budget: int = None):
         assert_exists(path)
         assert_is_dir(path)
 
-        result = DBMS(path)
+        result = DBMS(path, wal, sync_every, checkpoint_every, lazy, memory_budget, file_format, workers,
+                      join_memory_budget)
+        names = list()
         for file_name in os.listdir(path):
             abs_path = os.path.join(path, file_name)
-            if os.path.isfile(abs_path):
-                result._databases[file_name] = Database.load(abs_path)
+            if os.path.isfile(abs_path) and not file_name.endswith((WriteAheadLog.suffix, _temp_suffix)):
+                result._databases[file_name] = None
+                names.append(file_name)
+        if not lazy:
+            result._load_databases(names)
+
+        return result
 
+    def _load_databases(self, names: List[str]) -> None:
+        parallel = [name for name in names if not BinaryFormat.is_binary(os.path.join(self._path, name))]
+        if self._workers > 1 and len(parallel) > 1:
+            try:
+                # forking a process that runs server threads can copy locks held by them, so workers are spawned
+                executor = ProcessPoolExecutor(min(self._workers, len(parallel)),
+                                               mp_context=multiprocessing.get_context('spawn'))
+            except (OSError, NotImplementedError):
+                executor = None
+            if executor is not None:
+                with executor:
+                    paths = [os.path.join(self._path, name) for name in parallel]
+                    # workers parse and convert, the result comes back as a binary database image
+                    for name, path, loaded in zip(parallel, paths, executor.map(_load_database_bytes, paths)):
+                        if loaded is None:
+                            continue
+                        data, file_format = loaded
+                        database = BinaryFormat.read_buffer(memoryview(data), path)
+                        database.file_format = file_format
+                        database._mark_clean(path, dict())
+                        self._open_database(name, database)
+        for name in names:
+            if self._databases[name] is None:
+                self._load_database(name)
+
+    def _load_database(self, name: str) -> Database:
+        return self._open_database(name, Database.load(os.path.join(self._path, name), self._lazy))
+
+    def _open_database(self, name: str, database: Database) -> Database:
+        path = os.path.join(self._path, name)
+        if not database.file_format == self._file_format:
+            database.file_format = self._file_format
+            database.dirty = True
+        if os.path.isfile(path + WriteAheadLog.suffix):
+            database.replay(path + WriteAheadLog.suffix)
+        if self._wal:
+            database.enable_wal(path, self._sync_every, self._checkpoint_every)
+        self._databases[name] = database
+        self._loaded_sizes[name] = os.path.getsize(path)
+        self._evict(name)
+        return database
+
+    def _evict(self, keep: str) -> None:
+        if self._memory_budget is None:
+            return
+        loaded_size = sum(self._loaded_sizes.values())
+        for name in list(self._loaded_sizes):
+            if loaded_size <= self._memory_budget:
+                break
+            database = self._databases[name]
+            if name == keep or (database.dirty and database._wal is None):
+                continue
+            database.close()
+            self._databases[name] = None
+            loaded_size -= self._loaded_sizes.pop(name)
+
+    def join_tables(self, database_name: str, table_name: str, other_table_name: str, column_name: str,
+                    new_name: str = None, memory_budget: int = None) -> Table:
+        database = self.get_database(database_name)
+        table = database.get_table(table_name)
+        other_table = database.get_table(other_table_name)
+        result = table.join(other_table, column_name, new_name, spill_path=self._path,
+                            memory_budget=self._join_memory_budget if memory_budget is None else memory_budget)
+        database.add_table(result)
+        self._persist_database(database_name, database)
         return result
 
     def persist(self) -> None:
-        shutil.rmtree(self._path, ignore_errors=True)
-        os.mkdir(self._path)
-        for database_name, database in self._databases.items():
-            database.persist(os.path.join(self._path, database_name))
+        with self.lock.read():
+            if not os.path.exists(self._path):
+                os.mkdir(self._path)
+            databases = [(name, database) for name, database in self._databases.items() if database is not None]
+        # the lock is not held while writing, a queued writer would otherwise stall every reader
+        if self._workers > 1 and len(databases) > 1:
+            with ThreadPoolExecutor(min(self._workers, len(databases))) as executor:
+                futures = [executor.submit(self._persist_database, name, database)
+                           for name, database in databases]
+            for future in futures:
+                future.result()
+        else:
+            for name, database in databases:
+                self._persist_database(name, database)
+        with self.lock.write():
+            self._remove_deleted()
+
+    def _persist_database(self, name: str, database: Database) -> None:
+        with database._persist_lock:
+            # deleted or evicted since the list was taken
+            if database.closed:
+                return
+            if self._wal:
+                database.checkpoint()
+            else:
+                database.persist(os.path.join(self._path, name))
+
+    def _remove_deleted(self) -> None:
+        for name in self._deleted:
+            path = os.path.join(self._path, name)
+            for file_path in (path, path + WriteAheadLog.suffix):
+                if os.path.isfile(file_path):
+                    os.remove(file_path)
+        self._deleted.clear()
+        sync_directory(self._path)
+
+    @_writing
+    def close(self) -> None:
+        for database in self._databases.values():
+            if database is not None:
+                database.close()
+
+
+class Checkpointer:
+    def __init__(self, dbms: DBMS, interval: float = 60, dirty_bytes: int = 16 << 20,
+                 poll_interval: float = 1) -> None:
+        if interval is not None and interval <= 0:
+            raise ValueError(f'Invalid checkpoint interval {interval}')
+        if poll_interval <= 0:
+            raise ValueError(f'Invalid poll interval {poll_interval}')
+        self.dbms = dbms
+        self.interval = interval
+        self.dirty_bytes = dirty_bytes
+        self.poll_interval = poll_interval
+        self.last_checkpoint = None
+        self.last_duration = None
+        self.last_error = None
+        self.checkpoints = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._running = False
+        self._requested = 0
+        self._completed = 0
+        self._last_start = time.monotonic()
+
+    def start(self) -> None:
+        with self._condition:
+            if self._thread is not None:
+                raise ValueError('Checkpointer is already running')
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='checkpointer', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._condition:
+            thread = self._thread
+            self._stopped = True
+            self._condition.notify_all()
+        if thread is not None:
+            thread.join()
+        self._thread = None
+
+    def request(self, wait: bool = False, timeout: float = None) -> None:
+        with self._condition:
+            if self._thread is None:
+                raise ValueError('Checkpointer is not running')
+            self._requested += 1
+            ticket = self._requested
+            self._condition.notify_all()
+            if not wait:
+                return
+            if not self._condition.wait_for(lambda: self._completed >= ticket or self._stopped, timeout):
+                raise ValueError(f'Checkpoint did not finish within {timeout} seconds')
+            if self._completed < ticket:
+                raise ValueError('Checkpointer was stopped before the checkpoint finished')
+            if self.last_error is not None:
+                raise ValueError(f'Checkpoint failed: {self.last_error}')
+
+    def status(self) -> dict:
+        with self._condition:
+            return {'running': self._running,
+                    'pending': self._requested > self._completed,
+                    'checkpoints': self.checkpoints,
+                    'last_checkpoint': self.last_checkpoint,
+                    'last_duration': self.last_duration,
+                    'last_error': self.last_error}
+
+    def _due(self) -> bool:
+        if self._requested > self._completed:
+            return True
+        if self.interval is not None and time.monotonic() - self._last_start >= self.interval and self.dbms.dirty:
+            return True
+        # after a failure only requests and the interval retry, so a full disk is not hammered
+        return self.last_error is None and self.dirty_bytes is not None \
+            and self.dbms.dirty_bytes() >= self.dirty_bytes
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopped and not self._due():
+                    self._condition.wait(self.poll_interval)
+                if self._stopped:
+                    return
+                ticket = self._requested
+                self._running = True
+            start = time.monotonic()
+            error = None
+            try:
+                self.dbms.persist()
+            except Exception as e:
+                error = str(e)
+            with self._condition:
+                self._running = False
+                self._last_start = start
+                self.last_duration = time.monotonic() - start
+                self.last_checkpoint = time.time()
+                self.last_error = error
+                self.checkpoints += 1
+                self._completed = ticket
+                self._condition.notify_all()
@@ -1,8 +1,19 @@
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from datetime import datetime
 
 from pathvalidate import ValidationError
 
-from database import Char, TimeInterval, Color, ColorInterval, Time, ColumnTypes, Table, TableRow, Database, DBMS
+from database import Char, TimeInterval, Color, ColorInterval, Time, ColumnTypes, Table, TableRow, Database, DBMS, \
+    WriteAheadLog, JsonStreamReader, LruCache, ReadWriteLock, Checkpointer, BinaryFormat
 
 
 class CharTest(unittest.TestCase):
@@ -22,12 +33,23 @@ class CharTest(unittest.TestCase):
         self.assertEqual('\u00df', str(Char('\u00df')))
         self.assertEqual('\u00e4', str(Char('\u00e4')))
 
+    def test_hash(self):
+        self.assertEqual(hash(Char('a')), hash(Char('a')))
+        self.assertEqual({Char('a')}, {Char('a'), Char('a')})
+
     def test_eq(self):
         self.assertEqual(Char('a'), Char('a'))
         self.assertEqual(Char(' '), Char(' '))
         self.assertNotEqual(Char('\n'), Char('s'))
         self.assertNotEqual(Char('p'), Char('\t'))
 
+    def test_interned(self):
+        self.assertIs(Char('a'), Char('a'))
+        self.assertIs(Char('a'), pickle.loads(pickle.dumps(Char('a'))))
+        self.assertEqual(Char('\u4e2d'), pickle.loads(pickle.dumps(Char('\u4e2d'))))
+        self.assertRaises(AttributeError, setattr, Char('a'), 'value', 'b')
+        self.assertFalse(hasattr(Char('a'), '__dict__'))
+
 
 class ColorTest(unittest.TestCase):
     def test_init(self):
@@ -44,6 +66,10 @@ class ColorTest(unittest.TestCase):
         self.assertNotEqual(Color('#ffffff'), Color('#000000'))
         self.assertNotEqual(Color('#000000'), Color('#ffffff'))
 
+    def test_hash(self):
+        self.assertEqual(hash(Color('#00000a')), hash(Color('#00000A')))
+        self.assertLess(Color('#000000'), Color('#000001'))
+
     def test_str(self):
         self.assertEqual('#000000', str(Color('#000000')))
         self.assertEqual('#ffffff', str(Color('#ffffff')))
@@ -58,15 +84,28 @@ class ColorIntervalTest(unittest.TestCase):
         self.assertRaises(ValueError, ColorInterval, ['000000', '#ffffff'])
         self.assertRaises(ValueError, ColorInterval, ['#0000000', '#ffffff'])
         self.assertRaises(ValueError, ColorInterval, ['#0000g0', '#ffffff'])
+        self.assertEqual(ColorInterval(['#000000', '#ffffff']), ColorInterval('["#000000", "#ffffff"]'))
+        self.assertRaises(ValueError, ColorInterval, '["#000000"')
+        self.assertRaisesRegex(ValueError, 'Color interval .* format is not correct', ColorInterval, '#000000')
+        self.assertRaisesRegex(ValueError, 'Color interval .* format is not correct', ColorInterval, '5')
 
     def test_eq(self):
         self.assertEqual(ColorInterval(['#000000', '#ffffff']), ColorInterval(['#000000', '#ffffff']))
         self.assertNotEqual(ColorInterval(['#000000', '#ffffff']), ColorInterval(['#000001', '#ffffff']))
 
+    def test_hash(self):
+        self.assertEqual(hash(ColorInterval(['#000000', '#ffffff'])), hash(ColorInterval(['#000000', '#FFFFFF'])))
+
     def test_str(self):
         self.assertEqual('["#000000", "#ffffff"]', str(ColorInterval(['#000000', '#ffffff'])))
         self.assertEqual('["#000000", "#000000"]', str(ColorInterval(['#000000', '#000000'])))
 
+    def test_pickle(self):
+        interval = ColorInterval(['#000001', '#ffffff'])
+        self.assertEqual(interval, pickle.loads(pickle.dumps(interval)))
+        self.assertEqual(Color('#0000ff'), pickle.loads(pickle.dumps(Color('#0000ff'))))
+        self.assertRaises(AttributeError, setattr, interval, 'start', 0)
+
 
 class TimeTest(unittest.TestCase):
     def test_init(self):
@@ -87,11 +126,36 @@ class TimeTest(unittest.TestCase):
         self.assertEqual(Time('23:0:0'), Time('23:00:00'))
         self.assertNotEqual(Time('23:0:0'), Time('22:0:0'))
 
+    def test_hash(self):
+        self.assertEqual(hash(Time('1:2:3')), hash(Time('01:02:03')))
+        self.assertLess(Time('1:2:3'), Time('1:2:4'))
+
     def test_str(self):
         self.assertEqual('23:00:00', str(Time('23:0:0')))
         self.assertEqual('23:00:00', str(Time('23:00:00')))
         self.assertEqual('01:02:03', str(Time('1:2:3')))
 
+    def test_parse_seconds(self):
+        for time in ['1:2:3', '01:02:03', '23:59:59', '1:2:3\n', ' 1:2:3', '00:00:60', '24:00:00', '1:2', '001:2:3',
+                     '+1:2:3', '', '\u0661:\u0662:\u0663', None]:
+            try:
+                expected = Time.seconds_of_day(datetime.strptime(time, Time.time_format))
+            except (TypeError, ValueError) as e:
+                with self.assertRaises(type(e)) as context:
+                    Time.parse_seconds(time)
+                self.assertEqual(str(e), str(context.exception))
+            else:
+                self.assertEqual(expected, Time.parse_seconds(time))
+        for seconds in range(0, 86400, 7):
+            self.assertEqual(Time.time_of_day(seconds).strftime(Time.time_format), Time.format_seconds(seconds))
+
+    def test_seconds(self):
+        self.assertEqual(3723, Time('1:2:3').seconds)
+        self.assertEqual(Time('1:2:3'), Time.from_seconds(3723))
+        self.assertEqual(Time('1:2:3'), pickle.loads(pickle.dumps(Time('1:2:3'))))
+        self.assertRaises(AttributeError, setattr, Time('1:2:3'), 'seconds', 0)
+        self.assertFalse(hasattr(Time('1:2:3'), '__dict__'))
+
 
 class TimeIntervalTest(unittest.TestCase):
     def test_init(self):
@@ -100,16 +164,29 @@ class TimeIntervalTest(unittest.TestCase):
         self.assertRaises(ValueError, TimeInterval, ['17:18:11', ' '])
         self.assertRaises(ValueError, TimeInterval, ['17:18:11', '1711.126812'])
         self.assertRaises(ValueError, TimeInterval, ['17:18:11', '17:18:10'])
+        self.assertEqual(TimeInterval(['17:18:11', '17:18:12']), TimeInterval('["17:18:11", "17:18:12"]'))
+        self.assertRaisesRegex(ValueError, 'should consist of 2 elements', TimeInterval, '17:18:11')
+        self.assertRaisesRegex(ValueError, 'should consist of 2 elements', TimeInterval, '["17:18:11"]')
 
     def test_str(self):
         self.assertEqual('["17:18:11", "17:18:11"]', str(TimeInterval(['17:18:11', '17:18:11'])))
         self.assertEqual('["00:00:00", "23:00:00"]', str(TimeInterval(['0:0:0', '23:0:0'])))
         self.assertEqual('["22:00:03", "22:00:04"]', str(TimeInterval(['22:0:3', '22:0:4'])))
 
+    def test_hash(self):
+        self.assertEqual(hash(TimeInterval(['7:18:11', '17:18:11'])), hash(TimeInterval(['07:18:11', '17:18:11'])))
+
     def test_eq(self):
         self.assertEqual(TimeInterval(['17:18:11', '17:18:11']), TimeInterval(['17:18:11', '17:18:11']))
         self.assertNotEqual(TimeInterval(['17:18:11', '17:18:12']), TimeInterval(['17:18:11', '17:18:11']))
 
+    def test_seconds(self):
+        interval = TimeInterval(['0:1:0', '1:0:0'])
+        self.assertEqual((60, 3600), (interval.start, interval.end))
+        self.assertEqual(interval, TimeInterval.from_seconds(60, 3600))
+        self.assertEqual(interval, pickle.loads(pickle.dumps(interval)))
+        self.assertRaises(AttributeError, setattr, interval, 'start', 0)
+
 
 class ColumnsTypesTest(unittest.TestCase):
 
@@ -154,6 +231,30 @@ class ColumnsTypesTest(unittest.TestCase):
     "timeinvl"
 ]''')
 
+    def test_compiled(self):
+        types = ColumnTypes([int, float, str, Char, Time])
+        self.assertIs(types._convert, ColumnTypes([int, float, str, Char, Time])._convert)
+        self.assertEqual([1, 1.5, 'a', Char('b'), Time('1:2:3')], types.convert(['1', '1.5', 'a', 'b', '1:2:3']))
+        types.verify([1, 1.5, 'a', Char('b'), Time('1:2:3')])
+        with self.assertRaises(ValueError) as context:
+            types.verify([1, 1.5, 'a', 'b', Time('1:2:3')])
+        self.assertEqual("element 3 in row has invalid type <class 'str'>; expected: <class 'database.Char'>",
+                         str(context.exception))
+        with self.assertRaises(ValueError) as context:
+            types.convert(['1'])
+        self.assertEqual("Length of row ['1'] does not match number of columns in the table", str(context.exception))
+        self.assertRaises(ValueError, types.verify, [1, 1.5, 'a', Char('b')])
+        self.assertEqual([], ColumnTypes([]).convert([]))
+        ColumnTypes([]).verify([])
+
+    def test_convert_column_values(self):
+        types = ColumnTypes([int, Time])
+        self.assertEqual([1, 2, 1], types.convert_column_values(0, ['1', '2', '1']))
+        times = types.convert_column_values(1, ['1:2:3', '01:02:03', '1:2:3'])
+        self.assertEqual([Time('1:2:3')] * 3, times)
+        self.assertIs(times[0], times[2])
+        self.assertRaises(ValueError, types.convert_column_values, 1, ['1:2:3', '25:0:0'])
+
 
 class TableTest(unittest.TestCase):
 
@@ -173,6 +274,414 @@ class TableTest(unittest.TestCase):
         self.assertTrue([1, 4, 'str1'] in rows_data)
         self.assertTrue([2, 3, 'str2'] in rows_data)
 
+    def test_join_algorithms(self):
+        table1 = Table('table1', ['c1', 'c2'], ColumnTypes([Char, int]))
+        for c, i in [('b', 1), ('a', 2), ('b', 3), ('c', 4)]:
+            table1.append_row([Char(c), i])
+        table2 = Table('table2', ['c3', 'c1'], ColumnTypes([str, Char]))
+        for s, c in [('x', 'b'), ('y', 'a'), ('z', 'b')]:
+            table2.append_row([s, Char(c)])
+
+        expected = [[Char('b'), 1, 'x'], [Char('b'), 1, 'z'], [Char('a'), 2, 'y'],
+                    [Char('b'), 3, 'x'], [Char('b'), 3, 'z']]
+        for algorithm in Table.join_algorithms:
+            table3 = table1.join(table2, 'c1', algorithm=algorithm)
+            self.assertEqual(['c1', 'c2', 'c3'], table3.columns_names)
+            self.assertEqual(expected, [row.data for row in table3.rows])
+            self.assertEqual(list(range(5)), [row.id for row in table3.rows])
+            self.assertEqual(expected[:2], [row.data for row in table1.join(table2, 'c1', algorithm=algorithm,
+                                                                            limit=2).rows])
+
+        self.assertRaises(ValueError, table1.join, table2, 'c1', algorithm='nested')
+        self.assertRaises(ValueError, table1.join, table2, 'c1', algorithm='parallel')
+        self.assertRaises(ValueError, table1.join, table2, 'c1', limit=-1)
+
+        table4 = Table('table4', ['c2'], ColumnTypes([str]))
+        table4.append_row(['1'])
+        self.assertRaises(ValueError, table1.join, table4, 'c2', algorithm='merge')
+        self.assertEqual([], table1.join(table4, 'c2').rows)
+
+    def test_join_limit(self):
+        for keys, other_keys in (([i * 7 % 11 for i in range(40)], [i % 13 for i in range(30)]),
+                                 ([i % 5 for i in range(8)], [i * 3 % 7 for i in range(30)]),
+                                 (sorted(i % 6 for i in range(20)), [i % 4 for i in range(25)])):
+            expected = Table._hash_join(keys, other_keys)
+            for limit in (0, 1, 7, len(expected) + 1):
+                self.assertEqual(expected[:limit], Table._hash_join(keys, other_keys, limit))
+                self.assertEqual(expected[:limit], Table._merge_join(keys, other_keys, limit))
+
+        # a limited probe stops before the keys it does not need
+        self.assertRaises(TypeError, Table._hash_join, [1, 2, [3]], [1, 2])
+        self.assertEqual([(0, 0)], Table._hash_join([1, 2, [3]], [1, 2], 1))
+
+    def test_page(self):
+        for storage in Table.storages:
+            table = Table('table', ['c1', 'c2'], ColumnTypes([int, str]), storage=storage)
+            table.append_rows([[i, str(i)] for i in range(20)])
+            for row_id in (0, 5, 6, 7, 19):
+                table.delete_row(row_id)
+
+            self.assertEqual(table.rows, table.page())
+            self.assertEqual([1, 2, 3], [row.id for row in table.page(limit=3)])
+            self.assertEqual([8, 9], [row.id for row in table.page(4, 2)])
+            self.assertEqual([8, 9], [row.id for row in table.page(6, 2)])
+            self.assertEqual([18], [row.id for row in table.page(17)])
+            self.assertEqual([], table.page(18))
+            self.assertEqual([1], [row.id for row in table.page(-1, 1)])
+            self.assertEqual([], table.page(limit=0))
+            self.assertRaises(ValueError, table.page, limit=-1)
+
+            after_id, ids = None, list()
+            while True:
+                rows = table.page(after_id, 4)
+                if not rows:
+                    break
+                ids.extend(row.id for row in rows)
+                after_id = rows[-1].id
+            self.assertEqual([row.id for row in table.rows], ids)
+
+    def test_get_row(self):
+        table = Table('table', ['c1', 'c2'], ColumnTypes([int, str]))
+        table.append_row([1, 'a'])
+        table.append_row([2, 'b'])
+
+        self.assertEqual(TableRow(1, [2, 'b']), table.get_row(1))
+        self.assertRaises(ValueError, table.get_row, 2)
+
+    def test_update_row_sql(self):
+        table = Table('table', ['c1', 'c2'], ColumnTypes([int, str]))
+        table.append_row([1, 'a'])
+
+        table.update_row_sql(0, 'c1:5,c2:b')
+        self.assertEqual(TableRow(0, [5, 'b']), table.get_row(0))
+        self.assertRaises(ValueError, table.update_row_sql, 1, 'c1:5')
+        self.assertRaises(ValueError, table.update_row_sql, 0, 'c3:5')
+
+    def test_delete_row(self):
+        table = Table('table', ['c1'], ColumnTypes([int]))
+        for i in range(3000):
+            table.append_row([i])
+
+        self.assertEqual(TableRow(1, [1]), table.delete_row(1))
+        self.assertRaises(ValueError, table.delete_row, 1)
+        self.assertRaises(ValueError, table.get_row, 1)
+
+        for i in range(2, 2500):
+            table.delete_row(i)
+        self.assertEqual([0] + list(range(2500, 3000)), [row.id for row in table.rows])
+        self.assertEqual(TableRow(2999, [2999]), table.get_row(2999))
+
+        table.append_row([3000])
+        self.assertEqual(TableRow(3000, [3000]), table.rows[-1])
+
+    def test_append_rows(self):
+        for storage in Table.storages:
+            table = Table('table', ['c1', 'c2'], ColumnTypes([int, Time]), storage=storage)
+            table.create_index('c1')
+            table.append_row([7, Time('1:0:0')])
+            self.assertEqual([TableRow(1, [1, Time('1:2:3')]), TableRow(2, [2, Time('1:2:3')])],
+                             table.append_rows_str([['1', '1:2:3'], ['2', '01:02:03']]))
+            self.assertEqual([3], [row.id for row in table.append_rows([[3, Time('0:0:0')]])])
+            self.assertEqual([], table.append_rows([]))
+
+            self.assertRaises(ValueError, table.append_rows_str, [['4', '1:2:3'], ['5', '25:0:0']])
+            self.assertRaises(ValueError, table.append_rows_str, [['4', '1:2:3'], ['5']])
+            self.assertRaises(ValueError, table.append_rows, [[4, Time('1:2:3')], [5, '1:2:3']])
+            self.assertRaises(ValueError, table.append_rows, [[4, Time('1:2:3')], [2 ** 70, Time('1:2:3')]]
+                              if storage == 'columnar' else [[4]])
+            self.assertEqual([0, 1, 2, 3], [row.id for row in table.rows])
+            self.assertEqual(4, table.id_counter)
+            self.assertEqual([], table.lookup('c1', 4))
+            self.assertEqual([5], [row.id for row in table.append_rows([[4, Time('1:2:3')], [5, Time('1:2:3')]])][1:])
+
+
+class ColumnarStorageTest(unittest.TestCase):
+    types = ColumnTypes([int, float, str, Char, Color, ColorInterval, Time, TimeInterval])
+
+    def _table(self, storage):
+        table = Table('table', ['c1', 'c2', 'c3', 'c4', 'c5', 'c6', 'c7', 'c8'], self.types, storage=storage)
+        table.append_row_str(['1', '1.5', 'str', 'a', '#0000ff', '["#000000", "#ffffff"]', '1:2:3',
+                              '["00:00:00", "23:59:59"]'])
+        table.append_row_str(['-2', '0', '\u00df\u00e4', '\u00df', '#ffffff', '["#000001", "#000002"]',
+                              '23:59:59', '["10:00:00", "11:00:00"]'])
+        return table
+
+    def test_rows(self):
+        self.assertEqual(self._table('row'), self._table('columnar'))
+        self.assertEqual(self._table('row').to_json()['rows'], self._table('columnar').to_json()['rows'])
+        self.assertEqual('columnar', Table.from_json(self._table('columnar').to_json()).storage)
+        self.assertRaises(ValueError, Table, 'table', [], ColumnTypes([]), storage='unknown')
+
+    def test_update_and_delete(self):
+        table = self._table('columnar')
+        table.update_row_sql(1, 'c1:7,c3:updated,c5:#000000')
+        self.assertEqual([7, 'updated', Color('#000000')], [table.get_row(1).data[i] for i in (0, 2, 4)])
+
+        self.assertEqual(TableRow(0, self._table('row').get_row(0).data), table.delete_row(0))
+        self.assertEqual([1], [row.id for row in table.rows])
+        self.assertEqual([7], table.column_values('c1'))
+
+        for i in range(2000):
+            table.append_row(list(table.get_row(1).data))
+        for i in range(2, 1800):
+            table.delete_row(i)
+        self.assertEqual([1] + list(range(1800, 2002)), [row.id for row in table.rows])
+        self.assertEqual('updated', table.get_row(2001).data[2])
+
+    def test_overflow(self):
+        table = Table('table', ['c1', 'c2'], ColumnTypes([str, int]), storage='columnar')
+        self.assertRaises(ValueError, table.append_row, ['a', 2 ** 70])
+        self.assertEqual([], table.rows)
+        table.append_row(['a', 1])
+        self.assertEqual([TableRow(0, ['a', 1])], table.rows)
+
+    def test_join(self):
+        table1 = Table('table1', ['c1', 'c2'], ColumnTypes([int, Time]), storage='columnar')
+        table1.append_row([1, Time('1:0:0')])
+        table1.append_row([2, Time('2:0:0')])
+        table2 = Table('table2', ['c2', 'c3'], ColumnTypes([Time, str]))
+        table2.append_row([Time('2:0:0'), 'two'])
+
+        self.assertEqual([[2, Time('2:0:0'), 'two']], [row.data for row in table1.join(table2, 'c2').rows])
+
+
+class IndexTest(unittest.TestCase):
+
+    def _table(self, storage):
+        table = Table('table', ['c1', 'c2', 'c3'], ColumnTypes([int, str, Time]), storage=storage)
+        for i in range(20):
+            table.append_row([i % 7, str(i % 3), Time.from_seconds(i * 600)])
+        return table
+
+    def test_lookup(self):
+        for storage in Table.storages:
+            for kind in ('hash', 'ordered'):
+                indexed = self._table(storage)
+                indexed.create_index('c1', kind)
+                scanned = self._table(storage)
+                self.assertEqual({'c1': kind}, indexed.get_indexes())
+                self.assertEqual(scanned.lookup('c1', 3), indexed.lookup('c1', 3))
+                self.assertEqual([3, 10, 17], [row.id for row in indexed.lookup('c1', 3)])
+
+                for table in (indexed, scanned):
+                    table.append_row([3, 'x', Time('1:0:0')])
+                    table.update_row_sql(10, 'c1:4')
+                    table.delete_row(17)
+                    table.update_row_sql(11, 'c2:y')
+                self.assertEqual([3, 20], [row.id for row in indexed.lookup('c1', 3)])
+                self.assertEqual(scanned.lookup('c1', 4), indexed.lookup('c1', 4))
+                self.assertEqual(scanned.lookup_range('c1', 2, 4), indexed.lookup_range('c1', 2, 4))
+                self.assertEqual([], indexed.lookup('c1', 100))
+
+    def test_lookup_range(self):
+        table = self._table('row')
+        table.create_index('c3', 'ordered')
+        self.assertEqual([1, 2, 3], [row.id for row in table.lookup_range('c3', Time('0:10:0'), Time('0:30:0'))])
+        self.assertEqual([2], [row.id for row in table.lookup_range('c3', Time('0:10:0'), Time('0:30:0'),
+                                                                     include_low=False, include_high=False)])
+        self.assertEqual([18, 19], [row.id for row in table.lookup_range('c3', low=Time('3:0:0'))])
+        self.assertEqual([0, 1], [row.id for row in table.lookup_range('c3', high=Time('0:15:0'))])
+        self.assertEqual([0, 7, 14], [row.id for row in table.lookup_str('c1', '0')])
+        self.assertEqual([5, 6, 12, 13, 19], [row.id for row in table.lookup_str('c1', low='5')])
+        self.assertEqual(table.lookup_range('c1', 1, 2), table.lookup_str('c1', low='1', high='2'))
+
+        self.assertRaises(ValueError, table.lookup_range, 'c2', '1', '2')
+        self.assertRaises(ValueError, table.lookup_str, 'c1')
+        self.assertRaises(ValueError, table.lookup, 'c4', 1)
+        self.assertRaises(ValueError, table.create_index, 'c2', 'ordered')
+        self.assertRaises(ValueError, table.create_index, 'c2', 'btree')
+        self.assertRaises(ValueError, table.create_index, 'c3')
+        self.assertRaises(ValueError, table.drop_index, 'c1')
+        table.drop_index('c3')
+        self.assertEqual(dict(), table.get_indexes())
+
+    def test_ordered_updates(self):
+        indexed = Table('table', ['c1'], ColumnTypes([int]))
+        indexed.create_index('c1', 'ordered')
+        index = indexed._index('c1')
+        index.bucket_size = 4
+        scanned = Table('table', ['c1'], ColumnTypes([int]))
+        for i in range(300):
+            for table in (indexed, scanned):
+                table.append_row([(i * 7919) % 101])
+                if i % 5 == 0:
+                    table._set_values(i, {0: 50})
+                if i % 3 == 0:
+                    table.delete_row(i // 2)
+        self.assertTrue(all(0 < len(bucket) <= 8 for bucket in index._buckets))
+        for low, high in ((None, None), (0, 0), (50, 50), (10, 60), (None, 20), (90, None), (200, 300), (60, 10)):
+            for include_low, include_high in ((True, True), (False, False)):
+                self.assertEqual(scanned.lookup_range('c1', low, high, include_low, include_high),
+                                 indexed.lookup_range('c1', low, high, include_low, include_high))
+        self.assertEqual(scanned.lookup('c1', 50), indexed.lookup('c1', 50))
+        self.assertTrue(indexed.lookup('c1', 50))
+        for row_id in [row.id for row in indexed.rows]:
+            indexed.delete_row(row_id)
+        self.assertEqual(([], []), (index._buckets, indexed.lookup_range('c1', 0, 100)))
+
+    def test_interval(self):
+        for storage in Table.storages:
+            indexed = Table('table', ['c1', 'c2'], ColumnTypes([TimeInterval, ColorInterval]), storage=storage)
+            for i in range(200):
+                start = (i * 7919) % 80000
+                indexed.append_row([TimeInterval.from_seconds(start, start + (i * 31) % 5000),
+                                    ColorInterval.from_ints(i, i + i % 10)])
+            scanned = Table.from_json(indexed.to_json())
+            indexed.create_index('c1', 'interval')
+            indexed.create_index('c2', 'interval')
+
+            for table in (indexed, scanned):
+                table.delete_row(5)
+                table._set_values(6, {1: ColorInterval.from_ints(0, 255)})
+                table.append_row([TimeInterval.from_seconds(0, 86399), ColorInterval.from_ints(0, 0)])
+            for point in (0, 1, 4000, 40000, 86399):
+                expected = scanned.lookup_containing('c1', Time.from_seconds(point))
+                self.assertEqual(expected, indexed.lookup_containing('c1', Time.from_seconds(point)))
+                self.assertEqual([row.id for row in scanned.rows if row.data[0].start <= point <= row.data[0].end],
+                                 [row.id for row in expected])
+            for low, high in ((0, 0), (100, 2000), (50000, 50100), (86000, 86399)):
+                interval = TimeInterval.from_seconds(low, high)
+                self.assertEqual(scanned.lookup_overlapping('c1', interval), indexed.lookup_overlapping('c1', interval))
+            self.assertEqual([0, 6, 200], [row.id for row in indexed.lookup_containing('c2', Color('#000000'))])
+            self.assertEqual([6, 7, 8, 9, 11],
+                             [row.id for row in indexed.lookup_str('c2', overlaps='["#00000b", "#00000b"]')])
+            self.assertEqual(scanned.lookup_str('c2', overlaps='["#000010", "#000020"]'),
+                             indexed.lookup_str('c2', overlaps='["#000010", "#000020"]'))
+            self.assertEqual([200], [row.id for row in indexed.lookup_str('c1', contains='23:59:59')])
+            self.assertEqual([9], [row.id for row in indexed.lookup('c2', ColorInterval.from_ints(9, 18))])
+
+        self.assertRaises(ValueError, indexed.lookup_containing, 'c1', Color('#000000'))
+        self.assertRaises(ValueError, indexed.lookup_overlapping, 'c2', TimeInterval.from_seconds(0, 1))
+
+    def test_interval_updates(self):
+        indexed = Table('table', ['c1'], ColumnTypes([TimeInterval]))
+        indexed.create_index('c1', 'interval')
+        index = indexed._index('c1')
+        index.bucket_size = 4
+        scanned = Table('table', ['c1'], ColumnTypes([TimeInterval]))
+        for i in range(300):
+            for table in (indexed, scanned):
+                start = (i * 7919) % 80000
+                table.append_row([TimeInterval.from_seconds(start, start + (i * 31) % 5000)])
+                if i % 5 == 0:
+                    table._set_values(i, {0: TimeInterval.from_seconds(0, 0)})
+                if i % 3 == 0:
+                    table.delete_row(i // 2)
+        for table in (indexed, scanned):
+            table.append_rows([[TimeInterval.from_seconds(i * 1000, 86000)] for i in range(3)])
+        self.assertTrue(all(len(bucket) <= 8 for bucket in index._buckets))
+        self.assertEqual([bucket[-1][0] for bucket in index._ends],
+                         [max(end for _, end, _ in bucket) for bucket in index._buckets])
+        self.assertEqual(max(end for bucket in index._buckets for _, end, _ in bucket), index._tree[1])
+        for low, high in ((0, 0), (100, 2000), (50000, 50100), (86000, 86399), (0, 86399), (85000, 85000),
+                          (79999, 80001)):
+            interval = TimeInterval.from_seconds(low, high)
+            self.assertEqual(scanned.lookup_overlapping('c1', interval), indexed.lookup_overlapping('c1', interval))
+        zero = TimeInterval.from_seconds(0, 0)
+        self.assertEqual(scanned.lookup('c1', zero), indexed.lookup('c1', zero))
+        self.assertTrue(indexed.lookup('c1', zero))
+        self.assertRaises(ValueError, self._table('row').lookup_containing, 'c3', Time('1:0:0'))
+        self.assertRaises(ValueError, self._table('row').create_index, 'c3', 'interval')
+
+    def test_persist(self):
+        table = self._table('columnar')
+        table.create_index('c1', 'ordered')
+        table.create_index('c2')
+        table_json = table.to_json()
+        self.assertEqual({'c1': 'ordered', 'c2': 'hash'}, table_json['indexes'])
+        self.assertNotIn('indexes', self._table('row').to_json())
+
+        loaded = Table.from_json(table_json)
+        self.assertEqual(table.get_indexes(), loaded.get_indexes())
+        self.assertFalse(loaded._indexes['c1'].built)
+        self.assertEqual(table.lookup('c2', '1'), loaded.lookup('c2', '1'))
+        self.assertTrue(loaded._indexes['c2'].built)
+
+
+class SelectTest(unittest.TestCase):
+
+    def _table(self, storage):
+        table = Table('table', ['c1', 'c2', 'c3'], ColumnTypes([int, str, Time]), storage=storage)
+        for i in range(20):
+            table.append_row([i % 7, str(i % 3), Time.from_seconds(i * 600)])
+        return table
+
+    def test_select(self):
+        for storage in Table.storages:
+            for indexes in (dict(), {'c1': 'hash'}, {'c1': 'ordered', 'c3': 'ordered'}):
+                table = self._table(storage)
+                for column_name, kind in indexes.items():
+                    table.create_index(column_name, kind)
+
+                self.assertEqual(table.rows, list(table.select()))
+                self.assertEqual([TableRow(3, ['0', 3]), TableRow(10, ['1', 3]), TableRow(17, ['2', 3])],
+                                 list(table.select(['c2', 'c1'], [('c1', '=', 3)])))
+                self.assertEqual([3, 10, 17, 4, 11, 18],
+                                 [row.id for row in table.select(['c1'], [('c1', '>=', 3), ('c1', '<', 5)],
+                                                                 order_by='c1')])
+                self.assertEqual([6, 13, 12, 19, 5],
+                                 [row.id for row in table.select(where=[('c1', '>', 4)], order_by=['-c1', 'c2'])])
+                self.assertEqual([9, 2], [row.id for row in table.select(where=[('c1', '=', 2), ('c2', '!=', '1')],
+                                                                         order_by='-c3')])
+                self.assertEqual([7, 8, 9], [row.id for row in table.select(order_by='c3', limit=3, offset=7)])
+                self.assertEqual([0, 7, 14], [row.id for row in table.select(order_by='c1', limit=3)])
+                self.assertEqual([], list(table.select(where=[('c1', '=', 100)])))
+                self.assertEqual([], list(table.select(limit=0)))
+
+    def test_lazy(self):
+        for storage in Table.storages:
+            table = self._table(storage)
+            expected = [row.id for row in table.select(where=[('c1', '<', 3)], order_by='c2')]
+            rows = table.select(where=[('c1', '<', 3)], order_by='c2')
+            self.assertEqual((), table._snapshots)
+            self.assertEqual(expected[0], next(rows).id)
+            self.assertEqual(1, len(table._snapshots))
+
+            table.delete_row(expected[1])
+            table.update_row_sql(expected[2], 'c1:5')
+            table.append_row([0, '0', Time.from_seconds(0)])
+            self.assertEqual(expected[1:], [row.id for row in rows])
+            self.assertEqual((), table._snapshots)
+
+    def test_materialized(self):
+        for storage in Table.storages:
+            table = self._table(storage)
+            rows = [table.get_row(3), table.page(2, 1)[0], table.lookup('c1', 3)[0], table.rows[3]]
+            table.update_row_sql(3, 'c2:x')
+            for row_id in range(3):
+                table.delete_row(row_id)
+            self.assertEqual([TableRow(3, [3, '0', Time.from_seconds(1800)])] * 4, rows)
+
+    def test_parse_where(self):
+        table = self._table('row')
+        self.assertEqual([('c1', '>=', 3), ('c3', '<', Time('1:0:0')), ('c2', '!=', '1')],
+                         table.parse_where('c1>=3, c3<1:0:0,c2!=1'))
+        self.assertEqual([1, 2], [row.id for row in table.select(where=table.parse_where('c3>0:0:0,c3<=0:20:0'))])
+        self.assertRaises(ValueError, table.parse_where, 'c1~3')
+        self.assertRaises(ValueError, table.parse_where, 'c4=3')
+        self.assertRaises(ValueError, table.parse_where, 'c1=a')
+
+    def test_invalid(self):
+        table = self._table('row')
+        self.assertRaises(ValueError, table.select, ['c4'])
+        self.assertRaises(ValueError, table.select, where=[('c1', '~', 3)])
+        self.assertRaises(ValueError, table.select, order_by='-c4')
+        self.assertRaises(ValueError, table.select, limit=-1)
+        self.assertRaises(ValueError, table.select, offset=-1)
+
+    def test_statistics(self):
+        path = tempfile.mkdtemp()
+        try:
+            database = Database('db', file_format='binary')
+            database.add_table(self._table('columnar'))
+            database.persist(os.path.join(path, 'db'))
+            table = Database.load(os.path.join(path, 'db')).get_table('table')
+            table._storage.ids = lambda: self.fail('table was scanned')
+            self.assertEqual([], list(table.select(where=[('c1', '>', 6)])))
+            self.assertEqual([], list(table.select(where=[('c3', '<', Time('0:0:0'))])))
+        finally:
+            shutil.rmtree(path)
+
 
 class TableRowTest(unittest.TestCase):
 
@@ -269,5 +778,1064 @@ class DBMSTest(unittest.TestCase):
                 print(table.to_json())
 
 
+class IncrementalPersistTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_persist_dirty(self):
+        dbms = DBMS(self.path)
+        db1 = dbms.create_database('db1')
+        db1.add_table(Table('table1', ['c1'], ColumnTypes([int])))
+        db1.add_table(Table('table2', ['c1', 'c2'], ColumnTypes([str, TimeInterval])))
+        db1.get_table('table2').append_row(['a\nb', TimeInterval(['1:0:0', '2:0:0'])])
+        dbms.create_database('db2')
+        dbms.persist()
+        self.assertFalse(db1.dirty)
+        self.assertFalse(db1.get_table('table1').dirty)
+
+        db2_inode = os.stat(os.path.join(self.path, 'db2')).st_ino
+        db1.get_table('table1').append_row([1])
+        self.assertTrue(db1.dirty)
+        self.assertFalse(db1.get_table('table2').dirty)
+        dbms.persist()
+        db1.get_table('table1').delete_row(0)
+        db1.get_table('table1').append_row([2])
+        dbms.persist()
+
+        self.assertEqual(db2_inode, os.stat(os.path.join(self.path, 'db2')).st_ino)
+        self.assertEqual(db1.to_json(), DBMS.load(self.path).get_database('db1').to_json())
+
+        dbms.delete_database('db2')
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'db2')))
+        dbms.persist()
+        self.assertEqual(['db1'], os.listdir(self.path))
+
+    def test_persist_loaded(self):
+        dbms = DBMS(self.path)
+        database = dbms.create_database('db')
+        database.add_table(Table('table1', ['c1'], ColumnTypes([int])))
+        database.add_table(Table('table2', ['c1'], ColumnTypes([int])))
+        dbms.persist()
+
+        loaded = DBMS.load(self.path)
+        self.assertFalse(loaded.get_database('db').dirty)
+        loaded.get_database('db').get_table('table2').append_row([1])
+        loaded.persist()
+        loaded.get_database('db').get_table('table1').append_row([2])
+        loaded.persist()
+
+        self.assertEqual(loaded.get_database('db').to_json(), DBMS.load(self.path).get_database('db').to_json())
+
+
+class LazyLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        dbms = DBMS(self.path)
+        for name in ('db1', 'db2', 'db3'):
+            database = dbms.create_database(name)
+            for table_name in ('table1', 'table2'):
+                table = Table(table_name, ['c1'], ColumnTypes([Time]))
+                table.append_row([Time('1:2:3')])
+                database.add_table(table)
+        dbms.persist()
+        self.expected = dbms.get_database('db1').to_json()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_lazy(self):
+        dbms = DBMS.load(self.path, lazy=True)
+        self.assertEqual(['db1', 'db2', 'db3'], sorted(dbms.get_databases_names()))
+        self.assertEqual([], dbms.get_loaded_databases_names())
+
+        database = dbms.get_database('db1')
+        self.assertEqual(['db1'], dbms.get_loaded_databases_names())
+        self.assertEqual([None, None], list(database._tables.values()))
+        self.assertIsInstance(database._table_jsons['table1'], memoryview)
+        self.assertEqual(self.expected, database.to_json())
+
+        database.get_table('table2').append_row([Time('3:2:1')])
+        self.assertIsNone(database._tables['table1'])
+        dbms.persist()
+        with open(os.path.join(self.path, 'db1'), 'rb') as read_stream:
+            offset, length = database._table_sections['table1']
+            read_stream.seek(offset)
+            self.assertEqual(read_stream.read(length), bytes(database._table_jsons['table1']))
+        self.assertEqual(self.expected['tables']['table1'], database.get_table('table1').to_json())
+        database.drop_table('table1')
+        self.assertEqual(['table2'], database.get_tables_names())
+
+        self.assertEqual(2, len(DBMS.load(self.path).get_database('db1').get_table('table2').rows))
+
+    def test_unparsed(self):
+        path = os.path.join(self.path, 'db1')
+        with open(path) as read_stream:
+            text = read_stream.read()
+        database = Database.load(path, lazy=True)
+        self.assertEqual(['table1', 'table2'], database.get_tables_names())
+        self.assertEqual(self.expected, database.to_json())
+
+        window = Database.scan_window
+        try:
+            Database.scan_window = 8
+            self.assertEqual(self.expected, Database.load(path, lazy=True).to_json())
+        finally:
+            Database.scan_window = window
+
+        # other layouts are parsed as a whole
+        with open(path, 'w') as write_stream:
+            json.dump(json.loads(text), write_stream)
+        database = Database.load(path, lazy=True)
+        self.assertIsInstance(database._table_jsons['table1'], dict)
+        self.assertEqual(self.expected, database.to_json())
+
+    def test_memory_budget(self):
+        size = os.path.getsize(os.path.join(self.path, 'db1'))
+        dbms = DBMS.load(self.path, lazy=True, memory_budget=2 * size)
+
+        dbms.get_database('db1').get_table('table1').append_row([Time('3:2:1')])
+        dbms.get_database('db2')
+        dbms.get_database('db3')
+        self.assertEqual(['db1', 'db3'], sorted(dbms.get_loaded_databases_names()))
+
+        dbms.persist()
+        dbms.get_database('db2')
+        self.assertEqual(['db2', 'db3'], sorted(dbms.get_loaded_databases_names()))
+        self.assertEqual(2, len(dbms.get_database('db1').get_table('table1').rows))
+
+    def test_evicted_writes(self):
+        size = os.path.getsize(os.path.join(self.path, 'db1'))
+        dbms = DBMS.load(self.path, wal=True, lazy=True, memory_budget=size)
+        database = dbms.get_database('db1')
+        table = database.get_table('table1')
+        table.append_row([Time('3:2:1')])
+        dbms.get_database('db2')
+        self.assertEqual(['db2'], dbms.get_loaded_databases_names())
+
+        self.assertRaises(ValueError, table.append_row, [Time('4:0:0')])
+        self.assertRaises(ValueError, database.drop_table, 'table2')
+        self.assertEqual([Time('1:2:3'), Time('3:2:1')],
+                         dbms.get_database('db1').get_table('table1').column_values('c1'))
+        dbms.close()
+
+
+class ParallelDBMSTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        dbms = DBMS(self.path)
+        for i in range(4):
+            database = dbms.create_database(f'db{i}')
+            table = Table('table1', ['c1', 'c2', 'c3'], ColumnTypes([int, Time, ColorInterval]),
+                          storage='columnar' if i % 2 else 'row')
+            for j in range(50):
+                table.append_row([i * j, Time.from_seconds(j), ColorInterval.from_ints(j, 2 * j)])
+            table.delete_row(3)
+            table.create_index('c1', 'ordered')
+            database.add_table(table)
+            database.add_table(Table('table2', ['c1'], ColumnTypes([str])))
+        dbms.get_database('db3').get_table('table2').append_row([str(2 ** 70)])
+        dbms.get_database('db2').get_table('table1').append_row([2 ** 70, Time('1:0:0'), ColorInterval.from_ints(0, 0)])
+        dbms.persist()
+        self.expected = {name: dbms.get_database(name).to_json() for name in dbms.get_databases_names()}
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_load(self):
+        dbms = DBMS.load(self.path, workers=3)
+        self.assertEqual(self.expected,
+                         {name: dbms.get_database(name).to_json() for name in dbms.get_databases_names()})
+        for name in dbms.get_databases_names():
+            database = dbms.get_database(name)
+            self.assertEqual('json', database.file_format)
+            self.assertFalse(database.dirty)
+            self.assertEqual(51 if name == 'db2' else 50, database.get_table('table1').id_counter)
+        self.assertEqual([2], [row.id for row in dbms.get_database('db1').get_table('table1').lookup('c1', 2)])
+
+    def test_persist(self):
+        dbms = DBMS.load(self.path, workers=4)
+        for name in dbms.get_databases_names():
+            dbms.get_database(name).get_table('table2').append_row_str(['new'])
+        dbms.persist()
+
+        loaded = DBMS.load(self.path)
+        self.assertEqual({name: dbms.get_database(name).to_json() for name in dbms.get_databases_names()},
+                         {name: loaded.get_database(name).to_json() for name in loaded.get_databases_names()})
+        self.assertRaises(ValueError, DBMS, self.path, workers=0)
+
+
+class SpillingJoinTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.table1 = Table('table1', ['c1', 'c2'], ColumnTypes([str, int]))
+        self.table1.append_rows([[str(i * 7 % 101), i] for i in range(3000)])
+        self.table2 = Table('table2', ['c3', 'c1'], ColumnTypes([Time, str]), storage='columnar')
+        self.table2.append_rows([[Time.from_seconds(i), str(i % 131)] for i in range(500)])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    @staticmethod
+    def _sorted(rows):
+        return sorted([str(value) for value in row] for row in rows)
+
+    def test_join_rows(self):
+        for table, other_table in ((self.table1, self.table2), (self.table2, self.table1)):
+            expected = SpillingJoinTest._sorted(row.data for row in table.join(other_table, 'c1').rows)
+            self.assertEqual(expected, SpillingJoinTest._sorted(table.join_rows(other_table, 'c1')))
+            self.assertEqual(expected, SpillingJoinTest._sorted(
+                table.join_rows(other_table, 'c1', memory_budget=1 << 30, spill_path=self.path)))
+
+            result_rows = table.join_rows(other_table, 'c1', memory_budget=4096, spill_path=self.path)
+            first = next(result_rows)
+            spilled = os.listdir(self.path)
+            self.assertEqual(1, len(spilled))
+            self.assertGreater(len(os.listdir(os.path.join(self.path, spilled[0]))), 2)
+            self.assertEqual(expected, SpillingJoinTest._sorted([first, *result_rows]))
+            self.assertEqual([], os.listdir(self.path))
+
+    def test_join(self):
+        expected = SpillingJoinTest._sorted(row.data for row in self.table1.join(self.table2, 'c1').rows)
+        result = self.table1.join(self.table2, 'c1', 'result', memory_budget=4096, spill_path=self.path)
+        self.assertEqual('result', result.name)
+        self.assertEqual(['c1', 'c2', 'c3'], result.columns_names)
+        self.assertEqual(len(expected), result.id_counter)
+        self.assertEqual(expected, SpillingJoinTest._sorted(row.data for row in result.rows))
+        self.assertTrue(result._storage.mapped)
+        limited = self.table1.join(self.table2, 'c1', memory_budget=4096, spill_path=self.path, limit=10)
+        self.assertEqual(10, len(limited.rows))
+        self.assertEqual([], os.listdir(self.path))
+
+        self.assertRaises(ValueError, self.table1.join, self.table2, 'c1', memory_budget=4096, algorithm='merge')
+        self.assertRaises(ValueError, self.table1.join_rows, self.table2, 'c1', memory_budget=0)
+        self.assertRaises(ValueError, self.table1.join_rows, self.table2, 'c2')
+
+    def test_skew(self):
+        self.table1.append_rows([['hot', i] for i in range(1000)])
+        self.table2.append_rows([[Time.from_seconds(i), 'hot'] for i in range(100)])
+        expected = SpillingJoinTest._sorted(row.data for row in self.table1.join(self.table2, 'c1').rows)
+        spill = Table._spill
+        fan_outs = list()
+        try:
+            Table.max_spill_partitions = 2
+            Table._spill = staticmethod(lambda *args: fan_outs.append((args[2], args[4])) or spill(*args))
+            result_rows = self.table1.join_rows(self.table2, 'c1', memory_budget=4096, spill_path=self.path)
+            self.assertEqual(expected, SpillingJoinTest._sorted(result_rows))
+        finally:
+            Table.max_spill_partitions = 64
+            Table._spill = staticmethod(spill)
+        self.assertEqual({2}, {partitions for partitions, _ in fan_outs})
+        depths = {depth for _, depth in fan_outs}
+        self.assertIn(1, depths)
+        self.assertLessEqual(max(depths), Table.max_spill_depth)
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_dbms_join_tables(self):
+        dbms = DBMS(self.path, memory_budget=1 << 30, join_memory_budget=4096)
+        database = dbms.create_database('db')
+        database.add_table(self.table1)
+        database.add_table(self.table2)
+        expected = SpillingJoinTest._sorted(row.data for row in self.table1.join(self.table2, 'c1').rows)
+
+        self.assertTrue(dbms.join_tables('db', 'table1', 'table2', 'c1', 'result')._storage.mapped)
+        self.assertEqual(['db'], os.listdir(self.path))
+        result = DBMS.load(self.path).get_database('db').get_table('result')
+        self.assertEqual(expected, SpillingJoinTest._sorted(row.data for row in result.rows))
+
+        # the database cache budget does not make joins spill, a budget passed per call does
+        dbms = DBMS.load(self.path, memory_budget=4096)
+        self.assertFalse(dbms.join_tables('db', 'table1', 'table2', 'c1', 'unspilled')._storage.mapped)
+        self.assertTrue(dbms.join_tables('db', 'table1', 'table2', 'c1', 'spilled', memory_budget=4096)._storage.mapped)
+        self.assertRaises(ValueError, DBMS, self.path, join_memory_budget=0)
+
+
+class VersionTest(unittest.TestCase):
+
+    def test_table_version(self):
+        database = Database('db')
+        table = Table('table', ['c1', 'c2'], ColumnTypes([int, str]))
+        database.add_table(table)
+        versions = [(table.version, database.version)]
+
+        def assert_bumped():
+            versions.append((table.version, database.version))
+            self.assertLess(versions[-2][0], versions[-1][0])
+            self.assertLess(versions[-2][1], versions[-1][1])
+
+        table.append_row([1, 'a'])
+        assert_bumped()
+        table.append_rows([[2, 'b'], [3, 'c']])
+        assert_bumped()
+        table.update_row_sql(0, 'c2:d')
+        assert_bumped()
+        table.delete_row(1)
+        assert_bumped()
+        table.create_index('c1')
+        assert_bumped()
+        table.drop_index('c1')
+        assert_bumped()
+
+        table.to_json()
+        table.select(where=[('c1', '>', 1)])
+        table.page(limit=1)
+        self.assertEqual(versions[-1], (table.version, database.version))
+
+        self.assertRaises(ValueError, table.delete_row, 1)
+        self.assertEqual(versions[-1], (table.version, database.version))
+
+        other = Table('table', ['c1', 'c2'], ColumnTypes([int, str]))
+        self.assertLess(table.version, other.version)
+        database.drop_table('table')
+        self.assertLess(versions[-1][1], database.version)
+
+    def test_replay(self):
+        path = tempfile.mkdtemp()
+        try:
+            database = Database('db')
+            database.enable_wal(os.path.join(path, 'db'))
+            table = Table('table', ['c1'], ColumnTypes([int]))
+            database.add_table(table)
+            database.checkpoint()
+            table.append_row([1])
+            database.disable_wal()
+
+            loaded = Database.load(os.path.join(path, 'db'))
+            loaded_table = loaded.get_table('table')
+            version, table_version = loaded.version, loaded_table.version
+            loaded.replay(os.path.join(path, 'db') + WriteAheadLog.suffix)
+            self.assertLess(version, loaded.version)
+            self.assertLess(table_version, loaded_table.version)
+
+            database.enable_wal(os.path.join(path, 'db'))
+            large = Table('large', ['c1'], ColumnTypes([int]))
+            large.append_rows([[i] for i in range(2500)])
+            large.delete_row(5)
+            records = database._wal.records
+            database.add_table(large)
+            self.assertEqual(records + 3, database._wal.records)
+            database.disable_wal()
+            loaded.replay(os.path.join(path, 'db') + WriteAheadLog.suffix)
+            self.assertEqual(large.rows, loaded.get_table('large').rows)
+            self.assertEqual(large.id_counter, loaded.get_table('large').id_counter)
+        finally:
+            shutil.rmtree(path)
+
+
+class ReadWriteLockTest(unittest.TestCase):
+
+    def test_readers_share(self):
+        lock = ReadWriteLock()
+        inside = threading.Barrier(3, timeout=5)
+
+        def read():
+            with lock.read():
+                inside.wait()
+
+        threads = [threading.Thread(target=read) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        inside.wait()
+        for thread in threads:
+            thread.join()
+
+    def test_writer_excludes(self):
+        lock = ReadWriteLock()
+        events = list()
+        lock.acquire_read()
+        writer = threading.Thread(target=lambda: lock.write().__enter__() or events.append('write'))
+        writer.start()
+        writer.join(0.1)
+        self.assertEqual([], events)
+        events.append('read')
+        lock.release_read()
+        writer.join(5)
+        self.assertEqual(['read', 'write'], events)
+
+    def test_reentrant(self):
+        lock = ReadWriteLock()
+        with lock.write():
+            with lock.write(), lock.read():
+                self.assertTrue(lock.held())
+        self.assertFalse(lock.held())
+        with lock.read(), lock.read():
+            self.assertRaises(ValueError, lock.acquire_write)
+
+    def test_concurrent_table(self):
+        path = tempfile.mkdtemp()
+        try:
+            dbms = DBMS(path, wal=True, checkpoint_every=50)
+            database = dbms.create_database('db')
+            table = Table('table', ['c1', 'c2'], ColumnTypes([int, str]), storage='columnar')
+            database.add_table(table)
+            table.create_index('c1', 'ordered')
+            errors = list()
+
+            def write(offset):
+                try:
+                    for i in range(100):
+                        row = table.append_row([offset + i, str(i)])
+                        if i % 3 == 0:
+                            table.delete_row(row.id)
+                except Exception as e:
+                    errors.append(e)
+
+            def read():
+                try:
+                    for _ in range(30):
+                        table.to_json()
+                        list(table.select(where=[('c1', '>=', 100)], order_by='c1'))
+                        table.lookup_range('c1', 0, 1000)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=write, args=(i * 1000,)) for i in range(3)]
+            threads.extend(threading.Thread(target=read) for _ in range(3))
+            switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+            try:
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            finally:
+                sys.setswitchinterval(switch_interval)
+
+            self.assertEqual([], errors)
+            self.assertEqual(3 * 66, len(table.rows))
+            self.assertEqual(sorted(table.column_values('c1')), sorted(row.data[0] for row in table.lookup_range('c1')))
+            dbms.persist()
+            dbms.close()
+            loaded = DBMS.load(path).get_database('db').get_table('table')
+            self.assertEqual(table.rows, loaded.rows)
+        finally:
+            shutil.rmtree(path)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    @staticmethod
+    def _table(storage):
+        table = Table('table', ['c1', 'c2', 'c3'], ColumnTypes([int, str, TimeInterval]), storage=storage)
+        table.append_rows([[i, str(i), TimeInterval.from_seconds(i, 2 * i)] for i in range(10)])
+        return table
+
+    def test_isolation(self):
+        for storage in Table.storages:
+            table = SnapshotTest._table(storage)
+            expected = table.to_json()
+            with table.snapshot() as snapshot:
+                stored = table._storage
+                table.append_row([10, 'a', TimeInterval.from_seconds(0, 0)])
+                table.update_row_sql(3, 'c2:b')
+                table.delete_row(4)
+                self.assertIs(stored, table._storage)
+                self.assertEqual([3, 4], sorted(snapshot._versions))
+
+                self.assertEqual(expected, snapshot.to_json())
+                self.assertEqual(list(range(10)), snapshot.column_values('c1'))
+                self.assertEqual([3], [row.id for row in snapshot.page(2, 1)])
+                self.assertEqual(['3'], [row.data[1] for row in snapshot.page(2, 1)])
+                self.assertEqual(['b'], [row.data[1] for row in table.page(2, 1)])
+                self.assertEqual(10, len(table.rows))
+                self.assertEqual(10, len(snapshot))
+                self.assertEqual([4, 5], [row.id for row in snapshot.page(3, 2)])
+
+            table.update_row_sql(5, 'c2:c')
+            self.assertEqual((), table._snapshots)
+            self.assertIs(stored, table._storage)
+
+    def test_chunks(self):
+        for storage in Table.storages:
+            table = SnapshotTest._table(storage)
+            expected = table.to_json()
+            snapshot = table.snapshot()
+            snapshot.chunk_size = 3
+            rows = iter(snapshot)
+            self.assertEqual([0, 1], [next(rows).id for _ in range(2)])
+            for row_id in (2, 3, 6, 7, 9):
+                table.delete_row(row_id)
+            table.update_row_sql(8, 'c2:x')
+            table.append_row([10, 'a', TimeInterval.from_seconds(0, 0)])
+
+            self.assertEqual(list(range(2, 10)), [row.id for row in rows])
+            self.assertEqual(expected, snapshot.to_json())
+            self.assertEqual([6, 7, 8], [row.id for row in snapshot.page(5, 3)])
+            self.assertEqual('8', snapshot.page(7, 1)[0].data[1])
+            snapshot.release()
+            with self.assertRaises(ValueError):
+                snapshot.page()
+
+    def test_select(self):
+        for storage in Table.storages:
+            table = SnapshotTest._table(storage)
+            table.create_index('c1', 'ordered')
+            with table.snapshot() as snapshot:
+                expected = [TableRow(row_id, [str(row_id)]) for row_id in (9, 8, 7)]
+                self.assertEqual(expected, list(snapshot.select(['c2'], [('c1', '>', 6)], '-c1')))
+                table.delete_row(8)
+                table.update_row_sql(7, 'c1:1')
+                table.append_row([20, 'a', TimeInterval.from_seconds(0, 0)])
+                self.assertEqual(expected, list(snapshot.select(['c2'], [('c1', '>', 6)], '-c1')))
+                self.assertEqual([1, 7], [row.id for row in table.select(where=[('c1', '=', 1)])])
+                self.assertEqual([1], [row.id for row in snapshot.select(where=[('c1', '=', 1)])])
+                self.assertRaises(ValueError, snapshot.select, ['c4'])
+
+    def test_mapped(self):
+        database = Database('db', file_format='binary')
+        database.add_table(SnapshotTest._table('columnar'))
+        path = os.path.join(self.path, 'db')
+        database.persist(path)
+
+        table = Database.load(path).get_table('table')
+        self.assertTrue(table._storage.mapped)
+        expected = table.to_json()
+        with table.snapshot() as snapshot:
+            table.update_row_sql(1, 'c2:x')
+            table.delete_row(0)
+            self.assertEqual(expected, snapshot.to_json())
+        self.assertEqual(['x'], [row.data[1] for row in table.page(limit=1)])
+
+    def test_checkpoint_keeps_later_records(self):
+        dbms = DBMS(self.path, wal=True)
+        database = dbms.create_database('db')
+        table = SnapshotTest._table('row')
+        database.add_table(table)
+
+        persist_snapshot = database._persist_snapshot
+
+        def persist_while_writing(path, snapshot):
+            table.append_row([100, 'late', TimeInterval.from_seconds(0, 0)])
+            persist_snapshot(path, snapshot)
+
+        database._persist_snapshot = persist_while_writing
+        database.checkpoint()
+        database._persist_snapshot = persist_snapshot
+
+        self.assertEqual(1, database._wal.records)
+        self.assertTrue(table.dirty)
+        self.assertTrue(database.dirty)
+        dbms.close()
+
+        loaded = DBMS.load(self.path).get_database('db').get_table('table')
+        self.assertEqual(table.rows, loaded.rows)
+
+    def test_database_snapshot(self):
+        database = Database('db')
+        database.add_table(SnapshotTest._table('row'))
+        database.add_table(SnapshotTest._table('columnar').join(SnapshotTest._table('row'), 'c1', 'joined'))
+        expected = database.to_json()
+        with database.snapshot() as snapshot:
+            database.get_table('table').append_row([10, 'a', TimeInterval.from_seconds(0, 0)])
+            database.drop_table('joined')
+            self.assertEqual(expected, snapshot.to_json())
+        self.assertEqual((), database.get_table('table')._snapshots)
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_batch(self):
+        dbms = DBMS(self.path, wal=True)
+        database = dbms.create_database('db')
+        database.add_table(Table.from_sql('table', 'c1 int,c2 str'))
+        records = database._wal.records
+        results = database.batch([('append_row', 'table', '1,a'),
+                                  ('append_row', 'table', 'x,b'),
+                                  ('update_row', 'table', '0', 'c2:c'),
+                                  ('add_table', 'other', 'c1 str'),
+                                  ('append_row', 'other', 'd'),
+                                  ('delete_row', 'table', '5')])
+        self.assertEqual(TableRow(0, [1, 'c']), database.get_table('table').get_row(0))
+        self.assertEqual(0, results[0].id)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual([None, None, 0], [results[2], results[3], results[4].id])
+        self.assertIsInstance(results[5], ValueError)
+        self.assertEqual(records + 4, database._wal.records)
+
+        with self.assertRaises(ValueError):
+            database.batch([('append_row', 'table')])
+        with self.assertRaises(ValueError):
+            database.batch([('rename_table', 'table', 'other')])
+        dbms.close()
+
+        loaded = DBMS.load(self.path, wal=True).get_database('db')
+        self.assertEqual(database.to_json(), loaded.to_json())
+
+    def test_atomic(self):
+        for storage in Table.storages:
+            database = Database('db')
+            table = Table('table', ['c1', 'c2'], ColumnTypes([int, str]), storage=storage)
+            table.append_rows([[i, str(i)] for i in range(10)])
+            table.create_index('c1')
+            database.add_table(table)
+            database.add_table(Table.from_sql('dropped', 'c1 int'))
+            self.assertEqual([3], [row.id for row in table.lookup('c1', 3)])
+            expected = database.to_json()
+            versions = database.version, table.version
+
+            with table.snapshot() as snapshot:
+                with self.assertRaises(ValueError):
+                    database.batch([('append_row', 'table', '10,a'),
+                                    ('update_row', 'table', '3', 'c1:30'),
+                                    ('delete_row', 'table', '4'),
+                                    ('drop_table', 'dropped'),
+                                    ('add_table', 'added', 'c1 int'),
+                                    ('delete_row', 'table', '4')], atomic=True)
+                self.assertEqual(expected, database.to_json())
+                self.assertEqual(versions, (database.version, table.version))
+                self.assertIs(database, database.get_table('dropped')._database)
+                self.assertEqual([3], [row.id for row in table.lookup('c1', 3)])
+
+                table.append_row([10, 'b'])
+                self.assertEqual(expected['tables']['table'], snapshot.to_json())
+            self.assertEqual([10], [row.id for row in table.lookup('c1', 10)])
+
+    def test_atomic_undo(self):
+        for storage in Table.storages:
+            database = Database('db')
+            table = Table('table', ['c1', 'c2'], ColumnTypes([int, str]), storage=storage)
+            table.append_rows([[i, str(i)] for i in range(20)])
+            table.create_index('c1', 'ordered')
+            database.add_table(table)
+            expected = table.to_json()
+            stored = table._storage
+            stored.compaction_min_tombstones = 4
+
+            operations = [('delete_row', 'table', str(i)) for i in range(15)]
+            operations += [('append_row', 'table', '20,a'), ('update_row', 'table', '16', 'c2:b'),
+                           ('delete_row', 'table', '30')]
+            with self.assertRaises(ValueError):
+                database.batch(operations, atomic=True)
+
+            self.assertIs(stored, table._storage)
+            self.assertEqual(expected, table.to_json())
+            self.assertEqual(20, table.id_counter)
+            self.assertEqual(list(range(1, 20)), [row.id for row in table.lookup_range('c1', 1)])
+            self.assertEqual([1, 2], [row.id for row in table.page(0, 2)])
+
+
+class CheckpointerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_request(self):
+        dbms = DBMS(self.path, wal=True, checkpoint_every=None)
+        database = dbms.create_database('db')
+        database.add_table(Table.from_sql('table', 'c1 int,c2 str'))
+        database.get_table('table').append_rows_str([[str(i), 'a'] for i in range(100)])
+        wal = database._wal
+        self.assertEqual(os.path.getsize(wal.path), wal.size)
+        self.assertLess(0, dbms.dirty_bytes())
+
+        checkpointer = Checkpointer(dbms, interval=None, dirty_bytes=None)
+        self.assertRaises(ValueError, checkpointer.request)
+        checkpointer.start()
+        checkpointer.request(wait=True)
+        status = checkpointer.status()
+        self.assertEqual(1, status['checkpoints'])
+        self.assertIsNone(status['last_error'])
+        self.assertLessEqual(0, status['last_duration'])
+        self.assertEqual((0, 0, 0), (wal.records, wal.size, os.path.getsize(wal.path)))
+        self.assertFalse(dbms.dirty)
+
+        persist = dbms.persist
+
+        def fail():
+            raise ValueError('disk full')
+
+        dbms.persist = fail
+        with self.assertRaises(ValueError):
+            checkpointer.request(wait=True)
+        self.assertEqual('disk full', checkpointer.status()['last_error'])
+        dbms.persist = persist
+        checkpointer.stop()
+        self.assertRaises(ValueError, checkpointer.request)
+        dbms.close()
+
+    def test_thresholds(self):
+        dbms = DBMS(self.path)
+        database = dbms.create_database('db')
+        checkpointer = Checkpointer(dbms, interval=None, dirty_bytes=1 << 10, poll_interval=0.01)
+        checkpointer.start()
+        database.add_table(Table.from_sql('table', 'c1 int'))
+        time.sleep(0.1)
+        self.assertEqual(0, checkpointer.status()['checkpoints'])
+        self.assertTrue(dbms.dirty)
+
+        database.get_table('table').append_rows([[i] for i in range(100)])
+        for _ in range(500):
+            if not dbms.dirty:
+                break
+            time.sleep(0.01)
+        self.assertFalse(dbms.dirty)
+        checkpointer.stop()
+
+        checkpointer = Checkpointer(dbms, interval=0.05, dirty_bytes=None, poll_interval=0.01)
+        checkpointer.start()
+        database.drop_table('table')
+        for _ in range(500):
+            if not dbms.dirty:
+                break
+            time.sleep(0.01)
+        checkpointer.stop()
+        self.assertEqual([], DBMS.load(self.path).get_database('db').get_tables_names())
+
+
+    def test_persist_unlocked(self):
+        dbms = DBMS(self.path)
+        dbms.create_database('db').add_table(Table.from_sql('table', 'c1 int'))
+        dbms.create_database('deleted')
+        started = threading.Event()
+        resume = threading.Event()
+        persist_database = dbms._persist_database
+
+        def blocking_persist_database(name, database):
+            started.set()
+            resume.wait(5)
+            persist_database(name, database)
+
+        dbms._persist_database = blocking_persist_database
+        thread = threading.Thread(target=dbms.persist)
+        thread.start()
+        self.assertTrue(started.wait(5))
+        dbms.create_database('created')
+        dbms.delete_database('deleted')
+        self.assertEqual(['table'], dbms.get_database('db').get_tables_names())
+        resume.set()
+        thread.join()
+
+        self.assertEqual(['db'], sorted(os.listdir(self.path)))
+        dbms._persist_database = persist_database
+        dbms.persist()
+        self.assertEqual(['created', 'db'], sorted(os.listdir(self.path)))
+
+
+class LruCacheTest(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = LruCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertEqual(2, len(cache))
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        cache.put('a', 4)
+        cache.put('d', 5)
+        self.assertEqual(4, cache.get('a'))
+        self.assertNotIn('c', cache)
+        self.assertRaises(ValueError, LruCache, 0)
+
+    def test_size(self):
+        cache = LruCache(10, len)
+        cache.put('a', 'xxxx')
+        cache.put('b', 'xxxx')
+        self.assertEqual(8, cache.size)
+        cache.put('a', 'xx')
+        self.assertEqual(6, cache.size)
+        cache.put('c', 'xxxxx')
+        self.assertEqual(['a', 'c'], list(cache._entries))
+        self.assertEqual(7, cache.size)
+        cache.put('d', 'x' * 11)
+        self.assertNotIn('d', cache)
+        cache.put('a', 'x' * 11)
+        self.assertNotIn('a', cache)
+        self.assertEqual(['c'], list(cache._entries))
+        self.assertEqual(5, cache.size)
+
+
+class BinaryFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _database(self, storage):
+        database = Database('db', file_format='binary')
+        table = Table('table1', ['c1', 'c2', 'c3', 'c4', 'c5', 'c6', 'c7', 'c8'],
+                      ColumnTypes([int, float, str, Char, Color, ColorInterval, Time, TimeInterval]), storage=storage)
+        table.append_row_str(['1', '1.5', 'str', 'a', '#0000ff', '["#000000", "#ffffff"]', '1:2:3',
+                              '["00:00:00", "23:59:59"]'])
+        table.append_row_str(['-2', '0', '\u00df\u00e4', '\u00df', '#ffffff', '["#000001", "#000002"]',
+                              '23:59:59', '["10:00:00", "11:00:00"]'])
+        table.append_row_str(['3', '2', '', 'b', '#000000', '["#000001", "#000002"]', '0:0:0',
+                              '["10:00:00", "11:00:00"]'])
+        table.delete_row(2)
+        table.create_index('c1', 'ordered')
+        database.add_table(table)
+        database.add_table(Table('table2', ['c1'], ColumnTypes([str]), storage=storage))
+        return database
+
+    def test_round_trip(self):
+        for storage in Table.storages:
+            database = self._database(storage)
+            path = os.path.join(self.path, storage)
+            database.persist(path)
+
+            loaded = Database.load(path)
+            self.assertEqual('binary', loaded.file_format)
+            self.assertTrue(loaded.get_table('table1')._storage.mapped)
+            self.assertEqual(database.to_json(), loaded.to_json())
+            self.assertEqual(storage, loaded.get_table('table1').storage)
+            self.assertEqual(3, loaded.get_table('table1').id_counter)
+            self.assertEqual([TableRow(1, database.get_table('table1').get_row(1).data)],
+                             loaded.get_table('table1').lookup_range('c1', high=0))
+
+    def test_statistics(self):
+        path = os.path.join(self.path, 'db')
+        self._database('row').persist(path)
+        table = Database.load(path).get_table('table1')
+
+        self.assertEqual((-2, 1), table.column_statistics('c1'))
+        self.assertEqual((Time('1:2:3'), Time('23:59:59')), table.column_statistics('c7'))
+        self.assertEqual((Color('#0000ff'), Color('#ffffff')), table.column_statistics('c5'))
+        self.assertIsNone(table.column_statistics('c3'))
+        table.delete_row(0)
+        self.assertIsNone(table.column_statistics('c1'))
+
+    def test_mutate_mapped(self):
+        for storage in Table.storages:
+            path = os.path.join(self.path, storage)
+            self._database(storage).persist(path)
+            database = Database.load(path)
+            table = database.get_table('table1')
+
+            table.update_row_sql(1, 'c3:updated')
+            table.append_row_str(['4', '4', 'new', 'c', '#000000', '["#000001", "#000002"]', '0:0:0',
+                                  '["10:00:00", "11:00:00"]'])
+            table.delete_row(0)
+            self.assertFalse(table._storage.mapped)
+            self.assertIs(Table.storages[storage], type(table._storage))
+            database.persist(path)
+
+            self.assertEqual(['updated', 'new'], Database.load(path).get_table('table1').column_values('c3'))
+
+    def test_wide_ints(self):
+        path = os.path.join(self.path, 'db')
+        database = Database('db', file_format='binary')
+        table = Table('table', ['c1', 'c2'], ColumnTypes([int, str]))
+        table.append_rows([[2 ** 70, 'a'], [1, 'b'], [-2 ** 70, 'c']])
+        database.add_table(table)
+        database.persist(path)
+
+        loaded = Database.load(path).get_table('table')
+        self.assertEqual(table.rows, loaded.rows)
+        self.assertEqual((-2 ** 70, 2 ** 70), loaded.column_statistics('c1'))
+        loaded.update_row_sql(1, 'c1:' + str(2 ** 65))
+        self.assertEqual([2 ** 70, 2 ** 65, -2 ** 70], loaded.column_values('c1'))
+
+    def test_reuse_clean_tables(self):
+        path = os.path.join(self.path, 'db')
+        self._database('row').persist(path)
+        database = Database.load(path)
+        expected = database.get_table('table1').to_json()
+        database.get_table('table2').append_row(['x'])
+
+        copy_section = BinaryFormat._copy_section
+        copied = list()
+
+        def counting_copy_section(read_stream, write_stream, location):
+            copied.append(location)
+            return copy_section(read_stream, write_stream, location)
+
+        BinaryFormat._copy_section = staticmethod(counting_copy_section)
+        try:
+            database.persist(path)
+        finally:
+            BinaryFormat._copy_section = staticmethod(copy_section)
+        self.assertEqual(12, len(copied))
+
+        loaded = Database.load(path)
+        self.assertEqual(expected, loaded.get_table('table1').to_json())
+        self.assertEqual(['x'], loaded.get_table('table2').column_values('c1'))
+        self.assertEqual((-2, 1), loaded.get_table('table1').column_statistics('c1'))
+
+    def test_dbms(self):
+        data_path = os.path.join(self.path, 'data')
+        dbms = DBMS(data_path, file_format='binary')
+        dbms.create_database('db').add_table(Table('table', ['c1'], ColumnTypes([int])))
+        dbms.get_database('db').get_table('table').append_row([1])
+        dbms.persist()
+        expected = dbms.get_database('db').to_json()
+
+        dbms.get_database('db').export_json(os.path.join(self.path, 'db.json'))
+        with open(os.path.join(self.path, 'db.json')) as read_stream:
+            self.assertEqual(expected, json.load(read_stream))
+        self.assertEqual(expected, DBMS.load(data_path).get_database('db').to_json())
+
+        json_dbms = DBMS.load(data_path)
+        self.assertTrue(json_dbms.get_database('db').dirty)
+        json_dbms.persist()
+        self.assertEqual('json', DBMS.load(data_path).get_database('db').file_format)
+        self.assertEqual(expected, DBMS.load(data_path).get_database('db').to_json())
+
+
+class JsonStreamReaderTest(unittest.TestCase):
+
+    def _database(self, storage):
+        database = Database('db')
+        table = Table('table1', ['c1', 'c2', 'c3', 'c4', 'c5', 'c6'],
+                      ColumnTypes([int, float, str, Char, ColorInterval, Time]), storage=storage)
+        for i in range(50):
+            table.append_row_str([str(i * 12345), str(i / 7), 'str \u00df "' + str(i), 'a',
+                                  '["#000000", "#ffffff"]', '1:2:3'])
+        table.delete_row(3)
+        database.add_table(table)
+        database.add_table(Table('table2', ['c1'], ColumnTypes([str]), storage=storage))
+        database._lsn = 12
+        return database
+
+    def test_read_database(self):
+        for storage in Table.storages:
+            database = self._database(storage)
+            text = json.dumps(database.to_json(), indent=4)
+            expected = Database.from_json(json.loads(text))
+            for chunk_size in (1, 7, 1 << 16):
+                for batch_size in (1, 16, 1000):
+                    reader = JsonStreamReader(io.StringIO(text), batch_size)
+                    reader.chunk_size = chunk_size
+                    result = reader.read_database()
+                    self.assertEqual(expected.to_json(), result.to_json())
+                    self.assertEqual(12, result._lsn)
+                    for name in expected.get_tables_names():
+                        self.assertEqual(expected.get_table(name).id_counter, result.get_table(name).id_counter)
+                        self.assertEqual(storage, result.get_table(name).storage)
+                        self.assertIs(result, result.get_table(name)._database)
+
+    def test_read_database_any_key_order(self):
+        text = '{"tables": {"t": {"rows": [{"id": 4, "data": ["x"]}], "columns_types": ["str"], ' \
+               '"column_names": ["c1"], "name": "t"}}, "extra": [1, {"a": 2}], "name": "db"}'
+        result = JsonStreamReader(io.StringIO(text)).read_database()
+        self.assertEqual('db', result.name)
+        self.assertEqual(5, result.get_table('t').id_counter)
+        self.assertEqual(Database.from_json(json.loads(text)).to_json(), result.to_json())
+
+    def test_malformed(self):
+        for text in ('', '{"name": "db"', '{"name": "db" "tables": {}}', '[]', '{"tables": {"t": {"rows": [1 2]}}}'):
+            with self.assertRaises(ValueError):
+                JsonStreamReader(io.StringIO(text)).read_database()
+
+    def test_load(self):
+        path = tempfile.mkdtemp()
+        threshold = Database.streaming_threshold
+        try:
+            database = self._database('columnar')
+            database.persist(os.path.join(path, 'db'))
+            Database.streaming_threshold = 0
+            self.assertEqual(database.to_json(), Database.load(os.path.join(path, 'db')).to_json())
+        finally:
+            Database.streaming_threshold = threshold
+            shutil.rmtree(path)
+
+
+class WriteAheadLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _populate(self, dbms: DBMS):
+        database = dbms.create_database('db')
+        table1 = Table('table1', ['c1', 'c2'], ColumnTypes([int, Time]))
+        table1.append_row([5, Time('1:0:0')])
+        database.add_table(table1)
+        table1.create_index('c2', 'ordered')
+        database.add_table(Table('table2', ['c1'], ColumnTypes([str]), storage='columnar'))
+        database.add_table(Table('table3', ['c1'], ColumnTypes([str])))
+
+        for i in range(10):
+            table1.append_row([i, Time('2:0:0')])
+            database.get_table('table2').append_row_str([str(i)])
+        table1.append_rows_str([['20', '3:0:0'], ['21', '4:0:0']])
+        table1.update_row_sql(3, 'c1:33')
+        table1.delete_row(4)
+        database.get_table('table2').delete_row(0)
+        database.drop_table('table3')
+        return database
+
+    def test_replay(self):
+        dbms = DBMS(self.path, wal=True)
+        database = self._populate(dbms)
+        dbms.close()
+
+        self.assertEqual(['db', 'db.wal'], sorted(os.listdir(self.path)))
+        loaded = DBMS.load(self.path, wal=True)
+        loaded_database = loaded.get_database('db')
+        self.assertEqual(database.to_json(), loaded_database.to_json())
+
+        loaded_database.get_table('table1').append_row([100, Time('3:0:0')])
+        self.assertEqual([100, Time('3:0:0')], loaded_database.get_table('table1').get_row(13).data)
+        loaded.close()
+
+        self.assertEqual(loaded_database.to_json(), DBMS.load(self.path).get_database('db').to_json())
+
+    def test_checkpoint(self):
+        dbms = DBMS(self.path, wal=True, sync_every=4, checkpoint_every=5)
+        database = self._populate(dbms)
+        dbms.close()
+
+        wal_path = os.path.join(self.path, 'db' + WriteAheadLog.suffix)
+        self.assertLess(len(list(WriteAheadLog.read(wal_path))), 5)
+        with open(wal_path, 'a') as write_stream:
+            write_stream.write('[1000, "append_row", "tab')
+
+        self.assertEqual(database.to_json(), DBMS.load(self.path).get_database('db').to_json())
+
+    def test_delete_database(self):
+        dbms = DBMS(self.path, wal=True)
+        self._populate(dbms)
+        dbms.delete_database('db')
+        self.assertEqual([], os.listdir(self.path))
+        self.assertRaises(ValueError, dbms.create_database, 'db.wal')
+
+    def test_torn_tail(self):
+        dbms = DBMS(self.path, wal=True)
+        dbms.create_database('db').add_table(Table.from_sql('table', 'c1 int'))
+        dbms.get_database('db').get_table('table').append_row([1])
+        dbms.close()
+        wal_path = os.path.join(self.path, 'db') + WriteAheadLog.suffix
+        with open(wal_path, 'a') as write_stream:
+            write_stream.write('[9,"append_row","table",1,["')
+
+        loaded = DBMS.load(self.path, wal=True)
+        table = loaded.get_database('db').get_table('table')
+        self.assertEqual([[1]], [row.data for row in table.rows])
+        table.append_row([2])
+        table.append_row([3])
+        loaded.close()
+
+        reloaded = DBMS.load(self.path, wal=True)
+        self.assertEqual([[1], [2], [3]], [row.data for row in reloaded.get_database('db').get_table('table').rows])
+        reloaded.close()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,22 @@
+import sys
+
 import graphene
 from graphene import Field
-from database import DBMS, Table, TableRow
+from graphql_relay.connection.arrayconnection import cursor_to_offset, offset_to_cursor
+from database import DBMS, LruCache
 
 from flask import Flask
 from flask_graphql import GraphQLView
 
-_dbms = DBMS.load()
+_dbms = DBMS.load(lazy=True)
+
+
+def _rows_size(entry) -> int:
+    return sum(sys.getsizeof(row.data) + sum(map(sys.getsizeof, row.data)) for row in entry[1])
+
+
+# one entry per query holding the version and rows selected last, bounded by the size of the rows
+_rows_cache = LruCache(64 << 20, _rows_size)
 
 
 class TableRowType(graphene.ObjectType):
@@ -13,11 +24,81 @@ class TableRowType(graphene.ObjectType):
     data = graphene.List(graphene.String)
 
 
+class TableRowConnection(graphene.relay.Connection):
+    class Meta:
+        node = TableRowType
+
+
+def _to_row_types(rows) -> list:
+    return list(map(lambda row: TableRowType(id=row.id, data=list(map(str, row.data))), rows))
+
+
+def _select_rows(table, columns, where, order_by, limit, offset):
+    with table.snapshot() as snapshot:
+        # whole tables are not kept, nor join results, which get a new version every time they are built
+        if limit is None or table._database is None:
+            return _to_row_types(snapshot.select(columns, None if where is None else table.parse_where(where),
+                                                 order_by, limit, offset))
+        key = (table._database.name, table.name, 'rows', None if columns is None else tuple(columns), where,
+               None if order_by is None else tuple(order_by), limit, offset)
+        entry = _rows_cache.get(key)
+        if entry is None or entry[0] != snapshot.version:
+            rows = snapshot.select(columns, None if where is None else table.parse_where(where), order_by, limit,
+                                   offset)
+            entry = (snapshot.version, _to_row_types(rows))
+            _rows_cache.put(key, entry)
+    return entry[1]
+
+
+# resolvers run against the live Table, so a query only pays for the fields it asks for
 class TableType(graphene.ObjectType):
     name = graphene.String()
     column_names = graphene.List(graphene.String)
     column_types = graphene.List(graphene.String)
-    rows = graphene.List(TableRowType)
+    rows = graphene.List(TableRowType,
+                         columns=graphene.List(graphene.String, required=False),
+                         where=graphene.String(required=False),
+                         order_by=graphene.List(graphene.String, required=False),
+                         limit=graphene.Int(required=False),
+                         offset=graphene.Int(required=False))
+    rows_connection = Field(TableRowConnection,
+                            columns=graphene.List(graphene.String, required=False),
+                            where=graphene.String(required=False),
+                            order_by=graphene.List(graphene.String, required=False),
+                            first=graphene.Int(required=False),
+                            after=graphene.String(required=False))
+
+    def resolve_name(self, info):
+        return self.name
+
+    def resolve_column_names(self, info):
+        return self.columns_names
+
+    def resolve_column_types(self, info):
+        return self.columns_types.to_json()
+
+    def resolve_rows(self, info, columns=None, where=None, order_by=None, limit=None, offset=0):
+        return _select_rows(self, columns, where, order_by, limit, offset)
+
+    def resolve_rows_connection(self, info, columns=None, where=None, order_by=None, first=None, after=None):
+        if first is not None and first < 0:
+            raise ValueError(f'Invalid first {first}')
+        offset = 0
+        if after is not None:
+            offset = cursor_to_offset(after)
+            if offset is None:
+                raise ValueError(f'Invalid cursor {after}')
+            offset += 1
+        # one extra row tells whether there is a next page
+        rows = _select_rows(self, columns, where, order_by, None if first is None else first + 1, offset)
+        has_next_page = first is not None and len(rows) > first
+        edges = [TableRowConnection.Edge(node=row, cursor=offset_to_cursor(offset + i))
+                 for i, row in enumerate(rows[:first])]
+        return TableRowConnection(edges=edges, page_info=graphene.relay.PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=offset > 0,
+            has_next_page=has_next_page))
 
 
 class Query(graphene.ObjectType):
@@ -32,9 +113,31 @@ class Query(graphene.ObjectType):
                         num_rows=graphene.Int(),
                         result_table_name=graphene.String(required=False))
 
+    lookup_rows = graphene.List(TableRowType,
+                                database=graphene.String(),
+                                table=graphene.String(),
+                                column_name=graphene.String(),
+                                value=graphene.String(required=False),
+                                low=graphene.String(required=False),
+                                high=graphene.String(required=False),
+                                contains=graphene.String(required=False),
+                                overlaps=graphene.String(required=False))
+
+    def resolve_lookup_rows(self, info, database, table, column_name, value=None, low=None, high=None,
+                            contains=None, overlaps=None):
+        table = _dbms.get_database(database).get_table(table)
+        # lookups read under the table lock, so holding it pins the version they see
+        with table.lock.read():
+            key = (database, table.name, 'lookup', column_name, value, low, high, contains, overlaps)
+            entry = _rows_cache.get(key)
+            if entry is None or entry[0] != table.version:
+                entry = (table.version, _to_row_types(table.lookup_str(column_name, value, low, high, contains,
+                                                                       overlaps)))
+                _rows_cache.put(key, entry)
+        return entry[1]
+
     def resolve_table(self, info, database, table):
-        return Query.form_table_type(
-            _dbms.get_database(database).get_table(table).to_json())
+        return _dbms.get_database(database).get_table(table)
 
     def resolve_join_tables(self,
                             info,
@@ -42,27 +145,12 @@ class Query(graphene.ObjectType):
                             table1,
                             table2,
                             column_name,
+                            num_rows=None,
                             result_table_name=None):
         database = _dbms.get_database(database)
         table1 = database.get_table(table1)
         table2 = database.get_table(table2)
-        result_table = table1.join(table2, column_name, result_table_name)
-
-        return Query.form_table_type(result_table.to_json())
-
-    @staticmethod
-    def form_table_type(table_json):
-        return TableType(
-            name=table_json[Table.name_field],
-            column_names=table_json[Table.columns_names_field],
-            column_types=table_json[Table.columns_types_field],
-            rows=list(
-                map(lambda row_json:
-                    TableRowType(id=row_json[TableRow.id_field],
-                                 data=row_json[TableRow.data_field]),
-                    table_json[Table.rows_field])
-            ),
-        )
+        return table1.join(table2, column_name, result_table_name, limit=num_rows)
 
 
 schema = graphene.Schema(query=Query)
@@ -80,4 +168,4 @@ app.add_url_rule(
 )
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    app.run(debug=True, threaded=True)
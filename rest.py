@@ -1,24 +1,43 @@
+import csv
+import io
+import json
+import os
 import traceback
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 
 from flask_restful import Resource, Api
 
-from database import DBMS, Table
+from database import Checkpointer, DBMS, LruCache, Table, TableRow, TableSnapshot
 
 app = Flask(__name__)
 api = Api(app)
 
-_dbms = DBMS.load()
+# checkpoints run on the background checkpointer instead of the request that crosses the threshold
+_dbms = DBMS.load(wal=True, checkpoint_every=None, lazy=True, file_format='binary')
+_checkpointer = Checkpointer(_dbms)
+_checkpointer.start()
+_page_size = 100
+_stream_chunk_size = 1000
+_ndjson_mimetype = 'application/x-ndjson'
+_etag_prefix = os.urandom(4).hex()
+# one entry per resource holding the ETag and body of the version served last, bounded by the size of the bodies
+_response_cache = LruCache(64 << 20, lambda entry: len(entry[1]))
 
 
 class SaveResource(Resource):
 
+    def get(self):
+        return _checkpointer.status()
+
     def post(self):
         try:
             print("POST TO SAVE")
-            _dbms.persist()
-            return {'message': 'Databases saved successfully'}
+            if request.args.get('wait') == 'true':
+                _checkpointer.request(wait=True)
+                return {'message': 'Databases saved successfully'}
+            _checkpointer.request()
+            return {'message': 'Databases save scheduled'}, 202
         except Exception as e:
             raise InvalidUsage(str(e), 400)
 
@@ -30,10 +49,34 @@ class DatabaseResource(Resource):
         return _dbms.get_databases_names()
 
 
+def _etag(version: int) -> str:
+    return f'{_etag_prefix}-{version}'
+
+
+def _not_modified(etag: str) -> Response:
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def _json_response(key: tuple, etag: str, serialize) -> Response:
+    entry = _response_cache.get(key)
+    if entry is None or entry[0] != etag:
+        entry = (etag, json.dumps(serialize()))
+        _response_cache.put(key, entry)
+    response = Response(entry[1], mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+
 class DatabaseNameResource(Resource):
     def get(self, database_name):
         try:
-            return _dbms.get_database(database_name).to_json()
+            with _dbms.get_database(database_name).snapshot() as snapshot:
+                etag = _etag(snapshot.version)
+                if etag in request.if_none_match:
+                    return _not_modified(etag)
+                return _json_response((database_name,), etag, snapshot.to_json)
         except Exception as e:
             raise InvalidUsage(str(e), 400)
 
@@ -58,10 +101,67 @@ class TableResource(Resource):
         return _dbms.get_database(database_name).get_tables_names()
 
 
+def _table_header(table) -> dict:
+    return {Table.name_field: table.name,
+            Table.columns_names_field: table.columns_names,
+            Table.columns_types_field: table.columns_types.to_json()}
+
+
+def _stream_table(snapshot: TableSnapshot, after_id, limit):
+    # every chunk comes from the same version of the table, however long the client takes to read
+    with snapshot:
+        yield json.dumps(_table_header(snapshot)) + '\n'
+        while limit is None or limit > 0:
+            rows = snapshot.page(after_id, _stream_chunk_size if limit is None else min(limit, _stream_chunk_size))
+            if not rows:
+                break
+            yield ''.join(json.dumps(row.to_json()) + '\n' for row in rows)
+            after_id = rows[-1].id
+            if limit is not None:
+                limit -= len(rows)
+
+
+def _table_page(snapshot: TableSnapshot, after_id, limit: int) -> dict:
+    rows = snapshot.page(after_id, limit)
+    result = _table_header(snapshot)
+    result[Table.rows_field] = [row.to_json() for row in rows]
+    result['next_after_id'] = rows[-1].id if rows and len(rows) == limit else None
+    return result
+
+
 class TableNameResource(Resource):
     def get(self, database_name, table_name):
         try:
-            return _dbms.get_database(database_name).get_table(table_name).to_json()
+            table = _dbms.get_database(database_name).get_table(table_name)
+            after_id = request.args.get('after_id')
+            after_id = None if after_id is None else int(after_id)
+            limit = request.args.get('limit')
+            limit = None if limit is None else int(limit)
+            if limit is not None and limit < 0:
+                raise ValueError(f'Invalid limit {limit}')
+            stream = request.args.get('stream') == 'true' or request.accept_mimetypes.best == _ndjson_mimetype
+            # the ETag names the version that is actually served, not whatever the table holds by then
+            snapshot = table.snapshot()
+            try:
+                etag = _etag(snapshot.version) + ('-ndjson' if stream else '')
+                if etag in request.if_none_match:
+                    return _not_modified(etag)
+                if stream:
+                    response = Response(stream_with_context(_stream_table(snapshot, after_id, limit)),
+                                        mimetype=_ndjson_mimetype)
+                    response.set_etag(etag)
+                    # a response that is closed before it was read still lets go of the snapshot
+                    response.call_on_close(snapshot.release)
+                    snapshot = None
+                    return response
+                if after_id is None and limit is None:
+                    return _json_response((database_name, table_name), etag, snapshot.to_json)
+                limit = _page_size if limit is None else limit
+                return _json_response((database_name, table_name, after_id, limit), etag,
+                                      lambda: _table_page(snapshot, after_id, limit))
+            finally:
+                if snapshot is not None:
+                    snapshot.release()
         except Exception as e:
             raise InvalidUsage(str(e), 400)
 
@@ -85,11 +185,40 @@ class TableNameResource(Resource):
             raise InvalidUsage(str(e), 400)
 
 
+class IndexResource(Resource):
+    def get(self, database_name, table_name):
+        try:
+            return _dbms.get_database(database_name).get_table(table_name).get_indexes()
+        except Exception as e:
+            raise InvalidUsage(str(e), 400)
+
+    def post(self, database_name, table_name):
+        try:
+            _dbms.get_database(database_name).get_table(table_name).create_index(request.args.get('column_name'),
+                                                                                 request.args.get('kind', 'hash'))
+            return {'message': 'Index created successfully'}
+        except Exception as e:
+            raise InvalidUsage(str(e), 400)
+
+    def delete(self, database_name, table_name):
+        try:
+            _dbms.get_database(database_name).get_table(table_name).drop_index(request.args.get('column_name'))
+            return {'message': 'Index deleted successfully'}
+        except Exception as e:
+            raise InvalidUsage(str(e), 400)
+
+
 class RowResource(Resource):
     def get(self, database_name, table_name):
         try:
-            return _dbms.get_database(database_name).get_table(table_name) \
-                .get_row(int(request.args.get('row_id'))).to_json()
+            table = _dbms.get_database(database_name).get_table(table_name)
+            column_name = request.args.get('column_name')
+            if column_name is None:
+                return table.get_row(int(request.args.get('row_id'))).to_json()
+            return [row.to_json() for row in table.lookup_str(column_name, request.args.get('value'),
+                                                              request.args.get('low'), request.args.get('high'),
+                                                              request.args.get('contains'),
+                                                              request.args.get('overlaps'))]
         except Exception as e:
             raise InvalidUsage(str(e), 400)
 
@@ -118,6 +247,84 @@ class RowResource(Resource):
             raise InvalidUsage(str(e), 400)
 
 
+class RowsResource(Resource):
+    def post(self, database_name, table_name):
+        try:
+            table = _dbms.get_database(database_name).get_table(table_name)
+            stream = io.TextIOWrapper(request.stream, encoding='utf-8')
+            if request.mimetype == 'text/csv':
+                rows = [row for row in csv.reader(stream) if row]
+            else:
+                rows = [json.loads(line) for line in stream if line.strip()]
+            appended = table.append_rows_str(rows)
+            return {'message': 'Table rows created successfully',
+                    'count': len(appended),
+                    'first_id': appended[0].id if appended else None}
+        except Exception as e:
+            raise InvalidUsage(str(e), 400)
+
+
+class QueryResource(Resource):
+    def get(self, database_name, table_name):
+        try:
+            table = _dbms.get_database(database_name).get_table(table_name)
+            with table.snapshot() as snapshot:
+                etag = _etag(snapshot.version)
+                if etag in request.if_none_match:
+                    return _not_modified(etag)
+                columns = request.args.get('columns')
+                where = request.args.get('where')
+                order_by = request.args.get('order_by')
+                limit = request.args.get('limit')
+
+                def serialize():
+                    rows = snapshot.select(None if columns is None else columns.split(','),
+                                           None if where is None else table.parse_where(where),
+                                           None if order_by is None else order_by.split(','),
+                                           None if limit is None else int(limit),
+                                           int(request.args.get('offset', 0)))
+                    return {Table.columns_names_field: table.columns_names if columns is None else columns.split(','),
+                            Table.rows_field: [row.to_json() for row in rows]}
+
+                return _json_response((database_name, table_name, request.query_string), etag, serialize)
+        except Exception as e:
+            raise InvalidUsage(str(e), 400)
+
+
+_batch_arguments = {'add_table': ('sql',), 'drop_table': (), 'append_row': ('row_data',),
+                    'update_row': ('row_id', 'row_data'), 'delete_row': ('row_id',)}
+
+
+def _batch_result(result) -> dict:
+    if isinstance(result, Exception):
+        return {'ok': False, 'message': str(result)}
+    if isinstance(result, TableRow):
+        return {'ok': True, 'row': result.to_json()}
+    return {'ok': True}
+
+
+class BatchResource(Resource):
+    def post(self):
+        try:
+            body = request.get_json(force=True)
+            operations = list()
+            for operation in body['operations']:
+                name = operation.get('operation')
+                if name not in _batch_arguments:
+                    raise ValueError(f'Unknown batch operation {name}; expected one of {list(_batch_arguments)}')
+                operations.append((name, operation['table'], *(operation[key] for key in _batch_arguments[name])))
+            atomic = body.get('atomic', False)
+            if atomic in ('true', 'false'):
+                atomic = atomic == 'true'
+            if not isinstance(atomic, bool):
+                raise ValueError(f'Invalid value {atomic!r} for atomic; expected true or false')
+            results = _dbms.get_database(body['database']).batch(operations, atomic)
+            return {'message': 'Batch executed successfully',
+                    'results': [_batch_result(result) for result in results]}
+        except Exception as e:
+            raise InvalidUsage(str(e), 400)
+
+
 class InvalidUsage(Exception):
     status_code = 400
 
@@ -149,11 +356,15 @@ def after_request(response):
 
 
 api.add_resource(SaveResource, '/rest/save')
+api.add_resource(BatchResource, '/rest/batch')
 api.add_resource(DatabaseResource, '/rest/database')
 api.add_resource(DatabaseNameResource, '/rest/database/<database_name>')
 api.add_resource(TableResource, '/rest/database/<database_name>/table')
 api.add_resource(TableNameResource, '/rest/database/<database_name>/table/<table_name>')
+api.add_resource(IndexResource, '/rest/database/<database_name>/table/<table_name>/index')
 api.add_resource(RowResource, '/rest/database/<database_name>/table/<table_name>/row')
+api.add_resource(RowsResource, '/rest/database/<database_name>/table/<table_name>/rows')
+api.add_resource(QueryResource, '/rest/database/<database_name>/table/<table_name>/query')
 
 if __name__ == '__main__':
-    app.run(debug=True, port=6000)
+    app.run(debug=True, port=6000, threaded=True)
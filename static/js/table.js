@@ -21,38 +21,71 @@ $(document).ready(function () {
         $('#table tbody').append(table_row.join(''))
     }
 
-    $.ajax({
-        url: restUrl + '/rest' + window.location.pathname,
-        type: 'GET',
-        success: function (response) {
-            console.log(response);
-
-            var headRow = [];
-            headRow.push('<tr>');
+    const pageSize = 100;
+    var nextAfterId = null;
+    var loading = false;
+    var exhausted = false;
+
+    function appendHead(response) {
+        var headRow = [];
+        headRow.push('<tr>');
+        headRow.push('<th scope="col">');
+        headRow.push('id');
+        headRow.push('</th>');
+        for (var i = 0; i < response.column_names.length; ++i) {
             headRow.push('<th scope="col">');
-            headRow.push('id');
+            headRow.push(response.column_names[i]);
+            headRow.push(':');
+            headRow.push(response.columns_types[i]);
             headRow.push('</th>');
-            for (var i = 0; i < response.column_names.length; ++i) {
-                console.log(i);
-                headRow.push('<th scope="col">');
-                headRow.push(response.column_names[i]);
-                headRow.push(':');
-                headRow.push(response.columns_types[i]);
-                headRow.push('</th>');
+        }
+        headRow.push('</tr>');
+        $('#table thead').append(headRow.join(''));
+    }
+
+    function loadPage() {
+        if (loading || exhausted) {
+            return;
+        }
+        loading = true;
+        var url = restUrl + '/rest' + window.location.pathname + '?limit=' + pageSize;
+        if (nextAfterId !== null) {
+            url += '&after_id=' + nextAfterId;
+        }
+
+        $.ajax({
+            url: url,
+            type: 'GET',
+            success: function (response) {
+                if ($('#table thead tr').length === 0) {
+                    appendHead(response);
+                }
+                $.each(response.rows, function (index, row) {
+                    appendRow(row)
+                });
+                nextAfterId = response.next_after_id;
+                exhausted = nextAfterId === null;
+                loading = false;
+                if (!exhausted && $(document).height() <= $(window).height()) {
+                    loadPage();
+                }
+            },
+            error: function (error) {
+                console.log(error);
+                loading = false;
+                $('#error_alert').text(error.responseJSON.message).show();
             }
-            headRow.push('</tr>');
-            $('#table thead').append(headRow.join(''));
-
-            $.each(response.rows, function (index, row) {
-                appendRow(row)
-            });
-        },
-        error: function (error) {
-            console.log(error);
-            $('#error_alert').text(error.responseJSON.message).show();
+        });
+    }
+
+    $(window).scroll(function () {
+        if ($(window).scrollTop() + $(window).height() >= $(document).height() - 200) {
+            loadPage();
         }
     });
 
+    loadPage();
+
     $('#create_row').click(function () {
         const row_data = $('#create_row_data').val();
 
@@ -62,7 +95,9 @@ $(document).ready(function () {
             success: function (response) {
                 console.log(response);
                 $('#success_alert').text(response.message).show();
-                appendRow(response.row);
+                if (exhausted) {
+                    appendRow(response.row);
+                }
             },
             error: function (error) {
                 console.log(error);